@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from passlib.context import CryptContext
+
+
+class HasherBusy(RuntimeError):
+    """
+    Raised when too many hash operations are already queued.
+    """
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded thread pool.
+    bcrypt releases the GIL while it works, so threads give real parallelism
+    and the event loop stays free to serve other requests. At most
+    `max_pending` operations may be running or queued; beyond that calls
+    fail fast with HasherBusy instead of building an unbounded backlog.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int = 4, max_pending: int = 64):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy("Too many password operations in progress")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hasher")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified access tokens.
+    Maps a token to the user it authenticates until the token's exp claim,
+    so repeat requests with the same token skip JWT verification and the
+    user lookup. invalidate_user() drops the entries of a user whose
+    credentials or role changed; nothing else bounds how stale they get.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[Any]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            self._discard(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: Any, expires_at: float):
+        if token in self._entries:
+            self._discard(token)
+        self._entries[token] = (expires_at, user)
+        self._tokens_by_user.setdefault(user.username, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, username: str):
+        for token in self._tokens_by_user.pop(username, ()):
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def _discard(self, token: str):
+        _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.username]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
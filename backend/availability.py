@@ -0,0 +1,79 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+# Dates are ISO "YYYY-MM-DD" strings, which sort the same way as the dates
+# they represent. A stay occupies the half-open range [check_in, check_out).
+
+
+class RoomIntervals:
+    """
+    Bookings of one room as parallel arrays sorted by check-in date.
+    Intervals are assumed not to overlap (the API rejects conflicting
+    bookings), so the only booking that can overlap [a, b) is the last one
+    starting before b, which bisect finds in O(log n).
+    """
+
+    __slots__ = ("starts", "ends", "booking_ids")
+
+    def __init__(self):
+        self.starts: List[str] = []
+        self.ends: List[str] = []
+        self.booking_ids: List[str] = []
+
+    def is_free(self, check_in: str, check_out: str) -> bool:
+        i = bisect_left(self.starts, check_out)
+        return i == 0 or self.ends[i - 1] <= check_in
+
+    def add(self, check_in: str, check_out: str, booking_id: str):
+        i = bisect_right(self.starts, check_in)
+        self.starts.insert(i, check_in)
+        self.ends.insert(i, check_out)
+        self.booking_ids.insert(i, booking_id)
+
+    def remove(self, check_in: str, booking_id: str) -> bool:
+        i = bisect_left(self.starts, check_in)
+        while i < len(self.starts) and self.starts[i] == check_in:
+            if self.booking_ids[i] == booking_id:
+                del self.starts[i], self.ends[i], self.booking_ids[i]
+                return True
+            i += 1
+        return False
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class AvailabilityIndex:
+    """
+    Per-room interval index over confirmed bookings.
+    """
+
+    def __init__(self):
+        self._rooms: Dict[str, RoomIntervals] = {}
+
+    def add(self, room_id: str, check_in: str, check_out: str, booking_id: str):
+        intervals = self._rooms.get(room_id)
+        if intervals is None:
+            intervals = self._rooms[room_id] = RoomIntervals()
+        intervals.add(check_in, check_out, booking_id)
+
+    def remove(self, room_id: str, check_in: str, booking_id: str) -> bool:
+        intervals = self._rooms.get(room_id)
+        return intervals is not None and intervals.remove(check_in, booking_id)
+
+    def is_free(self, room_id: str, check_in: str, check_out: str) -> bool:
+        intervals = self._rooms.get(room_id)
+        return intervals is None or intervals.is_free(check_in, check_out)
+
+    def free_rooms(self, room_ids: Iterable[str], check_in: str, check_out: str) -> List[str]:
+        rooms = self._rooms
+        return [
+            room_id for room_id in room_ids
+            if room_id not in rooms or rooms[room_id].is_free(check_in, check_out)
+        ]
+
+    def bookings(self, room_id: str) -> List[Tuple[str, str, str]]:
+        intervals = self._rooms.get(room_id)
+        if intervals is None:
+            return []
+        return list(zip(intervals.starts, intervals.ends, intervals.booking_ids))
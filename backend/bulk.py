@@ -0,0 +1,182 @@
+"""
+Streaming NDJSON and CSV for bulk booking import and export.
+
+Everything here works on async iterators and holds at most one batch of
+rows, so memory use does not grow with the size of the file:
+
+    rows = read_rows(request.stream(), "csv")       # (row number, dict or error)
+    async for batch in batched(rows, 500): ...
+
+    StreamingResponse(write_rows(bookings, "ndjson", fields))
+"""
+import codecs
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# Longest accepted line; longer input is reported as an error and the import stops
+MAX_LINE_LENGTH = 1 << 16
+
+T = TypeVar("T")
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def bulk_format(explicit: Optional[str], content_type: Optional[str] = None) -> str:
+    """The format named by `explicit`, else by the Content-Type, else NDJSON."""
+    if explicit:
+        if explicit not in FORMATS:
+            raise BulkFormatError(f"Unknown format {explicit!r}, expected one of: {', '.join(FORMATS)}")
+        return explicit
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    for name, known in FORMATS.items():
+        if media_type == known:
+            return name
+    return "ndjson"
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream (UTF-8, optional BOM) into lines without their line ending."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        # Split on \n only: str.splitlines would also break on characters
+        # such as U+2028 that JSON strings and CSV fields may contain
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        if len(pending) > MAX_LINE_LENGTH:
+            raise BulkFormatError(f"Line longer than {MAX_LINE_LENGTH} characters")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def _csv_records(lines: AsyncIterator[str]) -> AsyncIterator[List[str]]:
+    # A quoted field may span lines: keep joining until the quotes balance
+    record = None
+    async for line in lines:
+        record = line if record is None else record + "\n" + line
+        if record.count('"') % 2:
+            if len(record) > MAX_LINE_LENGTH:
+                raise BulkFormatError(f"Unterminated quoted field longer than {MAX_LINE_LENGTH} characters")
+            continue
+        yield next(csv.reader([record]))
+        record = None
+    if record is not None:
+        yield next(csv.reader([record]))
+
+
+async def read_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Row]:
+    """
+    Rows of an NDJSON or CSV (with a header line) stream as
+    (row number, fields, None), or (row number, None, error) for rows
+    that cannot be parsed. Blank lines are skipped and not numbered.
+    """
+    lines = read_lines(chunks)
+    number = 0
+    if fmt == "ndjson":
+        async for line in lines:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield number, None, "Expected a JSON object"
+                continue
+            yield number, row, None
+        return
+
+    header = None
+    async for values in _csv_records(lines):
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        number += 1
+        if len(values) != len(header):
+            yield number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield number, {name: value for name, value in zip(header, values) if value != ""}, None
+
+
+async def batched(items: AsyncIterator[T], size: int) -> AsyncIterator[List[T]]:
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def write_rows(rows: AsyncIterator[Dict[str, Any]], fmt: str, fields: Sequence[str]) -> AsyncIterator[bytes]:
+    """Encode rows as NDJSON or CSV (header first), one chunk per row."""
+    if fmt == "ndjson":
+        async for row in rows:
+            yield json.dumps({field: row.get(field) for field in fields}).encode() + b"\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def encode(values) -> bytes:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue().encode()
+
+    yield encode(fields)
+    async for row in rows:
+        yield encode(["" if row.get(field) is None else row[field] for field in fields])
+
+
+class ImportReport:
+    """
+    Counts of an import plus the first `max_errors` row errors; the
+    rest are only counted, so the report stays small for any file size.
+    """
+
+    def __init__(self, max_errors: int = 1000):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+        # Set when the stream itself is unusable and the import stopped early
+        self.aborted: Optional[str] = None
+
+    def ok(self):
+        self.rows += 1
+        self.created += 1
+
+    def error(self, row: int, message: str):
+        self.rows += 1
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "error": message})
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "rows": self.rows,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+        if self.aborted is not None:
+            result["aborted"] = self.aborted
+        return result
@@ -2,24 +2,43 @@
 
 import socket
 import controller_pb2  # сгенерированный из file.proto
+from framing import FrameDecoder, encode_frame
 
 DEVICE_IP = '192.168.1.100'
 DEVICE_PORT = 7000
 BUFFER_SIZE = 4096
 TIMEOUT = 5  # секунд
+FRAMING = None  # None — без кадрирования, 'varint' или 'fixed' — с префиксом длины
+
+_decoder = FrameDecoder(FRAMING) if FRAMING else None
+_correlation_id = 0
 
 
 def send_message(sock: socket.socket, msg: controller_pb2.ClientMessage):
+    global _correlation_id
     data = msg.SerializeToString()
+    if FRAMING:
+        _correlation_id += 1
+        data = encode_frame(data, _correlation_id, FRAMING)
     sock.sendall(data)
 
 
 def receive_message(sock: socket.socket) -> controller_pb2.ControllerResponse:
     sock.settimeout(TIMEOUT)
+    resp = controller_pb2.ControllerResponse()
+    if FRAMING:
+        # Читаем, пока не соберём кадр с ответом на последний запрос
+        while True:
+            data = sock.recv(BUFFER_SIZE)
+            if not data:
+                raise RuntimeError("Нет данных от контроллера")
+            for correlation_id, payload in _decoder.feed(data):
+                if correlation_id == _correlation_id:
+                    resp.ParseFromString(payload)
+                    return resp
     data = sock.recv(BUFFER_SIZE)
     if not data:
         raise RuntimeError("Нет данных от контроллера")
-    resp = controller_pb2.ControllerResponse()
     resp.ParseFromString(data)
     return resp
 
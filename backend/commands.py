@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# Command lifecycle
+QUEUED = "queued"
+SENDING = "sending"
+APPLIED = "applied"
+FAILED = "failed"
+SUPERSEDED = "superseded"
+DONE = (APPLIED, FAILED, SUPERSEDED)
+
+
+class Command:
+    """
+    One control request for a room: the channel values it asked for and
+    what became of them. Channels overwritten by a later command before
+    they were sent are listed in `superseded` with the newer command's id.
+    """
+
+    __slots__ = ("id", "room_id", "changes", "status", "applied", "superseded",
+                 "error", "created_at", "completed_at", "_pending", "_done")
+
+    def __init__(self, room_id: str, changes: Dict[str, Any]):
+        self.id = str(uuid.uuid4())
+        self.room_id = room_id
+        self.changes = dict(changes)
+        self.status = QUEUED
+        self.applied: Dict[str, Any] = {}
+        self.superseded: Dict[str, str] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.completed_at: Optional[float] = None
+        self._pending: Set[str] = set(changes)
+        self._done = asyncio.Event()
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.completed_at = time.time()
+        self._done.set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the command is done; False on timeout."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "command_id": self.id,
+            "room_id": self.room_id,
+            "status": self.status,
+            "changes": self.changes,
+            "applied": self.applied,
+            "created_at": self.created_at,
+            "completed_at": self.completed_at,
+        }
+        if self.superseded:
+            result["superseded"] = self.superseded
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class CommandQueue:
+    """
+    Per-room queues of channel changes on their way to the controllers.
+
+    Pending changes are kept per channel, last writer wins: a new command
+    for a channel that has not been sent yet replaces the older value, so
+    a burst of taps on one switch costs one device message. A room's
+    changes are drained by a single worker that waits `window` seconds to
+    gather a burst and hands every pending channel to `apply` as one batch,
+    which sends one SetState per channel. Channels are sent even if the
+    last polled state already matches: that state may be stale. Workers
+    exist only while a room has pending changes.
+    """
+
+    def __init__(self, apply: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 window: float = 0.02, history: int = 10000,
+                 on_done: Optional[Callable[[Command], Any]] = None):
+        self.apply = apply
+        self.window = window
+        self.history = history
+        self.on_done = on_done
+        self.submitted = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.sent = 0
+        self._pending: Dict[str, Dict[str, tuple]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._commands: "OrderedDict[str, Command]" = OrderedDict()
+
+    def submit(self, room_id: str, changes: Dict[str, Any]) -> Command:
+        command = Command(room_id, changes)
+        self.submitted += 1
+        pending = self._pending.setdefault(room_id, {})
+        for channel, value in changes.items():
+            previous = pending.get(channel)
+            if previous is not None:
+                self._supersede(previous[1], channel, command)
+            pending[channel] = (value, command)
+        self._remember(command)
+        if room_id not in self._workers:
+            # A fresh context: the worker outlives the request that started it,
+            # so it must not inherit that request's fan_out deadline
+            self._workers[room_id] = asyncio.get_running_loop().create_task(
+                self._drain(room_id), context=contextvars.Context()
+            )
+        return command
+
+    def get(self, command_id: str) -> Optional[Command]:
+        return self._commands.get(command_id)
+
+    def _supersede(self, older: Command, channel: str, newer: Command):
+        self.coalesced += 1
+        older._pending.discard(channel)
+        older.superseded[channel] = newer.id
+        if not older._pending:
+            self._finish(older, APPLIED if older.applied else SUPERSEDED)
+
+    def _finish(self, command: Command, status: str, error: Optional[str] = None):
+        command._finish(status, error)
+        if self.on_done is not None:
+            self.on_done(command)
+
+    def _remember(self, command: Command):
+        self._commands[command.id] = command
+        while len(self._commands) > self.history:
+            oldest_id, oldest = next(iter(self._commands.items()))
+            if oldest.status not in DONE:
+                break
+            del self._commands[oldest_id]
+
+    async def _drain(self, room_id: str):
+        try:
+            while True:
+                if self.window > 0:
+                    await asyncio.sleep(self.window)
+                batch = self._pending.pop(room_id, None)
+                if not batch:
+                    return
+                await self._send(room_id, batch)
+        finally:
+            self._workers.pop(room_id, None)
+
+    async def _send(self, room_id: str, batch: Dict[str, tuple]):
+        commands = {command for _, command in batch.values()}
+        for command in commands:
+            command.status = SENDING
+        to_send = {channel: value for channel, (value, _) in batch.items()}
+        error = None
+        applied: Dict[str, Any] = {}
+        self.batches += 1
+        self.sent += len(to_send)
+        try:
+            applied = await self.apply(room_id, to_send)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        for channel, (value, command) in batch.items():
+            command._pending.discard(channel)
+            if channel in applied:
+                command.applied[channel] = value
+        for command in commands:
+            if command._pending:
+                continue  # still has channels queued behind this batch
+            missing = [channel for channel in command.changes
+                       if channel not in command.applied and channel not in command.superseded]
+            if not missing:
+                self._finish(command, APPLIED)
+            else:
+                self._finish(command, FAILED, error or f"Controller rejected {', '.join(missing)}")
+
+    async def close(self):
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "messages_sent": self.sent,
+            "rooms_pending": len(self._pending),
+            "tracked_commands": len(self._commands),
+        }
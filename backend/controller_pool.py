@@ -0,0 +1,422 @@
+import asyncio
+import random
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.protobuf.message import DecodeError
+
+import controller_pb2
+from fanout import deadline
+from framing import FrameDecoder, FrameError, encode_frame
+
+DEFAULT_PORT = 7000
+BUFFER_SIZE = 4096
+TIMEOUT = 5  # seconds
+KEEPALIVE_INTERVAL = 30.0  # seconds of idleness before a connection is pinged
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+
+
+class ControllerError(RuntimeError):
+    """
+    Raised when a controller cannot be reached or answers unexpectedly.
+    """
+
+
+class CircuitOpen(ControllerError):
+    """
+    Raised instead of contacting a device whose circuit breaker is open.
+    """
+
+
+class ControllerBackoff(ControllerError):
+    """
+    Raised instead of reconnecting while a connection backs off after failed connects.
+    """
+
+
+def state_to_dict(state: controller_pb2.State) -> Dict[str, Any]:
+    """
+    Convert a protobuf State into the dict shape used by the API.
+    """
+    return {
+        "lights_on": state.light_on == controller_pb2.On,
+        "door_locked": state.door_lock == controller_pb2.Close,
+        "channel1": state.channel_1 == controller_pb2.ChannelOn,
+        "channel2": state.channel_2 == controller_pb2.ChannelOn,
+        "temperature": round(state.temperature, 1),
+        "humidity": round(state.humidity, 1),
+        "pressure": round(state.pressure, 1),
+    }
+
+
+# API state key -> (States value when True, States value when False)
+STATE_COMMANDS = {
+    "lights_on": (controller_pb2.LightOn, controller_pb2.LightOff),
+    "door_locked": (controller_pb2.DoorLockClose, controller_pb2.DoorLockOpen),
+    "channel1": (controller_pb2.Channel1On, controller_pb2.Channel1Off),
+    "channel2": (controller_pb2.Channel2On, controller_pb2.Channel2Off),
+}
+
+
+# States value -> (API state key, value it sets)
+COMMAND_CHANGES = {
+    command: (key, value)
+    for key, (on_command, off_command) in STATE_COMMANDS.items()
+    for command, value in ((on_command, True), (off_command, False))
+}
+
+
+def commands_for_state(state_update: Dict[str, Any]) -> List[int]:
+    """
+    Translate an API state update into the SetState commands that apply it.
+    Sensor values are read-only and silently ignored.
+    """
+    commands = []
+    for key, value in state_update.items():
+        if key in STATE_COMMANDS:
+            on_command, off_command = STATE_COMMANDS[key]
+            commands.append(on_command if value else off_command)
+    return commands
+
+
+class ControllerConnection:
+    """
+    A single persistent connection to a controller.
+    Requests are serialized with a lock because the wire protocol has no
+    request IDs: a response always belongs to the last request sent.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.last_used = 0.0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._failures = 0
+        self._next_attempt = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def _connect(self, timeout: Optional[float] = None):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ControllerBackoff(f"Controller {self.host}:{self.port} is backing off after failures")
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout or self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            self._failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** (self._failures - 1))
+            self._next_attempt = now + delay * random.uniform(0.5, 1.0)
+            raise ControllerError(f"Cannot connect to controller {self.host}:{self.port}: {e!r}") from e
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._failures = 0
+        self._next_attempt = 0.0
+
+    async def close(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _roundtrip(self, data: bytes, timeout: float) -> bytes:
+        self._writer.write(data)
+        await self._writer.drain()
+        payload = await asyncio.wait_for(self._reader.read(BUFFER_SIZE), timeout)
+        if not payload:
+            raise ConnectionResetError("Controller closed the connection")
+        return payload
+
+    async def request(self, msg: controller_pb2.ClientMessage,
+                      timeout: Optional[float] = None) -> controller_pb2.ControllerResponse:
+        data = msg.SerializeToString()
+        timeout = timeout or self.timeout
+        async with self._lock:
+            # A connection that sat idle may have been dropped by the controller,
+            # so a failure on a reused connection gets one retry on a fresh one.
+            for attempt in range(2):
+                reused = self.connected
+                if not reused:
+                    await self._connect(timeout)
+                try:
+                    payload = await self._roundtrip(data, timeout)
+                    break
+                except (OSError, asyncio.TimeoutError) as e:
+                    await self.close()
+                    if reused and attempt == 0 and not isinstance(e, asyncio.TimeoutError):
+                        continue
+                    raise ControllerError(f"Controller {self.host}:{self.port} request failed: {e!r}") from e
+                except BaseException:
+                    # Cancelled mid-request: the reply may still arrive and would be
+                    # read as the answer to the next request on this connection
+                    await self.close()
+                    raise
+            self.last_used = time.monotonic()
+        resp = controller_pb2.ControllerResponse()
+        resp.ParseFromString(payload)
+        return resp
+
+
+class FramedControllerConnection(ControllerConnection):
+    """
+    A connection in framed mode (see framing.py).
+    Each request carries a correlation id, so requests are pipelined: writes
+    are serialized but many requests can wait for their responses at once.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = TIMEOUT, framing: str = "varint",
+                 max_in_flight: int = 32):
+        super().__init__(host, port, timeout)
+        self.framing = framing
+        self.max_in_flight = max_in_flight
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return len(self._pending) >= self.max_in_flight
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def _connect(self, timeout: Optional[float] = None):
+        await super()._connect(timeout)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_responses(self._reader))
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        decoder = FrameDecoder(self.framing)
+        error: Exception = ConnectionResetError("Controller closed the connection")
+        try:
+            while True:
+                data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    break
+                for correlation_id, payload in decoder.feed(data):
+                    future = self._pending.pop(correlation_id, None)
+                    if future is None or future.done():
+                        continue  # response to a request that already timed out
+                    resp = controller_pb2.ControllerResponse()
+                    try:
+                        resp.ParseFromString(payload)
+                    except DecodeError as e:
+                        # The framing is intact, so only this request fails
+                        future.set_exception(ControllerError(
+                            f"Controller {self.host}:{self.port} sent a malformed response: {e!r}"))
+                        continue
+                    future.set_result(resp)
+        except (OSError, FrameError) as e:
+            error = e
+        finally:
+            self._fail_pending(error)
+            if self._reader is reader:
+                await self.close()
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ControllerError(f"Controller {self.host}:{self.port} request failed: {error!r}"))
+
+    async def close(self):
+        task, self._reader_task = self._reader_task, None
+        await super().close()
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self._fail_pending(ConnectionResetError("Connection closed"))
+
+    async def request(self, msg: controller_pb2.ClientMessage,
+                      timeout: Optional[float] = None) -> controller_pb2.ControllerResponse:
+        timeout = timeout or self.timeout
+        async with self._connect_lock:
+            if not self.connected:
+                await self._connect(timeout)
+        self._next_id = (self._next_id + 1) & 0x7FFFFFFF
+        correlation_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            async with self._lock:
+                # The reader may have closed the connection while this request waited
+                if not self.connected:
+                    raise ConnectionResetError("Controller closed the connection")
+                self._writer.write(encode_frame(msg.SerializeToString(), correlation_id, self.framing))
+                await self._writer.drain()
+            resp = await asyncio.wait_for(future, timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ControllerError(f"Controller {self.host}:{self.port} request failed: {e!r}") from e
+        finally:
+            self._pending.pop(correlation_id, None)
+        self.last_used = time.monotonic()
+        return resp
+
+
+class ControllerPool:
+    """
+    Keyed pool of persistent controller connections, one or more per (host, port).
+    With a health tracker (see health.py) every request goes through the
+    device's circuit breaker and uses its adaptive timeout.
+    """
+
+    def __init__(self, size_per_device: int = 1, timeout: float = TIMEOUT,
+                 keepalive_interval: float = KEEPALIVE_INTERVAL, framing: Optional[str] = None,
+                 health=None):
+        self.size_per_device = size_per_device
+        self.health = health
+        self.framing = framing
+        self.timeout = timeout
+        self.keepalive_interval = keepalive_interval
+        self._connections: Dict[Tuple[str, int], List[ControllerConnection]] = {}
+        self._next: Dict[Tuple[str, int], int] = {}
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+    def connection(self, host: str, port: int = DEFAULT_PORT) -> ControllerConnection:
+        key = (host, port)
+        connections = self._connections.get(key)
+        if connections is None:
+            connections = self._connections[key] = []
+        for conn in connections:
+            if not conn.busy:
+                return conn
+        if len(connections) < self.size_per_device:
+            if self.framing:
+                conn = FramedControllerConnection(host, port, self.timeout, self.framing)
+            else:
+                conn = ControllerConnection(host, port, self.timeout)
+            connections.append(conn)
+            return conn
+        index = self._next.get(key, 0)
+        self._next[key] = (index + 1) % len(connections)
+        return connections[index]
+
+    async def request(self, host: str, port: int, msg: controller_pb2.ClientMessage) -> controller_pb2.ControllerResponse:
+        """
+        Send a request within the device's timeout, shortened to the caller's
+        fan_out deadline if there is one.
+        """
+        limit = deadline.get()
+        remaining = None if limit is None else limit - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise ControllerError(f"Controller {host}:{port} request not sent, deadline passed")
+        if self.health is None:
+            timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+            return await self.connection(host, port).request(msg, timeout)
+        health = self.health.get((host, port))
+        if not health.allow():
+            raise CircuitOpen(f"Controller {host}:{port} is failing, circuit open")
+        trial = health.half_open
+        timeout = health.timeout if remaining is None else min(health.timeout, remaining)
+        started = time.monotonic()
+        try:
+            resp = await self.connection(host, port).request(msg, timeout)
+        except ControllerBackoff:
+            # Not sent: the failed connects that started the backoff were recorded
+            health.release(trial)
+            raise
+        except ControllerError:
+            if timeout < health.timeout and time.monotonic() >= limit:
+                # The caller's deadline ran out, not the device's timeout
+                health.release(trial)
+            else:
+                health.record(False, time.monotonic() - started, trial)
+            raise
+        except BaseException:
+            health.release(trial)
+            raise
+        health.record(True, time.monotonic() - started, trial)
+        return resp
+
+    async def get_info(self, host: str, port: int = DEFAULT_PORT) -> controller_pb2.Info:
+        msg = controller_pb2.ClientMessage()
+        msg.get_info.SetInParent()
+        resp = await self.request(host, port, msg)
+        if not resp.HasField("info"):
+            raise ControllerError(f"Controller {host}:{port} did not return Info")
+        return resp.info
+
+    async def get_state(self, host: str, port: int = DEFAULT_PORT) -> Dict[str, Any]:
+        msg = controller_pb2.ClientMessage()
+        msg.get_state.SetInParent()
+        resp = await self.request(host, port, msg)
+        if not resp.HasField("state"):
+            raise ControllerError(f"Controller {host}:{port} did not return State")
+        return state_to_dict(resp.state)
+
+    async def set_state(self, host: str, port: int, new_state: int) -> bool:
+        msg = controller_pb2.ClientMessage()
+        msg.set_state.state = new_state
+        resp = await self.request(host, port, msg)
+        if not resp.HasField("status"):
+            raise ControllerError(f"Controller {host}:{port} did not return Status")
+        return resp.status == controller_pb2.Ok
+
+    async def apply_state(self, host: str, port: int, state_update: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send the SetState commands needed for a state update.
+        Returns the subset of the update the controller acknowledged.
+        """
+        applied = {}
+        for key, value in state_update.items():
+            if key not in STATE_COMMANDS:
+                continue
+            on_command, off_command = STATE_COMMANDS[key]
+            if await self.set_state(host, port, on_command if value else off_command):
+                applied[key] = value
+        return applied
+
+    def start(self):
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.get_running_loop().create_task(self._keepalive())
+
+    async def _keepalive(self):
+        ping = controller_pb2.ClientMessage()
+        ping.get_info.SetInParent()
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            cutoff = time.monotonic() - self.keepalive_interval
+            idle = [
+                conn
+                for connections in self._connections.values()
+                for conn in connections
+                if conn.connected and not conn.busy and conn.last_used < cutoff
+            ]
+            # Failures close the connection; the next real request reconnects.
+            await asyncio.gather(*(conn.request(ping) for conn in idle), return_exceptions=True)
+
+    async def close(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        for connections in self._connections.values():
+            for conn in connections:
+                await conn.close()
+        self._connections.clear()
+        self._next.clear()
+
+    def stats(self) -> Dict[str, int]:
+        connections = [conn for conns in self._connections.values() for conn in conns]
+        return {
+            "devices": len(self._connections),
+            "connections": len(connections),
+            "connected": sum(1 for conn in connections if conn.connected),
+            "busy": sum(1 for conn in connections if conn.busy),
+        }
@@ -0,0 +1,316 @@
+"""
+Simulated room controllers speaking controller.proto over TCP.
+
+Each virtual controller keeps its own switch state and drifting sensors
+and answers GetInfo, GetState and SetState like the hardware. Controllers
+listen on consecutive ports, or share one multiplexed port where every
+accepted connection is bound to the next controller in turn. Latency,
+jitter, dropped responses and occasional slow responses can be injected
+to exercise the timeout and retry paths.
+
+    python controller_simulator.py --count 100 --base-port 17000
+    python controller_simulator.py --count 5000 --multiplex --base-port 7000 --framing varint \\
+        --latency 0.005 --jitter 0.002 --drop-rate 0.001 --slow-rate 0.01 --slow-delay 3
+
+--write-config writes a device config for the server (DEVICES_CONFIG, see
+devices.py) that assigns the controllers to the --rooms in order:
+
+    python controller_simulator.py --count 5 --base-port 17000 --rooms 101,102,103,104,105 \\
+        --write-config devices.json
+
+Multiplexed controllers all share one address, so the device registry
+cannot tell them apart: every room routed there would reach whichever
+controller the connection landed on. --multiplex is for load tests against
+a single default controller address and cannot be combined with
+--write-config.
+"""
+import argparse
+import asyncio
+import json
+import random
+import secrets
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import controller_pb2
+from framing import FRAMINGS, FrameDecoder, FrameError, encode_frame
+
+BUFFER_SIZE = 4096
+
+# SetState command -> (State field, value it sets)
+SET_STATE_FIELDS = {
+    controller_pb2.LightOn: ("light_on", controller_pb2.On),
+    controller_pb2.LightOff: ("light_on", controller_pb2.Off),
+    controller_pb2.DoorLockOpen: ("door_lock", controller_pb2.Open),
+    controller_pb2.DoorLockClose: ("door_lock", controller_pb2.Close),
+    controller_pb2.Channel1On: ("channel_1", controller_pb2.ChannelOn),
+    controller_pb2.Channel1Off: ("channel_1", controller_pb2.ChannelOff),
+    controller_pb2.Channel2On: ("channel_2", controller_pb2.ChannelOn),
+    controller_pb2.Channel2Off: ("channel_2", controller_pb2.ChannelOff),
+}
+
+
+class VirtualController:
+    """
+    State and identity of one simulated controller.
+    """
+
+    def __init__(self, index: int, host: str, rng: random.Random):
+        self.index = index
+        self.rng = rng
+        self.info = controller_pb2.Info(
+            ip=host,
+            mac="02:00:%02x:%02x:%02x:%02x" % tuple((index >> shift) & 0xFF for shift in (24, 16, 8, 0)),
+            ble_name=f"HotelCtl-{index:05d}",
+            token=secrets.token_hex(8),
+        )
+        self.state = controller_pb2.State(
+            light_on=controller_pb2.Off,
+            door_lock=controller_pb2.Close,
+            channel_1=controller_pb2.ChannelOff,
+            channel_2=controller_pb2.ChannelOff,
+            temperature=round(rng.uniform(20.0, 24.0), 1),
+            humidity=round(rng.uniform(40.0, 60.0), 1),
+            pressure=round(rng.uniform(1000.0, 1020.0), 1),
+        )
+
+    def handle(self, msg: controller_pb2.ClientMessage, error_rate: float = 0.0) -> controller_pb2.ControllerResponse:
+        resp = controller_pb2.ControllerResponse()
+        kind = msg.WhichOneof("message")
+        if kind == "get_info":
+            resp.info.CopyFrom(self.info)
+        elif kind == "get_state":
+            self._drift()
+            resp.state.CopyFrom(self.state)
+        elif kind == "set_state" and msg.set_state.state in SET_STATE_FIELDS:
+            if error_rate and self.rng.random() < error_rate:
+                resp.status = controller_pb2.Error
+            else:
+                field, value = SET_STATE_FIELDS[msg.set_state.state]
+                setattr(self.state, field, value)
+                resp.status = controller_pb2.Ok
+        else:
+            resp.status = controller_pb2.Error
+        return resp
+
+    def _drift(self):
+        state, rng = self.state, self.rng
+        state.temperature = min(26.0, max(18.0, state.temperature + rng.uniform(-0.2, 0.2)))
+        state.humidity = min(70.0, max(30.0, state.humidity + rng.uniform(-0.5, 0.5)))
+        state.pressure = min(1030.0, max(990.0, state.pressure + rng.uniform(-1.0, 1.0)))
+
+
+class ControllerSimulator:
+    """
+    A fleet of virtual controllers behind asyncio TCP servers.
+
+    With multiplex=False controller i listens on base_port + i (or on an
+    ephemeral port when base_port is 0); with multiplex=True all of them
+    share base_port. `addresses[i]` is where controller i can be reached.
+    Faults apply per request: drop_rate leaves a request unanswered,
+    slow_rate adds slow_delay seconds, error_rate answers SetState with
+    Error. Every response waits latency +/- jitter seconds.
+    """
+
+    def __init__(self, count: int = 1, host: str = "127.0.0.1", base_port: int = 0,
+                 multiplex: bool = False, framing: Optional[str] = None,
+                 latency: float = 0.0, jitter: float = 0.0, drop_rate: float = 0.0,
+                 slow_rate: float = 0.0, slow_delay: float = 5.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        if framing is not None and framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing {framing!r}")
+        self.host = host
+        self.base_port = base_port
+        self.multiplex = multiplex
+        self.framing = framing
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.controllers = [VirtualController(i, host, self.rng) for i in range(count)]
+        self.addresses: List[Tuple[str, int]] = []
+        self.connections = 0
+        self.requests = 0
+        self.dropped = 0
+        self.slow = 0
+        self._servers: List[asyncio.AbstractServer] = []
+        self._next_controller = 0
+
+    async def start(self):
+        if self.multiplex:
+            server = await asyncio.start_server(self._accept_next, self.host, self.base_port)
+            port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+            self.addresses = [(self.host, port)] * len(self.controllers)
+            return
+        for i, controller in enumerate(self.controllers):
+            port = self.base_port + i if self.base_port else 0
+            server = await asyncio.start_server(
+                lambda reader, writer, controller=controller: self._serve(controller, reader, writer),
+                self.host, port,
+            )
+            self._servers.append(server)
+            self.addresses.append((self.host, server.sockets[0].getsockname()[1]))
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        await asyncio.gather(*(server.wait_closed() for server in self._servers), return_exceptions=True)
+        self._servers.clear()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _accept_next(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        controller = self.controllers[self._next_controller]
+        self._next_controller = (self._next_controller + 1) % len(self.controllers)
+        await self._serve(controller, reader, writer)
+
+    def _delay(self) -> Optional[float]:
+        """Seconds to wait before answering, or None to drop the request."""
+        self.requests += 1
+        rng = self.rng
+        if self.drop_rate and rng.random() < self.drop_rate:
+            self.dropped += 1
+            return None
+        delay = self.latency + (rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if self.slow_rate and rng.random() < self.slow_rate:
+            self.slow += 1
+            delay += self.slow_delay
+        return max(0.0, delay)
+
+    async def _serve(self, controller: VirtualController, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            if self.framing:
+                await self._serve_framed(controller, reader, writer)
+            else:
+                await self._serve_unframed(controller, reader, writer)
+        except (ConnectionError, FrameError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # simulator stopping; this is the connection's top-level task
+        finally:
+            writer.close()
+
+    async def _serve_unframed(self, controller, reader, writer):
+        # No framing: one message per read, answered in order
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                return
+            msg = controller_pb2.ClientMessage()
+            msg.ParseFromString(data)
+            delay = self._delay()
+            if delay is None:
+                continue
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(controller.handle(msg, self.error_rate).SerializeToString())
+            await writer.drain()
+
+    async def _serve_framed(self, controller, reader, writer):
+        # Framed requests are answered independently, so responses may come back out of order
+        decoder = FrameDecoder(self.framing)
+        pending = set()
+
+        async def respond(correlation_id: int, msg: controller_pb2.ClientMessage, delay: float):
+            if delay:
+                await asyncio.sleep(delay)
+            payload = controller.handle(msg, self.error_rate).SerializeToString()
+            writer.write(encode_frame(payload, correlation_id, self.framing))
+
+        try:
+            while True:
+                data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    return
+                for correlation_id, payload in decoder.feed(data):
+                    msg = controller_pb2.ClientMessage()
+                    msg.ParseFromString(payload)
+                    delay = self._delay()
+                    if delay is None:
+                        continue
+                    task = asyncio.get_running_loop().create_task(respond(correlation_id, msg, delay))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def device_config(self, rooms: Sequence[str] = ()) -> Dict[str, Any]:
+        """Device config for DEVICES_CONFIG, controllers assigned to `rooms` in order."""
+        if self.multiplex:
+            raise ValueError("Multiplexed controllers share one address and cannot be routed per room")
+        devices = []
+        for i, (controller, (host, port)) in enumerate(zip(self.controllers, self.addresses)):
+            device = {"host": host, "port": port, "mac": controller.info.mac,
+                      "ble_name": controller.info.ble_name, "token": controller.info.token}
+            if i < len(rooms):
+                device["room"] = rooms[i]
+            devices.append(device)
+        ports = sorted({port for _, port in self.addresses})
+        return {"discover": [f"{self.host}:{ports[0]}-{ports[-1]}"] if ports else [], "devices": devices}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "controllers": len(self.controllers),
+            "connections": self.connections,
+            "requests": self.requests,
+            "dropped": self.dropped,
+            "slow": self.slow,
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1, help="Virtual controllers (default 1)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=7000, help="First port, or the shared port with --multiplex")
+    parser.add_argument("--multiplex", action="store_true", help="Serve all controllers on one port (no per-room routing)")
+    parser.add_argument("--framing", choices=FRAMINGS, help="Length-prefixed frames with correlation ids")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of requests left unanswered")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of responses delayed by --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="Extra seconds for slow responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of SetState answered with Error")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    parser.add_argument("--rooms", default="", help="Comma-separated room numbers for --write-config")
+    parser.add_argument("--write-config", metavar="PATH", help="Write a device config for the server")
+    args = parser.parse_args()
+    if args.multiplex and args.write_config:
+        parser.error("--write-config needs a port per controller; it cannot be used with --multiplex")
+
+    simulator = ControllerSimulator(
+        count=args.count, host=args.host, base_port=args.base_port, multiplex=args.multiplex,
+        framing=args.framing, latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+        slow_rate=args.slow_rate, slow_delay=args.slow_delay, error_rate=args.error_rate, seed=args.seed,
+    )
+    await simulator.start()
+    ports = sorted({port for _, port in simulator.addresses})
+    where = f"port {ports[0]}" if len(ports) == 1 else f"ports {ports[0]}-{ports[-1]}"
+    print(f"{args.count} controllers on {args.host} {where}, framing {args.framing or 'none'}")
+    if args.write_config:
+        rooms = [room.strip() for room in args.rooms.split(",") if room.strip()]
+        with open(args.write_config, "w") as config:
+            json.dump(simulator.device_config(rooms), config, indent=2)
+        print(f"Device config written to {args.write_config}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+        print(simulator.stats())
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
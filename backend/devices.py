@@ -0,0 +1,369 @@
+"""
+Registry of room controllers: which device serves which room, the identity
+each device reported, and whether it answered lately.
+
+Devices come from a JSON config and from discovery, which sends GetInfo to
+every address of a subnet or list concurrently and matches the answers to
+known devices by MAC, so a controller that got a new IP keeps its room:
+
+    {
+      "discover": ["192.168.1.0/24", "192.168.2.10:7000", "127.0.0.1:17000-17099"],
+      "devices": [
+        {"room": "101", "host": "192.168.1.100", "port": 7000, "mac": "02:00:00:00:00:01"}
+      ]
+    }
+
+Routes are resolved once per change (bind_rooms, configure, discover), so
+looking up a room's address on a request is a single dict access.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import controller_pb2
+from controller_pool import BUFFER_SIZE, DEFAULT_PORT
+from fanout import fan_out
+from framing import FrameDecoder, encode_frame
+
+logger = logging.getLogger(__name__)
+
+Address = Tuple[str, int]
+
+PROBE_TIMEOUT = 1.0  # seconds
+PROBE_CONCURRENCY = 256
+# Largest number of addresses one discovery may probe
+MAX_TARGETS = 1 << 16
+
+
+class Device:
+    """
+    One controller and the rooms it serves.
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, rooms: Iterable[str] = (),
+                 mac: str = "", ble_name: str = "", token: str = ""):
+        self.host = host
+        self.port = port
+        self.rooms = list(rooms)
+        self.mac = mac
+        self.ble_name = ble_name
+        # Identity token from the last GetInfo
+        self.token = token
+        # None until the device has been contacted
+        self.healthy: Optional[bool] = None
+        self.last_seen: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+
+    @property
+    def address(self) -> Address:
+        return self.host, self.port
+
+    def update_identity(self, info: controller_pb2.Info):
+        if self.token and info.token != self.token:
+            logger.warning("Controller %s at %s:%d reported a new token", info.mac or "?", self.host, self.port)
+        self.mac = info.mac or self.mac
+        self.ble_name = info.ble_name or self.ble_name
+        self.token = info.token
+
+    def to_config(self) -> Dict[str, Any]:
+        config = {"host": self.host, "port": self.port}
+        if len(self.rooms) == 1:
+            config["room"] = self.rooms[0]
+        elif self.rooms:
+            config["rooms"] = self.rooms
+        for key in ("mac", "ble_name", "token"):
+            if getattr(self, key):
+                config[key] = getattr(self, key)
+        return config
+
+    def to_dict(self) -> Dict[str, Any]:
+        """API view: the token itself is not exposed."""
+        return {
+            "host": self.host,
+            "port": self.port,
+            "rooms": self.rooms,
+            "mac": self.mac or None,
+            "ble_name": self.ble_name or None,
+            "has_token": bool(self.token),
+            "healthy": self.healthy,
+            "last_seen": self.last_seen,
+            "last_error": self.last_error,
+            "failures": self.failures,
+        }
+
+
+def parse_address(spec: str, default_port: int = DEFAULT_PORT) -> Address:
+    host, _, port = spec.strip().rpartition(":")
+    if not host or "]" in port:  # no port, or a bare IPv6 address
+        return spec.strip().strip("[]"), default_port
+    return host.strip("[]"), int(port)
+
+
+def parse_targets(specs: Iterable[str], default_port: int = DEFAULT_PORT) -> List[Address]:
+    """
+    Addresses to probe from "host", "host:port", "host:first-last" (a port
+    range) and "network/prefix" (every host of a subnet) entries.
+    """
+    targets = []
+    for spec in specs:
+        spec = spec.strip()
+        if not spec:
+            continue
+        if "/" in spec:
+            # "10.0.0.0/24" or "10.0.0.0/24:7001"
+            network, _, port = spec.partition(":") if spec.count(":") == 1 else (spec, "", "")
+            network = ipaddress.ip_network(network, strict=False)
+            if network.num_addresses > MAX_TARGETS:
+                raise ValueError(f"Network {network} has more than {MAX_TARGETS} addresses")
+            hosts = [str(host) for host in network.hosts()] or [str(network.network_address)]
+            targets.extend((host, int(port) if port else default_port) for host in hosts)
+            continue
+        host, _, ports = spec.rpartition(":")
+        if host and "-" in ports:
+            first, last = (int(port) for port in ports.split("-", 1))
+            targets.extend((host, port) for port in range(first, last + 1))
+        else:
+            targets.append(parse_address(spec, default_port))
+        if len(targets) > MAX_TARGETS:
+            raise ValueError(f"More than {MAX_TARGETS} addresses to probe")
+    return list(dict.fromkeys(targets))
+
+
+async def probe(host: str, port: int, timeout: float = PROBE_TIMEOUT,
+                framing: Optional[str] = None) -> controller_pb2.Info:
+    """
+    GetInfo over a short-lived connection, so probing a whole subnet does
+    not leave pooled connections behind.
+    """
+    msg = controller_pb2.ClientMessage()
+    msg.get_info.SetInParent()
+    data = msg.SerializeToString()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(encode_frame(data, 1, framing) if framing else data)
+        await writer.drain()
+        decoder = FrameDecoder(framing) if framing else None
+        while True:
+            payload = await asyncio.wait_for(reader.read(BUFFER_SIZE), timeout)
+            if not payload:
+                raise ConnectionResetError("Controller closed the connection")
+            if decoder is None:
+                break
+            frames = [frame for correlation_id, frame in decoder.feed(payload) if correlation_id == 1]
+            if frames:
+                payload = frames[0]
+                break
+        resp = controller_pb2.ControllerResponse()
+        resp.ParseFromString(payload)
+        if not resp.HasField("info"):
+            raise ValueError("Response is not Info")
+        return resp.info
+    finally:
+        writer.close()
+
+
+class DeviceRegistry:
+    """
+    Devices by address and MAC, plus the resolved room id -> address routes
+    used by the controller calls. Rooms without a device use `default_address`.
+    """
+
+    def __init__(self, default_address: Address, framing: Optional[str] = None,
+                 probe_timeout: float = PROBE_TIMEOUT, concurrency: int = PROBE_CONCURRENCY,
+                 on_discovery: Optional[Callable[["DeviceRegistry"], None]] = None):
+        self.default_address = default_address
+        self.framing = framing
+        self.probe_timeout = probe_timeout
+        self.concurrency = concurrency
+        self.on_discovery = on_discovery
+        # Addresses probed by discover() when it is given none
+        self.targets: List[str] = []
+        self.discoveries = 0
+        self.last_discovery: Optional[float] = None
+        self._devices: Dict[Address, Device] = {}
+        self._by_mac: Dict[str, Device] = {}
+        self._room_numbers: Dict[str, str] = {}
+        self._routes: Dict[str, Address] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._devices)
+
+    def devices(self) -> List[Device]:
+        return list(self._devices.values())
+
+    def load(self, path: str):
+        """Read a config file; a missing file is an empty config."""
+        if not os.path.exists(path):
+            logger.info("Device config %s does not exist, starting without devices", path)
+            return
+        with open(path) as config:
+            self.configure(json.load(config))
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as config:
+            json.dump(self.to_config(), config, indent=2)
+        os.replace(tmp, path)
+
+    def configure(self, config: Dict[str, Any]):
+        """Replace the devices, and the discovery targets when the config lists some."""
+        if "discover" in config:
+            self.targets = list(config["discover"])
+        self._devices.clear()
+        self._by_mac.clear()
+        for entry in config.get("devices", []):
+            rooms = entry.get("rooms") or ([entry["room"]] if entry.get("room") else [])
+            address = (entry["host"], int(entry.get("port", DEFAULT_PORT)))
+            device = self._devices.get(address)
+            if device is None:
+                device = self._add(Device(*address, mac=entry.get("mac", ""),
+                                          ble_name=entry.get("ble_name", ""), token=entry.get("token", "")))
+            device.rooms.extend(str(room) for room in rooms if str(room) not in device.rooms)
+        self._route()
+
+    def to_config(self) -> Dict[str, Any]:
+        return {"discover": self.targets, "devices": [device.to_config() for device in self._devices.values()]}
+
+    def bind_rooms(self, rooms: Iterable[Dict[str, Any]]):
+        """Tell the registry the room ids behind the room numbers the devices are configured with."""
+        self._room_numbers = {room["id"]: room["number"] for room in rooms}
+        self._route()
+
+    def address(self, room_id: str) -> Address:
+        return self._routes.get(room_id, self.default_address)
+
+    def device(self, room_id: str) -> Optional[Device]:
+        address = self._routes.get(room_id)
+        return self._devices.get(address) if address is not None else None
+
+    def record(self, address: Address, ok: bool, error: Optional[str] = None):
+        """Health of a device after a controller call."""
+        device = self._devices.get(address)
+        if device is None:
+            return
+        device.healthy = ok
+        if ok:
+            device.last_seen = time.time()
+            device.failures = 0
+        else:
+            device.last_error = error
+            device.failures += 1
+
+    async def discover(self, targets: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Probe `targets` (default: the configured ones) with GetInfo and
+        update the devices that answered. Returns a summary.
+        """
+        addresses = parse_targets(self.targets if targets is None else targets)
+        infos: Dict[Address, controller_pb2.Info] = {}
+
+        async def probe_address(key: str):
+            host, port = parse_address(key)
+            infos[host, port] = await probe(host, port, self.probe_timeout, self.framing)
+
+        started = time.monotonic()
+        results = await fan_out(
+            [f"[{host}]:{port}" if ":" in host else f"{host}:{port}" for host, port in addresses],
+            probe_address, concurrency=self.concurrency, timeout=self.probe_timeout * 2,
+        )
+        found = moved = added = 0
+        for address, info in infos.items():
+            found += 1
+            device = self._by_mac.get(info.mac) if info.mac else None
+            if device is not None and device.address != address:
+                # Known controller at a new address (DHCP lease changed)
+                logger.info("Controller %s moved from %s:%d to %s:%d", info.mac, *device.address, *address)
+                self._devices.pop(device.address, None)
+                device.host, device.port = address
+                replaced = self._devices.get(address)
+                if replaced is not None:
+                    # The controller that used to answer here is gone; its rooms follow the address
+                    self._forget_mac(replaced)
+                    device.rooms.extend(room for room in replaced.rooms if room not in device.rooms)
+                self._devices[address] = device
+                moved += 1
+            elif device is None:
+                device = self._devices.get(address)
+                if device is None:
+                    device = self._add(Device(*address))
+                    added += 1
+                elif device.mac != info.mac:
+                    # A different controller now answers at this address
+                    self._forget_mac(device)
+            device.update_identity(info)
+            if device.mac:
+                self._by_mac[device.mac] = device
+            self.record(address, True)
+        for result in results:
+            if not result["ok"]:
+                self.record(parse_address(result["target"]), False, result["error"])
+        self._route()
+        self.discoveries += 1
+        self.last_discovery = time.time()
+        if self.on_discovery is not None:
+            self.on_discovery(self)
+        return {
+            "probed": len(addresses),
+            "found": found,
+            "added": added,
+            "moved": moved,
+            "unassigned": sum(1 for device in self._devices.values() if not device.rooms),
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+
+    def start(self, interval: float = 0.0):
+        """Discover in the background now, then every `interval` seconds if it is positive."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.discover()
+            except Exception:
+                logger.exception("Device discovery failed")
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+
+    def _add(self, device: Device) -> Device:
+        self._devices[device.address] = device
+        if device.mac:
+            self._by_mac[device.mac] = device
+        return device
+
+    def _forget_mac(self, device: Device):
+        if device.mac and self._by_mac.get(device.mac) is device:
+            del self._by_mac[device.mac]
+
+    def _route(self):
+        by_number = {room: device.address for device in self._devices.values() for room in device.rooms}
+        self._routes = {
+            room_id: by_number[number] for room_id, number in self._room_numbers.items() if number in by_number
+        }
+
+    def stats(self) -> Dict[str, int]:
+        devices = self._devices.values()
+        return {
+            "devices": len(self._devices),
+            "routed_rooms": len(self._routes),
+            "healthy": sum(1 for device in devices if device.healthy),
+            "unhealthy": sum(1 for device in devices if device.healthy is False),
+            "unassigned": sum(1 for device in devices if not device.rooms),
+            "discoveries": self.discoveries,
+        }
@@ -0,0 +1,231 @@
+"""
+Publish/subscribe between the worker processes of one server.
+
+Workers keep caches and in-memory indexes of data that lives in the shared
+storage backend; whenever one of them changes something it publishes an
+event so the others can drop or update their copies. A message reaches
+every other process, never the publisher, whose own state was already
+updated where the change happened.
+
+    create_event_bus("local")                      # single process, publish is a no-op
+    create_event_bus("unix:///tmp/hotel-events.sock")
+
+With the Unix socket bus the first worker to claim the socket becomes the
+broker and relays each line to the other connections. If it exits, the
+remaining workers reconnect and one of them takes over. Messages published
+while a worker is disconnected are lost, so on_connect callbacks should
+resynchronise from storage.
+"""
+import asyncio
+import fcntl
+import inspect
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Any]
+ConnectCallback = Callable[[], Union[None, Awaitable[None]]]
+
+# Longest accepted message line
+MAX_MESSAGE_SIZE = 1 << 20
+# A peer with more unsent bytes than this is disconnected and has to resync
+MAX_PEER_BUFFER = 4 << 20
+RECONNECT_DELAY = 0.5
+
+
+class EventBus:
+    """
+    Bus of a single process: there are no other workers to tell, so
+    publish only counts. Subclasses deliver to other processes.
+    """
+
+    def __init__(self):
+        # The leader runs work that must happen once per server, such as telemetry polling
+        self.leader = True
+        self.published = 0
+        self.received = 0
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._connect_callbacks: List[ConnectCallback] = []
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_connect(self, callback: ConnectCallback):
+        """Run callback (sync or async) after every (re)connection, including the first."""
+        self._connect_callbacks.append(callback)
+
+    def publish(self, channel: str, data: Dict[str, Any]):
+        self.published += 1
+
+    async def start(self):
+        await self._connected()
+
+    async def close(self):
+        pass
+
+    async def _connected(self):
+        for callback in self._connect_callbacks:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+
+    def _deliver(self, channel: str, data: Dict[str, Any]):
+        self.received += 1
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(data)
+            except Exception:
+                logger.exception("Event handler for %s failed", channel)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": self.leader,
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+class UnixSocketEventBus(EventBus):
+    """
+    Newline-delimited JSON over a Unix socket, relayed by whichever worker
+    holds the broker. Election is serialised with a lock file next to the
+    socket, so a stale socket left by a crashed broker is replaced once.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.leader = False
+        self.dropped = 0
+        self.reconnects = 0
+        self._broker: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        reader = await self._connect()
+        await self._connected()
+        self._task = asyncio.get_running_loop().create_task(self._run(reader))
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._broker is not None:
+            self._broker.close()
+            for peer in list(self._peers):
+                peer.close()
+            await self._broker.wait_closed()
+            self._broker = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def publish(self, channel: str, data: Dict[str, Any]):
+        self.published += 1
+        if self._writer is None or self._writer.is_closing():
+            self.dropped += 1
+            return
+        self._writer.write(json.dumps({"channel": channel, "data": data}).encode() + b"\n")
+
+    async def _connect(self) -> asyncio.StreamReader:
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_SIZE)
+                return reader
+            except (FileNotFoundError, ConnectionRefusedError):
+                await self._elect()
+
+    async def _elect(self):
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have become the broker while we waited for the lock
+                try:
+                    _, writer = await asyncio.open_unix_connection(self.path)
+                    writer.close()
+                    return
+                except (FileNotFoundError, ConnectionRefusedError):
+                    pass
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+                self._broker = await asyncio.start_unix_server(self._serve_peer, self.path, limit=MAX_MESSAGE_SIZE)
+                self.leader = True
+                logger.info("Event bus broker listening on %s (pid %d)", self.path, os.getpid())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                for peer in list(self._peers):
+                    if peer is writer:
+                        continue
+                    if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                        logger.warning("Event bus peer is not keeping up, disconnecting it")
+                        peer.close()
+                        self._peers.discard(peer)
+                        continue
+                    peer.write(line)
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass  # ValueError: line over MAX_MESSAGE_SIZE
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _run(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        logger.warning("Ignoring malformed event bus message %r", line[:200])
+                        continue
+                    self._deliver(message["channel"], message["data"])
+            except (ConnectionError, ValueError) as e:
+                logger.warning("Event bus connection failed: %r", e)
+            # Broker gone: reconnect, possibly as the new broker, and resync
+            self._writer.close()
+            self._writer = None
+            await asyncio.sleep(RECONNECT_DELAY)
+            self.reconnects += 1
+            reader = await self._connect()
+            try:
+                await self._connected()
+            except Exception:
+                logger.exception("Event bus resync failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "peers": len(self._peers),
+        }
+
+
+def create_event_bus(url: Optional[str] = None) -> EventBus:
+    if not url or url == "local":
+        return EventBus()
+    if url.startswith("unix://"):
+        return UnixSocketEventBus(url[len("unix://"):])
+    raise ValueError(f"Unknown event bus {url!r}")
@@ -0,0 +1,86 @@
+import asyncio
+from typing import Any, Dict, Iterable, Optional, Set
+
+
+class Subscription:
+    """
+    One consumer of room state changes.
+    Changes are merged per room until the consumer collects them, so a slow
+    consumer receives one coalesced update per room instead of a backlog.
+    """
+
+    def __init__(self, hub: "RoomStateHub", room_ids: Optional[Set[str]]):
+        self.hub = hub
+        self.room_ids = room_ids  # None subscribes to all rooms
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._event = asyncio.Event()
+
+    def wants(self, room_id: str) -> bool:
+        return self.room_ids is None or room_id in self.room_ids
+
+    def push(self, room_id: str, changes: Dict[str, Any]):
+        pending = self._pending.get(room_id)
+        if pending is None:
+            self._pending[room_id] = dict(changes)
+        else:
+            pending.update(changes)
+        self._event.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Wait for changes and return them keyed by room id.
+        Returns an empty dict if nothing changed within timeout.
+        """
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return {}
+        batch, self._pending = self._pending, {}
+        self._event.clear()
+        return batch
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RoomStateHub:
+    """
+    Fan-out of room state changes to push subscribers (WebSocket and SSE).
+    """
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self.published = 0
+
+    def subscribe(self, room_ids: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(self, set(room_ids) if room_ids else None)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, room_id: str, changes: Dict[str, Any]):
+        if not changes:
+            return
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.wants(room_id):
+                subscription.push(room_id, changes)
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+
+def diff_state(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fields of new that differ from old.
+    """
+    return {key: value for key, value in new.items() if old.get(key) != value}
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# time.monotonic() by which the current fan_out action must finish. Actions
+# that can bound their own I/O by it (ControllerPool.request) do, so they
+# fail cleanly instead of being cancelled mid-request.
+deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+# Seconds past the deadline before an action that ignored it is cancelled
+DEADLINE_GRACE = 0.5
+
+
+async def fan_out(targets: Iterable[str], action: Callable[[str], Awaitable[Any]],
+                  concurrency: int = 200, timeout: float = 3.0) -> List[Dict[str, Any]]:
+    """
+    Run action(target) for every target with at most `concurrency` calls in
+    flight and a per-call timeout, passed to the action as `deadline` and
+    enforced by cancelling it shortly after. Never raises for a failed target; returns
+    one result per target, in input order:
+    {"target", "ok", "latency_ms"} plus "error" on failure.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(target: str) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            deadline.set(time.monotonic() + timeout)
+            try:
+                await asyncio.wait_for(action(target), timeout + DEADLINE_GRACE)
+            except asyncio.TimeoutError:
+                error = f"Timed out after {timeout}s"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            else:
+                error = None
+            result = {
+                "target": target,
+                "ok": error is None,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            if error is not None:
+                result["error"] = error
+            return result
+
+    return await asyncio.gather(*(run(target) for target in targets))
@@ -0,0 +1,135 @@
+import struct
+from typing import List, Tuple
+
+# Framed mode wraps every controller.proto message as
+#   <length><correlation id><protobuf payload>
+# where <length> counts the correlation id and the payload. With "varint"
+# both header fields are protobuf-style base-128 varints, with "fixed" they
+# are 4-byte big-endian unsigned integers. The controller echoes the
+# correlation id of the request in its response, so several requests can be
+# in flight on one connection.
+VARINT = "varint"
+FIXED = "fixed"
+FRAMINGS = (VARINT, FIXED)
+
+MAX_FRAME_SIZE = 1 << 20
+_FIXED_HEADER = struct.Struct(">II")
+
+
+class FrameError(ValueError):
+    """
+    Raised when the byte stream does not contain a valid frame.
+    """
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(buf, pos: int) -> Tuple[int, int]:
+    """
+    Decode a varint at buf[pos:]. Returns (value, new position), or
+    (-1, pos) if the buffer ends before the varint does.
+    """
+    result = 0
+    shift = 0
+    end = len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 35:
+            raise FrameError("Varint too long")
+    return -1, pos
+
+
+def encode_frame(payload: bytes, correlation_id: int, framing: str = VARINT) -> bytes:
+    if framing == FIXED:
+        return _FIXED_HEADER.pack(len(payload) + 4, correlation_id & 0xFFFFFFFF) + payload
+    cid = encode_varint(correlation_id)
+    return encode_varint(len(cid) + len(payload)) + cid + payload
+
+
+class FrameDecoder:
+    """
+    Incremental frame decoder.
+    Bytes are appended to a single reusable bytearray and complete frames are
+    returned as memoryviews into it. The views are released on the next call
+    to feed(), so each payload must be parsed or copied before then.
+    """
+
+    def __init__(self, framing: str = VARINT, max_frame_size: int = MAX_FRAME_SIZE):
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing {framing!r}")
+        self.framing = framing
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._consumed = 0
+        self._views: List[memoryview] = []
+
+    def feed(self, data: bytes) -> List[Tuple[int, memoryview]]:
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        buf = self._buffer
+        # Drop the bytes of frames handed out by the previous call
+        if self._consumed:
+            del buf[:self._consumed]
+            self._consumed = 0
+        buf += data
+        frames = []
+        view = memoryview(buf)
+        try:
+            pos = 0
+            while True:
+                frame = self._next_frame(view, pos)
+                if frame is None:
+                    break
+                pos, correlation_id, payload = frame
+                self._views.append(payload)
+                frames.append((correlation_id, payload))
+            self._consumed = pos
+        finally:
+            view.release()
+        return frames
+
+    def _next_frame(self, view: memoryview, pos: int):
+        end = len(view)
+        if self.framing == FIXED:
+            if end - pos < _FIXED_HEADER.size:
+                return None
+            length, correlation_id = _FIXED_HEADER.unpack_from(view, pos)
+            if length < 4 or length > self.max_frame_size:
+                raise FrameError(f"Invalid frame length {length}")
+            start = pos + _FIXED_HEADER.size
+            stop = pos + 4 + length
+        else:
+            length, start = decode_varint(view, pos)
+            if length < 0:
+                return None
+            if length > self.max_frame_size:
+                raise FrameError(f"Invalid frame length {length}")
+            stop = start + length
+            if stop > end:
+                return None
+            correlation_id, start = decode_varint(view, start)
+            if correlation_id < 0 or start > stop:
+                raise FrameError("Truncated correlation id")
+        if stop > end:
+            return None
+        return stop, correlation_id, view[start:stop]
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer) - self._consumed
@@ -0,0 +1,155 @@
+"""
+Health of each controller, as seen from the requests sent to it.
+
+Every device gets exponentially weighted averages of its latency and error
+rate, a window of recent latencies from which its request timeout is
+derived, and a circuit breaker:
+
+    closed     requests go through; enough failures open the circuit
+    open       requests fail at once with CircuitOpen (controller_pool.py),
+               for `open_seconds`
+    half_open  one trial request goes through; success closes the
+               circuit, failure opens it again
+
+Only the trial resolves half_open: a slow request sent before the circuit
+opened still counts towards the averages, but cannot close the circuit or
+free the trial slot when it finally completes.
+
+A dead controller then costs one timeout per `open_seconds` instead of one
+per request.
+"""
+import time
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+
+from controller_pool import TIMEOUT
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Weight of the newest sample in the averages
+EWMA_ALPHA = 0.2
+# Successful latencies kept per device for the timeout percentile
+LATENCY_WINDOW = 100
+# Samples needed before timeouts adapt or the error rate can open the circuit
+MIN_SAMPLES = 10
+TIMEOUT_PERCENTILE = 0.99
+# Timeout = latency percentile x this, within [min_timeout, max_timeout]
+TIMEOUT_MULTIPLIER = 3.0
+
+
+class DeviceHealth:
+    """
+    Latency, error rate, adaptive timeout and circuit breaker of one device.
+    """
+
+    def __init__(self, failure_threshold: int = 3, error_rate_threshold: float = 0.5,
+                 open_seconds: float = 10.0, min_timeout: float = 0.25, max_timeout: float = TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.open_seconds = open_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.state = CLOSED
+        self.latency_ewma = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self.opened_at = 0.0
+        self.timeout = max_timeout
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._trial_in_flight = False
+
+    @property
+    def half_open(self) -> bool:
+        return self.state == HALF_OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent now; call record() with its outcome.
+        Allowed while half_open, the request is the trial.
+        """
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok: bool, latency: float, trial: bool = False):
+        if trial:
+            self._trial_in_flight = False
+        self.samples += 1
+        self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.latency_ewma = latency if self.samples == 1 else self.latency_ewma + EWMA_ALPHA * (latency - self.latency_ewma)
+            self.consecutive_failures = 0
+            if trial:
+                self.state = CLOSED
+            self._latencies.append(latency)
+            # Recomputed every few samples rather than per request
+            if len(self._latencies) >= MIN_SAMPLES and len(self._latencies) % 10 == 0:
+                self._adapt_timeout()
+            return
+        self.consecutive_failures += 1
+        if trial or self.state == CLOSED and (self.consecutive_failures >= self.failure_threshold or (
+            self.samples >= MIN_SAMPLES and self.error_rate >= self.error_rate_threshold
+        )):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self, trial: bool = False):
+        """The allowed request was abandoned (e.g. cancelled) without an outcome."""
+        if trial:
+            self._trial_in_flight = False
+
+    def _adapt_timeout(self):
+        latencies = sorted(self._latencies)
+        percentile = latencies[min(len(latencies) - 1, int(len(latencies) * TIMEOUT_PERCENTILE))]
+        self.timeout = min(self.max_timeout, max(self.min_timeout, percentile * TIMEOUT_MULTIPLIER))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.state,
+            "latency_ms": round(self.latency_ewma * 1000, 2),
+            "error_rate": round(self.error_rate, 3),
+            "timeout_ms": round(self.timeout * 1000, 1),
+            "consecutive_failures": self.consecutive_failures,
+            "rejected": self.rejected,
+            "samples": self.samples,
+        }
+
+
+class HealthTracker:
+    """
+    DeviceHealth per device key, created on first use with shared settings.
+    """
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._devices: Dict[Hashable, DeviceHealth] = {}
+
+    def get(self, key: Hashable) -> DeviceHealth:
+        health = self._devices.get(key)
+        if health is None:
+            health = self._devices[key] = DeviceHealth(**self.settings)
+        return health
+
+    def peek(self, key: Hashable) -> Optional[DeviceHealth]:
+        """Health of a device without creating it; None if it was never contacted."""
+        return self._devices.get(key)
+
+    def stats(self) -> Dict[str, int]:
+        states = [health.state for health in self._devices.values()]
+        return {
+            "devices": len(states),
+            CLOSED: states.count(CLOSED),
+            OPEN: states.count(OPEN),
+            HALF_OPEN: states.count(HALF_OPEN),
+            "rejected": sum(health.rejected for health in self._devices.values()),
+        }
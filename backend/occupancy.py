@@ -0,0 +1,108 @@
+from array import array
+from calendar import monthrange
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+DEFAULT_ROOM_TYPE = "standard"
+# Nights tracked on each side of the day the tracker was created; stays
+# outside the window are only counted for the nights inside it
+WINDOW_DAYS = 10 * 366
+
+
+class OccupancyTracker:
+    """
+    Occupied room-nights maintained incrementally from bookings.
+    A per-day counter array (indexed by days since `origin`) answers daily
+    occupancy, and per-month totals, overall and per room type, answer
+    monthly occupancy; both are updated when a stay is added or removed,
+    so reads cost the same however many years of bookings exist.
+
+    Counters never go below zero: a removal that arrives before the matching
+    addition (e.g. a reload racing another worker's event) is dropped.
+    """
+
+    def __init__(self, today: Optional[date] = None, window_days: int = WINDOW_DAYS):
+        today = (today or date.today()).toordinal()
+        self.window = (today - window_days, today + window_days)
+        self.origin: Optional[int] = None  # ordinal of the date at index 0
+        self.days = array("i")
+        self.months: Dict[Tuple[int, int], int] = {}
+        self.type_months: Dict[Tuple[str, int, int], int] = {}
+        self.room_types: Dict[str, str] = {}
+        self.type_counts: Dict[str, int] = {}
+
+    def register_room(self, room_id: str, room_type: Optional[str]):
+        room_type = room_type or DEFAULT_ROOM_TYPE
+        previous = self.room_types.get(room_id)
+        if previous == room_type:
+            return
+        if previous is not None:
+            self.type_counts[previous] -= 1
+        self.room_types[room_id] = room_type
+        self.type_counts[room_type] = self.type_counts.get(room_type, 0) + 1
+
+    @property
+    def total_rooms(self) -> int:
+        return len(self.room_types)
+
+    def _ensure_range(self, first: int, last: int):
+        if self.origin is None:
+            self.origin = first
+        if first < self.origin:
+            self.days = array("i", [0]) * (self.origin - first) + self.days
+            self.origin = first
+        needed = last - self.origin + 1
+        if needed > len(self.days):
+            self.days.extend([0] * (needed - len(self.days)))
+
+    def _apply(self, room_id: str, check_in: str, check_out: str, delta: int):
+        first = max(date.fromisoformat(check_in).toordinal(), self.window[0])
+        last = min(date.fromisoformat(check_out).toordinal() - 1, self.window[1])  # the check-out night is free
+        if last < first:
+            return
+        self._ensure_range(first, last)
+        room_type = self.room_types.get(room_id, DEFAULT_ROOM_TYPE)
+        days = self.days
+        for ordinal in range(first, last + 1):
+            index = ordinal - self.origin
+            if days[index] + delta < 0:
+                continue
+            days[index] += delta
+            day = date.fromordinal(ordinal)
+            month = (day.year, day.month)
+            self.months[month] = max(0, self.months.get(month, 0) + delta)
+            type_month = (room_type, day.year, day.month)
+            self.type_months[type_month] = max(0, self.type_months.get(type_month, 0) + delta)
+
+    def add_stay(self, room_id: str, check_in: str, check_out: str):
+        self._apply(room_id, check_in, check_out, 1)
+
+    def remove_stay(self, room_id: str, check_in: str, check_out: str):
+        self._apply(room_id, check_in, check_out, -1)
+
+    def occupied_on(self, day: date) -> int:
+        if self.origin is None:
+            return 0
+        index = day.toordinal() - self.origin
+        return self.days[index] if 0 <= index < len(self.days) else 0
+
+    def day_percentage(self, day: date) -> float:
+        total = self.total_rooms
+        return self.occupied_on(day) / total * 100 if total else 0.0
+
+    def month_percentage(self, year: int, month: int, room_type: Optional[str] = None) -> float:
+        if room_type is None:
+            nights = self.months.get((year, month), 0)
+            rooms = self.total_rooms
+        else:
+            nights = self.type_months.get((room_type, year, month), 0)
+            rooms = self.type_counts.get(room_type, 0)
+        capacity = rooms * monthrange(year, month)[1]
+        return nights / capacity * 100 if capacity else 0.0
+
+    def daily_percentages(self, year: int, month: int) -> Dict[str, float]:
+        first = date(year, month, 1)
+        return {
+            str(day): round(self.day_percentage(first + timedelta(days=day - 1)), 1)
+            for day in range(1, monthrange(year, month)[1] + 1)
+        }
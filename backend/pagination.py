@@ -0,0 +1,159 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised for a cursor that is malformed or belongs to another sort order.
+    """
+
+
+def encode_cursor(sort: str, key: Sequence[Any]) -> str:
+    """
+    Opaque cursor pointing just past the row with the given sort key.
+    Keys are strings; both storage backends encode a missing field as "".
+    """
+    raw = json.dumps([sort, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, length: int) -> Tuple[str, ...]:
+    """
+    Sort key of a cursor made by encode_cursor for `sort`, whose keys have
+    `length` fields (the sort fields plus the id).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort or not isinstance(key, list):
+        raise InvalidCursor("Cursor does not match the requested sort order")
+    # Keys are compared with stored string fields, so anything else is rejected here
+    if len(key) != length or not all(isinstance(value, str) for value in key):
+        raise InvalidCursor("Malformed cursor")
+    return tuple(key)
+
+
+def parse_sort(value: Optional[str], sorts: Dict[str, Sequence[str]], default: str) -> Tuple[str, bool]:
+    """
+    Split a sort parameter such as "-check_in_date" into (field, descending).
+    """
+    value = value or default
+    descending = value.startswith("-")
+    field = value.lstrip("-")
+    if field not in sorts:
+        raise ValueError(f"Cannot sort by {field!r}; expected one of {', '.join(sorts)}")
+    return field, descending
+
+
+def project(doc: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if not fields:
+        return doc
+    return {field: doc[field] for field in fields if field in doc}
+
+
+class SortedIndex:
+    """
+    Documents ordered by a composite key that ends with the document id,
+    so keys are unique and a page can resume right after the last key
+    returned. Lookups are a bisect plus a walk over the page itself.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self._keys: List[Tuple[Any, ...]] = []
+        self._docs: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+
+    def key(self, doc: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(doc.get(field) or "" for field in self.fields) + (doc["id"],)
+
+    def add(self, doc: Dict[str, Any]):
+        key = self.key(doc)
+        insort(self._keys, key)
+        self._docs[key] = doc
+
+    def remove(self, doc: Dict[str, Any]):
+        key = self.key(doc)
+        if self._docs.pop(key, None) is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def scan(self, after: Optional[Tuple[Any, ...]] = None, descending: bool = False,
+             above: Optional[str] = None, below: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Documents after the cursor key, limited to those whose first sort
+        field is > `above` and < `below`; the bounds are bisected, not walked.
+        """
+        keys = self._keys
+        low = 0 if above is None else bisect_right(keys, above, key=_first)
+        high = len(keys) if below is None else bisect_left(keys, below, key=_first)
+        if descending:
+            i = high if after is None else min(high, bisect_left(keys, after))
+            while i > low:
+                i -= 1
+                yield self._docs[keys[i]]
+        else:
+            i = low if after is None else max(low, bisect_right(keys, after))
+            while i < high:
+                yield self._docs[keys[i]]
+                i += 1
+
+    def page(self, limit: int, after: Optional[Tuple[Any, ...]] = None, descending: bool = False,
+             predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Any, ...]]]:
+        """
+        Up to `limit` matching documents after the cursor key, and the key
+        to resume from (None when this is the last page).
+        """
+        return take_page(self.scan(after, descending), self.key, limit, predicate)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def _first(key: Tuple[Any, ...]) -> Any:
+    return key[0]
+
+
+class PartitionedIndex:
+    """
+    One SortedIndex per value of `field`, so a filter on that field pages
+    through its own partition instead of walking past every other document.
+    """
+
+    def __init__(self, field: str, fields: Sequence[str]):
+        self.field = field
+        self.fields = tuple(fields)
+        self._partitions: Dict[Any, SortedIndex] = {}
+
+    def add(self, doc: Dict[str, Any]):
+        value = doc.get(self.field)
+        partition = self._partitions.get(value)
+        if partition is None:
+            partition = self._partitions[value] = SortedIndex(self.fields)
+        partition.add(doc)
+
+    def remove(self, doc: Dict[str, Any]):
+        value = doc.get(self.field)
+        partition = self._partitions.get(value)
+        if partition is not None:
+            partition.remove(doc)
+            if not partition:
+                del self._partitions[value]
+
+    def partition(self, value: Any) -> SortedIndex:
+        """The documents whose field equals `value`; an empty index if there are none."""
+        return self._partitions.get(value) or SortedIndex(self.fields)
+
+
+def take_page(docs, key: Callable[[Dict[str, Any]], Tuple[Any, ...]], limit: int,
+              predicate: Optional[Callable[[Dict[str, Any]], bool]] = None):
+    page = []
+    for doc in docs:
+        if predicate is not None and not predicate(doc):
+            continue
+        if len(page) == limit:
+            return page, key(page[-1])
+        page.append(doc)
+    return page, None
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import NotRequired, TypedDict
+
+
+def row_type(model: Type[BaseModel]) -> type:
+    """
+    TypedDict with the fields of `model`, all optional. Serializing through
+    it keeps only the model's fields and checks nothing, so stored dicts go
+    straight to JSON without building a model per row; projected rows with
+    a subset of the fields work too.
+    """
+    fields = {name: NotRequired[field.annotation] for name, field in model.model_fields.items()}
+    return TypedDict(f"{model.__name__}Row", fields)
+
+
+class JSONSerializer:
+    """
+    Precompiled JSON dumper for one stored document, or a list of them,
+    shaped like `model`.
+    """
+
+    def __init__(self, model: Type[BaseModel], many: bool = False):
+        row = row_type(model)
+        self.adapter = TypeAdapter(List[row] if many else row)
+
+    def dump(self, data: Any) -> bytes:
+        return self.adapter.dump_json(data)
+
+
+class ResponseCache:
+    """
+    Serialized response bodies grouped by collection. A collection's
+    entries are dropped together when it changes; an entry may also carry
+    a tag (e.g. a state version) that must match on lookup. Each collection
+    keeps at most `max_entries` bodies, least recently used first out.
+
+    Every invalidation bumps the collection's generation. Callers read the
+    generation before loading data and pass it to put(), so a body built
+    from data that changed meanwhile is never stored.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._collections: Dict[str, "OrderedDict[Hashable, Tuple[Any, Any]]"] = {}
+        self._generations: Dict[str, int] = {}
+
+    def generation(self, collection: str) -> int:
+        return self._generations.get(collection, 0)
+
+    def get(self, collection: str, key: Hashable, tag: Any = None) -> Optional[Any]:
+        entries = self._collections.get(collection)
+        entry = entries.get(key) if entries is not None else None
+        if entry is None or entry[0] != tag:
+            self.misses += 1
+            return None
+        entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, collection: str, key: Hashable, value: Any, tag: Any = None,
+            generation: Optional[int] = None):
+        if self.max_entries <= 0:
+            return
+        if generation is not None and generation != self.generation(collection):
+            return
+        entries = self._collections.setdefault(collection, OrderedDict())
+        entries[key] = (tag, value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def invalidate(self, collection: str, key: Optional[Hashable] = None):
+        self._collections.pop(collection, None)
+        self._generations[collection] = self.generation(collection) + 1
+
+    def clear(self):
+        self._collections.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": sum(len(entries) for entries in self._collections.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -2,23 +2,119 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
 import json
 import uuid
-from datetime import datetime, timedelta
+import hashlib
+import time
+import asyncio
+import tempfile
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException, Depends, status, Form, Body
+from pydantic import BaseModel, Field, ValidationError
+from fastapi import FastAPI, HTTPException, Depends, status, Form, Body, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from mock_client import ControllerClient
+from storage import create_storage, BookingConflict, BOOKED, CONFLICT, ROOM_SORTS, BOOKING_SORTS
+from pagination import InvalidCursor, decode_cursor, encode_cursor, parse_sort, project
+from bulk import FORMATS, BulkFormatError, ImportReport, batched, bulk_format, read_rows, write_rows
+from serialization import JSONSerializer, ResponseCache
+from versions import Versions, etag_matches
+from auth import PasswordHasher, HasherBusy, TokenCache
+import controller_pb2
+from controller_pool import ControllerPool, ControllerError, CircuitOpen, ControllerBackoff, COMMAND_CHANGES, STATE_COMMANDS
+from devices import DeviceRegistry
+from health import HealthTracker
+from commands import CommandQueue, FAILED
+from eventbus import create_event_bus
+from metrics import MetricsMiddleware, Registry
+from fanout import fan_out
+from timeseries import TimeSeriesStore
+from occupancy import OccupancyTracker
+from telemetry import StateCache, TelemetryPoller
+from events import RoomStateHub, diff_state
 
 # Settings for JWT
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Password hashing runs on a thread pool; beyond AUTH_MAX_PENDING queued
+# operations logins and registrations are rejected with 503
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", str(min(4, os.cpu_count() or 1))))
+AUTH_MAX_PENDING = int(os.environ.get("AUTH_MAX_PENDING", "64"))
+# Verified tokens kept in memory so repeat requests skip JWT decoding
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+
+# Storage: "memory" keeps everything in-process, "mongo" uses MONGO_URL
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+MONGO_URL = os.environ.get("MONGO_URL")
+
+# Room controllers: "mock" uses the in-process simulator, "tcp" talks controller.proto
+CONTROLLER_MODE = os.environ.get("CONTROLLER_MODE", "mock")
+CONTROLLER_HOST = os.environ.get("CONTROLLER_HOST", "192.168.1.100")
+CONTROLLER_PORT = int(os.environ.get("CONTROLLER_PORT", "7000"))
+CONTROLLER_POOL_SIZE = int(os.environ.get("CONTROLLER_POOL_SIZE", "1"))
+# Set to "varint" or "fixed" for controllers with length-prefixed framing (see framing.py)
+CONTROLLER_FRAMING = os.environ.get("CONTROLLER_FRAMING") or None
+# Room -> controller mapping (see devices.py); rooms without a device use CONTROLLER_HOST:CONTROLLER_PORT.
+# DEVICE_DISCOVERY adds comma-separated addresses or subnets to probe with GetInfo, at startup
+# and then every DEVICE_DISCOVERY_INTERVAL seconds (0: only at startup and on request)
+DEVICES_CONFIG = os.environ.get("DEVICES_CONFIG")
+DEVICE_DISCOVERY = [target for target in os.environ.get("DEVICE_DISCOVERY", "").split(",") if target.strip()]
+DEVICE_DISCOVERY_INTERVAL = float(os.environ.get("DEVICE_DISCOVERY_INTERVAL", "0"))
+# Per-device circuit breaker (see health.py): consecutive failures that open it and how long
+# it stays open. Request timeouts follow each device's latency within [MIN, MAX] seconds.
+CIRCUIT_FAILURES = int(os.environ.get("CIRCUIT_FAILURES", "3"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "10"))
+CONTROLLER_TIMEOUT_MIN = float(os.environ.get("CONTROLLER_TIMEOUT_MIN", "0.25"))
+CONTROLLER_TIMEOUT_MAX = float(os.environ.get("CONTROLLER_TIMEOUT_MAX", "5"))
+# Bulk control and multi-room state reads: controllers contacted at once and per-room
+# deadline (seconds), which caps the device timeout of each request instead of cancelling it
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", "200"))
+BULK_TIMEOUT = float(os.environ.get("BULK_TIMEOUT", "3"))
+# Room control commands are queued per room; changes arriving within this many
+# seconds are coalesced into one batch. The control endpoint waits up to
+# COMMAND_WAIT_TIMEOUT for the result unless called with ?wait=false (202).
+COMMAND_WINDOW = float(os.environ.get("COMMAND_WINDOW", "0.02"))
+COMMAND_WAIT_TIMEOUT = float(os.environ.get("COMMAND_WAIT_TIMEOUT", "10"))
+
+# Background sensor polling; an interval of 0 disables the poller
+TELEMETRY_INTERVAL = float(os.environ.get("TELEMETRY_INTERVAL", "10"))
+TELEMETRY_CONCURRENCY = int(os.environ.get("TELEMETRY_CONCURRENCY", "50"))
+# Raw sensor samples kept per room for the history endpoint (older data lives in rollups)
+HISTORY_RAW_SAMPLES = int(os.environ.get("HISTORY_RAW_SAMPLES", "180"))
+# Cached room states older than this (seconds) are re-read from the controller
+STATE_MAX_AGE = float(os.environ.get("STATE_MAX_AGE", str(2 * TELEMETRY_INTERVAL)))
+# Page size of the room and booking listings when the client sets no limit, and its cap
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "1000"))
+# Listings and room states serialize stored dicts directly instead of building
+# a response model per row; FAST_JSON=0 goes back to response_model validation
+FAST_JSON = os.environ.get("FAST_JSON", "1") != "0"
+# Serialized bodies kept per collection until it changes (0 disables)
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+# Longest stay accepted by bookings, imports and availability searches
+MAX_STAY_NIGHTS = int(os.environ.get("MAX_STAY_NIGHTS", "365"))
+# Bulk booking import: rows committed per batch, and row errors listed in the report
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+
+# Worker processes started by `python server.py`. More than one needs a shared
+# storage backend; the workers tell each other about changes over EVENT_BUS,
+# "local" (single process) or unix://<socket path>
+WORKERS = int(os.environ.get("WORKERS", "1"))
+EVENT_BUS = os.environ.get("EVENT_BUS") or (
+    "unix://" + os.path.join(tempfile.gettempdir(), "hotel-events.sock") if WORKERS > 1 else "local"
+)
+
 # Initialize FastAPI app
 app = FastAPI()
 
@@ -30,76 +126,191 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# MongoDB connection (mock for this demonstration)
-class MockDatabase:
-    def __init__(self):
-        # Mock data storage
-        self.users = {
-            "admin": {
-                "id": str(uuid.uuid4()),
-                "username": "admin",
-                # Hashed password for "admin"
-                "hashed_password": "$2b$12$1YGx1OYRyfnYQyA9ofCkYO0udGENbNIq2RCbJTJm7Bh9MPrnY9RBW",
-                "role": "admin"
-            },
-            "guest": {
-                "id": str(uuid.uuid4()),
-                "username": "guest",
-                # Hashed password for "guest"
-                "hashed_password": "$2b$12$1YGx1OYRyfnYQyA9ofCkYO0udGENbNIq2RCbJTJm7Bh9MPrnY9RBW",
-                "role": "guest"
-            }
-        }
-        
-        self.rooms = [
-            {
-                "id": str(uuid.uuid4()),
-                "number": "101",
-                "status": "available",
-                "check_out_date": None
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "number": "102",
-                "status": "available",
-                "check_out_date": None
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "number": "103",
-                "status": "occupied",
-                "check_out_date": (datetime.now() + timedelta(days=3)).isoformat()
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "number": "104",
-                "status": "maintenance",
-                "check_out_date": None
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "number": "105",
-                "status": "available",
-                "check_out_date": None
-            }
-        ]
-        
-        self.bookings = []
-        self.room_states = {}
-        
-        # Initialize room states
-        for room in self.rooms:
-            controller = ControllerClient()
-            state = controller.get_state()
-            state["last_updated"] = datetime.now().isoformat()
-            self.room_states[room["id"]] = state
+# Request latency per route plus timed sections inside handlers, served at /metrics
+metrics = Registry()
+request_duration = metrics.histogram(
+    "hotel_http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+span_duration = metrics.histogram(
+    "hotel_span_duration_seconds", "Time spent in instrumented sections of request handling", ("span",),
+)
+controller_errors = metrics.counter(
+    "hotel_controller_errors_total", "Controller calls that failed", ("operation",),
+)
+app.add_middleware(MetricsMiddleware, duration=request_duration)
+
+db = create_storage(STORAGE_BACKEND, MONGO_URL)
+event_bus = create_event_bus(EVENT_BUS)
+
+controller_health = HealthTracker(
+    failure_threshold=CIRCUIT_FAILURES, open_seconds=CIRCUIT_OPEN_SECONDS,
+    min_timeout=CONTROLLER_TIMEOUT_MIN, max_timeout=CONTROLLER_TIMEOUT_MAX,
+)
+controller_pool = ControllerPool(size_per_device=CONTROLLER_POOL_SIZE, timeout=CONTROLLER_TIMEOUT_MAX,
+                                 framing=CONTROLLER_FRAMING, health=controller_health)
+
+# Discovery runs in one worker; the others take over its results
+def share_devices(registry: DeviceRegistry):
+    event_bus.publish("devices", registry.to_config())
+
+devices = DeviceRegistry((CONTROLLER_HOST, CONTROLLER_PORT), framing=CONTROLLER_FRAMING, on_discovery=share_devices)
+event_bus.subscribe("devices", devices.configure)
+if DEVICES_CONFIG:
+    devices.load(DEVICES_CONFIG)
+devices.targets = list(dict.fromkeys(devices.targets + DEVICE_DISCOVERY))
+
+async def call_controller(room_id: str, operation: str, call, *args):
+    """Call a controller_pool method on the room's device and record the device's health."""
+    host, port = devices.address(room_id)
+    try:
+        result = await call(host, port, *args)
+    except (CircuitOpen, ControllerBackoff):
+        # Rejected without contacting the device: nothing new about its health
+        raise
+    except ControllerError as e:
+        controller_errors.inc(operation)
+        devices.record((host, port), False, str(e))
+        raise
+    devices.record((host, port), True)
+    return result
+
+async def read_controller_state(room_id: str) -> Dict[str, Any]:
+    with span_duration.time("controller_get_state"):
+        if CONTROLLER_MODE == "tcp":
+            return await call_controller(room_id, "get_state", controller_pool.get_state)
+        return ControllerClient().get_state()
+
+async def write_controller_state(room_id: str, state_update: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply channel changes; returns the subset the controller acknowledged."""
+    with span_duration.time("controller_apply_state"):
+        if CONTROLLER_MODE == "tcp":
+            return await call_controller(room_id, "apply_state", controller_pool.apply_state, state_update)
+        ControllerClient().set_state(state_update)
+        return {key: value for key, value in state_update.items() if key in STATE_COMMANDS}
+
+state_cache = StateCache()
+state_hub = RoomStateHub()
+sensor_history = TimeSeriesStore(raw_capacity=HISTORY_RAW_SAMPLES)
+# Occupied room-nights per day and month, built from bookings at startup
+occupancy = OccupancyTracker()
+
+async def stored_state(room_id: str) -> Optional[Dict[str, Any]]:
+    entry = state_cache.get(room_id)
+    if entry is not None:
+        return entry.state
+    return await db.get_room_state(room_id)
+
+async def record_state(room_id: str, state: Dict[str, Any]):
+    """Store a state read from the room's controller."""
+    previous = await stored_state(room_id) or {}
+    changes = diff_state(previous, state)
+    state = {**state, "last_updated": datetime.now().isoformat()}
+    read_at = time.time()
+    sensor_history.record(room_id, read_at, state)
+    await db.update_room_state(room_id, state)
+    if changes:
+        changes = {**changes, "last_updated": state["last_updated"]}
+        state_hub.publish(room_id, changes)
+    entry = state_cache.put(room_id, {**previous, **state})
+    event_bus.publish("room_state", {"room_id": room_id, "state": entry.state, "read_at": read_at, "changes": changes})
+    return entry
+
+async def record_changes(room_id: str, changes: Dict[str, Any]):
+    """Store state fields changed by a command."""
+    previous = await stored_state(room_id) or {}
+    changes = {key: value for key, value in changes.items() if key in previous}
+    changes["last_updated"] = datetime.now().isoformat()
+    await db.update_room_state(room_id, changes)
+    state_hub.publish(room_id, changes)
+    event_bus.publish("room_state", {"room_id": room_id, "changes": changes})
+    return state_cache.update(room_id, changes) or state_cache.put(room_id, {**previous, **changes})
+
+def apply_remote_room_state(event: Dict[str, Any]):
+    """Room state recorded by another worker."""
+    room_id, changes = event["room_id"], event["changes"]
+    if "state" in event:
+        sensor_history.record(room_id, event["read_at"], event["state"])
+        state_cache.put(room_id, event["state"])
+    else:
+        state_cache.update(room_id, changes)
+    if changes:
+        state_hub.publish(room_id, changes)
+
+event_bus.subscribe("room_state", apply_remote_room_state)
+
+async def room_state_ids():
+    return list(await db.list_room_states())
+
+telemetry_poller = TelemetryPoller(
+    room_ids=room_state_ids,
+    read_state=read_controller_state,
+    on_state=record_state,
+    interval=TELEMETRY_INTERVAL or 10.0,
+    concurrency=TELEMETRY_CONCURRENCY,
+)
+
+async def apply_room_changes(room_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Send a coalesced batch of channel changes and record what was applied."""
+    applied = await write_controller_state(room_id, changes)
+    if applied:
+        await record_changes(room_id, applied)
+    return applied
+
+def share_command(command):
+    event_bus.publish("command", command.to_dict())
 
-db = MockDatabase()
+command_queue = CommandQueue(apply_room_changes, window=COMMAND_WINDOW, on_done=share_command)
+# Commands queued by other workers, as last reported, so any worker can answer a status poll
+remote_commands: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def remember_remote_command(command: Dict[str, Any]):
+    remote_commands[command["command_id"]] = command
+    remote_commands.move_to_end(command["command_id"])
+    while len(remote_commands) > command_queue.history:
+        remote_commands.popitem(last=False)
+
+event_bus.subscribe("command", remember_remote_command)
+
+async def run_room_command(room_id: str, changes: Dict[str, Any]):
+    """
+    Queue channel changes behind the room's other commands and wait for
+    them; raises ControllerError if the controller did not apply them.
+    """
+    command = command_queue.submit(room_id, changes)
+    share_command(command)
+    await command.wait()
+    if command.status == FAILED:
+        raise ControllerError(command.error)
+
+def room_floor(room: Dict[str, Any]) -> str:
+    # Room numbers follow the usual <floor><two-digit room> scheme
+    return room.get("floor") or room["number"][:-2] or "0"
+
+def controller_unavailable(room_id: str, error: ControllerError):
+    return HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail=f"Controller for room {room_id} is unavailable: {error}"
+    )
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context, max_workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING)
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE)
+# Every worker caches tokens. Code that changes a user's password or role
+# must call this so all workers drop that user's entries; until then a
+# cached user is served until its token's exp.
+def invalidate_user_tokens(username: str):
+    token_cache.invalidate_user(username)
+    event_bus.publish("tokens", {"username": username})
+
+def apply_remote_token_invalidation(event: Dict[str, Any]):
+    token_cache.invalidate_user(event["username"])
+
+event_bus.subscribe("tokens", apply_remote_token_invalidation)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 # Models
@@ -121,6 +332,7 @@ class UserInDB(User):
 class Room(BaseModel):
     id: str
     number: str
+    type: str = "standard"
     status: str
     check_out_date: Optional[str] = None
 
@@ -134,6 +346,16 @@ class RoomState(BaseModel):
     humidity: float
     pressure: float
     last_updated: str
+    # Last known state, served because the controller could not be read
+    stale: bool = False
+
+class RoomStateError(BaseModel):
+    room_id: str
+    error: str
+
+class RoomStates(BaseModel):
+    states: List[RoomState]
+    errors: List[RoomStateError]
 
 class Booking(BaseModel):
     id: str
@@ -145,6 +367,70 @@ class Booking(BaseModel):
     status: str
     created_at: str
 
+# Precompiled serializers for the fast JSON path
+room_list_json = JSONSerializer(Room, many=True)
+booking_list_json = JSONSerializer(Booking, many=True)
+room_state_json = JSONSerializer(RoomState)
+
+# Storage changes drop the cached bodies of the changed collection
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+db.add_listener(response_cache.invalidate)
+# Change counters behind the ETags of rooms, bookings and room states
+versions = Versions()
+db.add_listener(versions.bump)
+
+# Other workers drop the same cached bodies and bump the same counters
+def share_storage_change(collection: str, key: Optional[str]):
+    event_bus.publish("storage", {"collection": collection, "key": key})
+
+def apply_remote_storage_change(event: Dict[str, Any]):
+    response_cache.invalidate(event["collection"], event["key"])
+    versions.bump(event["collection"], event["key"])
+
+db.add_listener(share_storage_change)
+event_bus.subscribe("storage", apply_remote_storage_change)
+
+def change_occupancy(change: Dict[str, Any]):
+    stay = (change["room_id"], change["check_in"], change["check_out"])
+    if change["booked"]:
+        occupancy.add_stay(*stay)
+    else:
+        occupancy.remove_stay(*stay)
+
+def share_occupancy(room_id: str, check_in: str, check_out: str, booked: bool):
+    change = {"room_id": room_id, "check_in": check_in, "check_out": check_out, "booked": booked}
+    change_occupancy(change)
+    event_bus.publish("occupancy", change)
+
+event_bus.subscribe("occupancy", change_occupancy)
+
+async def load_occupancy():
+    global occupancy
+    tracker = OccupancyTracker()
+    for room in await db.list_rooms():
+        tracker.register_room(room["id"], room.get("type"))
+    for booking in await db.list_bookings():
+        if booking["status"] == "confirmed":
+            tracker.add_stay(booking["room_id"], booking["check_in_date"], booking["check_out_date"])
+    occupancy = tracker
+
+async def sync_with_workers():
+    """
+    Runs whenever the event bus (re)connects. Events missed while
+    disconnected are gone, so rebuild what they would have updated.
+    """
+    response_cache.clear()
+    versions.renew()
+    await load_occupancy()
+    devices.bind_rooms(await db.list_rooms())
+    # Only one worker polls the controllers; the others get its readings over the bus
+    if TELEMETRY_INTERVAL > 0 and event_bus.leader:
+        telemetry_poller.start()
+    if CONTROLLER_MODE == "tcp" and devices.targets and event_bus.leader:
+        devices.start(DEVICE_DISCOVERY_INTERVAL)
+
+event_bus.on_connect(sync_with_workers)
+
 class BookingCreate(BaseModel):
     room_id: str
     guest_name: str
@@ -156,33 +442,144 @@ class ControlCommand(BaseModel):
     room_id: str
     state: Optional[Dict[str, Any]] = None
 
+class BulkControlCommand(BaseModel):
+    # Any States value from controller.proto, e.g. "LightOff" or "DoorLockClose"
+    command: Optional[str] = None
+    # Room filters; all rooms when none is given
+    room_ids: Optional[List[str]] = None
+    floor: Optional[str] = None
+    status: Optional[str] = None
+    concurrency: Optional[int] = Field(None, ge=1, le=1000)
+    timeout: Optional[float] = Field(None, gt=0, le=30)
+    # Legacy form: {"lights_on": true} / {"lights_off": true}
+    lights_on: Optional[bool] = None
+    lights_off: Optional[bool] = None
+
 class AdminStats(BaseModel):
     total_rooms: int
     available_rooms: int
     occupied_rooms: int
     occupancy_percentage: float
     monthly_stats: Dict[str, float]
+    daily_stats: Dict[str, float] = {}
+    room_type_stats: Dict[str, float] = {}
 
 # Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def parse_date(value: str, field: str) -> str:
+    """Normalize a date or datetime string to an ISO date ("YYYY-MM-DD")."""
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {field}: {value!r}, expected YYYY-MM-DD"
+        )
+
+def parse_date_range(check_in: str, check_out: str):
+    check_in = parse_date(check_in, "check-in date")
+    check_out = parse_date(check_out, "check-out date")
+    if check_out <= check_in:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Check-out date must be after check-in date"
+        )
+    if (date.fromisoformat(check_out) - date.fromisoformat(check_in)).days > MAX_STAY_NIGHTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Stays are limited to {MAX_STAY_NIGHTS} nights"
+        )
+    return check_in, check_out
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def parse_page(sort: Optional[str], cursor: Optional[str], fields: Optional[str],
+               sorts: Dict[str, Any], default_sort: str, model) -> Dict[str, Any]:
+    """Validate the sort, cursor and fields parameters of a paged listing."""
+    try:
+        sort_field, descending = parse_sort(sort, sorts, default_sort)
+        sort_name = ("-" if descending else "") + sort_field
+        after = decode_cursor(cursor, sort_name, len(sorts[sort_field]) + 1) if cursor else None
+    except (ValueError, InvalidCursor) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    projection = None
+    if fields:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in projection if field not in model.model_fields]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+    return {"sort": sort_field, "descending": descending, "after": after, "fields": projection}
+
+def json_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 if the client already holds the representation tagged etag."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+def page_response(rows: List[Dict[str, Any]], next_key, page: Dict[str, Any], response: Response,
+                  serializer: JSONSerializer, etag: str, cache_key=None, generation: Optional[int] = None):
+    """
+    Rows go in the body as before; the cursor of the next page, if any,
+    goes in the X-Next-Cursor header. On the fast path the serialized page
+    is cached under cache_key = (collection, key).
+    """
+    headers = {"ETag": etag}
+    if next_key is not None:
+        sort_name = ("-" if page["descending"] else "") + page["sort"]
+        headers["X-Next-Cursor"] = encode_cursor(sort_name, next_key)
+    if FAST_JSON or page["fields"]:
+        # Projected rows are partial, so they never go through the response model
+        with span_duration.time("serialize"):
+            body = serializer.dump(rows)
+        if FAST_JSON and cache_key is not None:
+            response_cache.put(*cache_key, (body, headers), generation=generation)
+        return json_response(body, headers)
+    response.headers.update(headers)
+    return rows
+
+def cached_page(collection: str, key):
+    """Cached (body, headers) of a listing page as a fresh response, or None."""
+    if not FAST_JSON:
+        return None
+    cached = response_cache.get(collection, key)
+    return json_response(*cached) if cached is not None else None
+
+def auth_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HasherBusy:
+        raise auth_busy()
 
-def get_user(username: str):
-    if username in db.users:
-        user_dict = db.users[username]
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise auth_busy()
+
+async def get_user(username: str):
+    user_dict = await db.get_user(username)
+    if user_dict is not None:
         return UserInDB(**user_dict)
     return None
 
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
-    if not user:
-        return False
-    if not verify_password(password, user.hashed_password):
-        return False
-    return user
+async def authenticate_user(username: str, password: str):
+    with span_duration.time("authenticate_user"):
+        user = await get_user(username)
+        if not user:
+            return False
+        if not await verify_password(password, user.hashed_password):
+            return False
+        return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -194,23 +591,32 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def user_from_token(token: str) -> Optional[UserInDB]:
+    user = token_cache.get(token)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
         token_data = TokenData(username=username)
     except JWTError:
-        raise credentials_exception
-    user = get_user(token_data.username)
+        return None
+    user = await get_user(token_data.username)
+    if user is not None and payload.get("exp") is not None:
+        token_cache.put(token, user, payload["exp"])
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    with span_duration.time("get_current_user"):
+        user = await user_from_token(token)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 async def get_current_active_user(current_user: UserInDB = Depends(get_current_user)):
@@ -227,7 +633,7 @@ async def is_admin(current_user: UserInDB = Depends(get_current_user)):
 # API Routes
 @app.post("/api/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -242,7 +648,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @app.post("/api/register")
 async def register_user(username: str = Form(...), password: str = Form(...), role: str = Form("guest")):
-    if username in db.users:
+    if await db.get_user(username) is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already exists"
@@ -251,15 +657,20 @@ async def register_user(username: str = Form(...), password: str = Form(...), ro
     if role not in ["admin", "guest"]:
         role = "guest"  # Default to guest role for security
     
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     user_id = str(uuid.uuid4())
     
-    db.users[username] = {
+    created = await db.add_user({
         "id": user_id,
         "username": username,
         "hashed_password": hashed_password,
         "role": role
-    }
+    })
+    if not created:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already exists"
+        )
     
     return {"id": user_id, "username": username, "role": role}
 
@@ -272,77 +683,384 @@ async def read_users_me(current_user: UserInDB = Depends(get_current_active_user
     }
 
 @app.get("/api/rooms", response_model=List[Room])
-async def get_rooms(current_user: UserInDB = Depends(get_current_active_user)):
-    return db.rooms
+async def get_rooms(
+    request: Request,
+    response: Response,
+    room_status: Optional[str] = Query(None, alias="status"),
+    room_type: Optional[str] = Query(None, alias="type"),
+    number: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    page = parse_page(sort, cursor, fields, ROOM_SORTS, "number", Room)
+    etag = versions.etag("rooms", versions.collection("rooms"))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    cache_key = (room_status, room_type, number, sort, cursor, limit, fields)
+    cached = cached_page("rooms", cache_key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation("rooms")
+    if number is not None:
+        room = await db.get_room_by_number(number)
+        matches = room is not None and room_status in (None, room["status"]) and room_type in (None, room.get("type"))
+        rows = [project(room, page["fields"])] if matches else []
+        return page_response(rows, None, page, response, room_list_json, etag, ("rooms", cache_key), generation)
+    rows, next_key = await db.page_rooms(
+        page["sort"], page["descending"], page["after"], limit,
+        status=room_status, room_type=room_type, fields=page["fields"]
+    )
+    return page_response(rows, next_key, page, response, room_list_json, etag, ("rooms", cache_key), generation)
 
 @app.get("/api/rooms/number/{room_number}", response_model=Room)
-async def get_room_by_number(room_number: str, current_user: UserInDB = Depends(get_current_active_user)):
-    for room in db.rooms:
-        if room["number"] == room_number:
-            return room
+async def get_room_by_number(
+    room_number: str,
+    request: Request,
+    response: Response,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    room = await db.get_room_by_number(room_number)
+    if room is not None:
+        etag = versions.etag("room", room["id"], versions.document("rooms", room["id"]))
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+        response.headers["ETag"] = etag
+        return room
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail=f"Room {room_number} not found"
     )
 
+# Push streams of room state changes. Browsers cannot set headers on
+# WebSocket/EventSource requests, so the token may also come as a query parameter.
+STREAM_HEARTBEAT = 15.0  # seconds
+
+async def stream_user(request_token: Optional[str], authorization: Optional[str]) -> Optional[UserInDB]:
+    token = request_token
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    return await user_from_token(token) if token else None
+
+async def state_snapshot(room_ids: Optional[List[str]]):
+    states = {}
+    for room_id in room_ids or await room_state_ids():
+        state = await stored_state(room_id)
+        if state is not None:
+            states[room_id] = state
+    return states
+
+@app.websocket("/api/ws/room-states")
+async def room_states_websocket(websocket: WebSocket, token: Optional[str] = None, room_id: Optional[List[str]] = Query(None)):
+    if await stream_user(token, websocket.headers.get("authorization")) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    
+    with state_hub.subscribe(room_id) as subscription:
+        # Full state first, then only the fields that change
+        for rid, state in (await state_snapshot(room_id)).items():
+            await websocket.send_json({"room_id": rid, "changes": state})
+        
+        receiver = asyncio.ensure_future(websocket.receive())
+        try:
+            while True:
+                batch = asyncio.ensure_future(subscription.next_batch(STREAM_HEARTBEAT))
+                done, _ = await asyncio.wait({batch, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    batch.cancel()
+                    message = receiver.result()
+                    if message["type"] == "websocket.disconnect":
+                        break
+                    receiver = asyncio.ensure_future(websocket.receive())
+                    continue
+                for rid, changes in batch.result().items():
+                    await websocket.send_json({"room_id": rid, "changes": changes})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+
+@app.get("/api/room-states/stream")
+async def room_states_sse(request: Request, token: Optional[str] = None, room_id: Optional[List[str]] = Query(None)):
+    if await stream_user(token, request.headers.get("authorization")) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    subscription = state_hub.subscribe(room_id)
+    
+    async def events():
+        with subscription:
+            for rid, state in (await state_snapshot(room_id)).items():
+                yield f"data: {json.dumps({'room_id': rid, 'changes': state})}\n\n"
+            while not await request.is_disconnected():
+                batch = await subscription.next_batch(STREAM_HEARTBEAT)
+                if not batch:
+                    yield ": keepalive\n\n"
+                for rid, changes in batch.items():
+                    yield f"data: {json.dumps({'room_id': rid, 'changes': changes})}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def room_state_body(room_id: str, entry) -> bytes:
+    """Serialized RoomState of a cache entry; bodies are cached per room and tagged with the state's version."""
+    if isinstance(entry, dict):
+        # Stale last-known state, not cached
+        return room_state_json.dump({"room_id": room_id, **entry, "stale": True})
+    body = response_cache.get("room_state", room_id, entry.version)
+    if body is None:
+        with span_duration.time("serialize"):
+            body = room_state_json.dump({"room_id": room_id, **entry.state})
+        response_cache.put("room_state", room_id, body, entry.version)
+    return body
+
+async def refresh_room_state(room_id: str):
+    await record_state(room_id, await read_controller_state(room_id))
+
+@app.get("/api/room-states", response_model=RoomStates)
+async def get_room_states(
+    request: Request,
+    response: Response,
+    ids: Optional[str] = Query(None, description="Comma-separated room ids; all rooms when omitted"),
+    floor: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    max_age: Optional[float] = Query(None, ge=0, description="Maximum age in seconds of a cached state; 0 forces controller reads"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    States of many rooms in one response. Fresh cached states are served
+    as they are; the other rooms are read from their controllers
+    concurrently. Rooms that cannot be read are listed under "errors"
+    and do not fail the request; their last known state is still
+    included, flagged "stale".
+    """
+    if ids is not None:
+        room_ids = list(dict.fromkeys(room_id.strip() for room_id in ids.split(",") if room_id.strip()))
+        if len(room_ids) > MAX_PAGE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {MAX_PAGE_SIZE} room ids per request"
+            )
+        if floor is not None or status_filter is not None:
+            rooms = {room_id: await db.get_room(room_id) for room_id in room_ids}
+            # Unknown ids stay in so they are reported
+            room_ids = [room_id for room_id, room in rooms.items() if room is None or (
+                (floor is None or room_floor(room) == floor)
+                and (status_filter is None or room["status"] == status_filter)
+            )]
+    else:
+        room_ids = [room["id"] for room in await db.list_rooms(status=status_filter)
+                    if floor is None or room_floor(room) == floor]
+    
+    max_age = STATE_MAX_AGE if max_age is None else max_age
+    entries = {}
+    errors = {}
+    to_read = []
+    for room_id in room_ids:
+        entry = state_cache.get(room_id, max_age)
+        if entry is not None:
+            entries[room_id] = entry
+        elif await stored_state(room_id) is None:
+            errors[room_id] = f"Room state for room {room_id} not found"
+        else:
+            to_read.append(room_id)
+    for result in await fan_out(to_read, refresh_room_state, concurrency=BULK_CONCURRENCY, timeout=BULK_TIMEOUT):
+        room_id = result["target"]
+        if result["ok"]:
+            entries[room_id] = state_cache.peek(room_id)
+        else:
+            errors[room_id] = f"Controller for room {room_id} is unavailable: {result['error']}"
+            entries[room_id] = await stored_state(room_id)
+    error_list = [{"room_id": room_id, "error": errors[room_id]} for room_id in room_ids if room_id in errors]
+    
+    headers = {}
+    if not errors:
+        # Tagged by the versions of every listed state
+        digest = hashlib.sha256(";".join(f"{room_id}:{entries[room_id].version}" for room_id in room_ids).encode())
+        headers["ETag"] = versions.etag("states", digest.hexdigest()[:16])
+        unchanged = not_modified(request, headers["ETag"])
+        if unchanged is not None:
+            return unchanged
+    
+    if FAST_JSON:
+        # Reuse the per-room bodies of GET /api/room-states/{room_id}
+        states = b",".join(room_state_body(room_id, entries[room_id]) for room_id in room_ids if room_id in entries)
+        return json_response(b'{"states":[' + states + b'],"errors":' + json.dumps(error_list).encode() + b"}", headers)
+    
+    response.headers.update(headers)
+    return {
+        "states": [
+            {"room_id": room_id, **entries[room_id], "stale": True} if room_id in errors
+            else {"room_id": room_id, **entries[room_id].state}
+            for room_id in room_ids if room_id in entries
+        ],
+        "errors": error_list
+    }
+
 @app.get("/api/room-states/{room_id}", response_model=RoomState)
-async def get_room_state(room_id: str, current_user: UserInDB = Depends(get_current_active_user)):
-    if room_id not in db.room_states:
+async def get_room_state(
+    room_id: str,
+    request: Request,
+    response: Response,
+    max_age: Optional[float] = Query(None, ge=0, description="Maximum age in seconds of a cached state; 0 forces a controller read"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    if await stored_state(room_id) is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Room state for room {room_id} not found"
         )
     
-    # Refresh sensor data before returning
-    controller = ControllerClient()
-    state = controller.get_state()
-    state["last_updated"] = datetime.now().isoformat()
-    db.room_states[room_id].update(state)
+    # Serve from the poller's cache unless it is older than the caller accepts
+    entry = state_cache.get(room_id, STATE_MAX_AGE if max_age is None else max_age)
+    if entry is None:
+        try:
+            state = await read_controller_state(room_id)
+        except ControllerError:
+            # Unreachable or circuit open: answer at once with the last known state
+            last_known = await stored_state(room_id)
+            if FAST_JSON:
+                return json_response(room_state_body(room_id, last_known))
+            return {"room_id": room_id, **last_known, "stale": True}
+        entry = await record_state(room_id, state)
+    
+    # State cache versions are never reused, so they make strong ETags
+    etag = versions.etag("state", room_id, entry.version)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
     
+    if FAST_JSON:
+        return json_response(room_state_body(room_id, entry), {"ETag": etag})
+    
+    response.headers["ETag"] = etag
     return {
         "room_id": room_id,
-        **db.room_states[room_id]
+        **entry.state
     }
 
-@app.post("/api/room-states/{room_id}/control")
-async def control_room(room_id: str, command_data: ControlCommand, current_user: UserInDB = Depends(get_current_active_user)):
-    if room_id not in db.room_states:
+def parse_utc_datetime(value: str) -> datetime:
+    """
+    Aware UTC datetime from ISO text; naive values are taken as UTC, so
+    timestamp() never goes through the local time zone (which fails near
+    years 1 and 9999).
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+@app.get("/api/room-states/{room_id}/history")
+async def get_room_state_history(
+    room_id: str,
+    start: Optional[str] = Query(None, alias="from", description="ISO datetime (UTC unless it has an offset), default 24 hours before 'to'"),
+    end: Optional[str] = Query(None, alias="to", description="ISO datetime (UTC unless it has an offset), default now"),
+    resolution: str = Query("auto", pattern="^(auto|raw|minute|hour|day)$"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    if await stored_state(room_id) is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Room state for room {room_id} not found"
         )
     
-    controller = ControllerClient()
+    try:
+        end_dt = parse_utc_datetime(end) if end else datetime.now(timezone.utc)
+        start_dt = parse_utc_datetime(start) if start else end_dt - timedelta(days=1)
+    except (ValueError, OverflowError):
+        # Not ISO, or outside years 1-9999 once converted to UTC
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' and 'to' must be ISO datetimes between years 1 and 9999"
+        )
+    start_ts, end_ts = start_dt.timestamp(), end_dt.timestamp()
+    if resolution == "auto":
+        resolution = sensor_history.choose_resolution(room_id, start_ts, end_ts)
+    
+    points = sensor_history.query(room_id, start_ts, end_ts, resolution)
+    for point in points:
+        point["time"] = datetime.fromtimestamp(point["time"], timezone.utc).isoformat()
     
-    if command_data.command == "set_state" and command_data.state:
-        result = controller.set_state(command_data.state)
-        
-        # Update room state
-        for key, value in command_data.state.items():
-            if key in db.room_states[room_id]:
-                db.room_states[room_id][key] = value
-        
-        db.room_states[room_id]["last_updated"] = datetime.now().isoformat()
-        
+    return {
+        "room_id": room_id,
+        "resolution": resolution,
+        "from": start_dt.isoformat(),
+        "to": end_dt.isoformat(),
+        "points": points
+    }
+
+@app.post("/api/room-states/{room_id}/control")
+async def control_room(
+    room_id: str,
+    command_data: ControlCommand,
+    wait: bool = Query(True, description="Wait until the controller has applied the command; false returns 202 with the queued command"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    if await stored_state(room_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Room state for room {room_id} not found"
+        )
+    
+    # Only switchable channels can be set; sensor values are read-only
+    changes = {key: value for key, value in (command_data.state or {}).items() if key in STATE_COMMANDS}
+    if command_data.command != "set_state" or not changes:
         return {
-            "status": "success",
-            "message": "Room state updated",
-            "result": command_data.state
+            "status": "error", 
+            "message": "Invalid command"
         }
     
+    command = command_queue.submit(room_id, changes)
+    share_command(command)
+    if not wait:
+        return Response(
+            content=json.dumps({
+                "status": "accepted",
+                "message": "Command queued",
+                "command_id": command.id,
+                "result": changes
+            }),
+            status_code=status.HTTP_202_ACCEPTED,
+            media_type="application/json",
+            headers={"Location": f"/api/commands/{command.id}"}
+        )
+    
+    if not await command.wait(COMMAND_WAIT_TIMEOUT):
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Command {command.id} is still {command.status}"
+        )
+    if command.status == FAILED:
+        raise controller_unavailable(room_id, ControllerError(command.error))
     return {
-        "status": "error", 
-        "message": "Invalid command"
+        "status": "success",
+        "message": "Room state updated",
+        "command_id": command.id,
+        "result": command.applied
     }
 
+@app.get("/api/commands/{command_id}")
+async def get_command(command_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    command = command_queue.get(command_id)
+    if command is not None:
+        return command.to_dict()
+    if command_id in remote_commands:
+        return remote_commands[command_id]
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Command {command_id} not found"
+    )
+
 @app.post("/api/bookings", response_model=Booking)
 async def create_booking(booking_data: BookingCreate, current_user: UserInDB = Depends(get_current_active_user)):
     # Find the room
-    room = None
-    for r in db.rooms:
-        if r["id"] == booking_data.room_id:
-            room = r
-            break
+    room = await db.get_room(booking_data.room_id)
     
     if not room:
         raise HTTPException(
@@ -350,11 +1068,13 @@ async def create_booking(booking_data: BookingCreate, current_user: UserInDB = D
             detail=f"Room {booking_data.room_id} not found"
         )
     
-    if room["status"] != "available":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Room {room['number']} is not available"
-        )
+    check_in, check_out = parse_date_range(booking_data.check_in_date, booking_data.check_out_date)
+    unavailable = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Room {room['number']} is not available from {check_in} to {check_out}"
+    )
+    if room["status"] == "maintenance":
+        raise unavailable
     
     # Create booking
     booking_id = str(uuid.uuid4())
@@ -363,84 +1083,460 @@ async def create_booking(booking_data: BookingCreate, current_user: UserInDB = D
         "room_id": booking_data.room_id,
         "room_number": room["number"],
         "guest_name": booking_data.guest_name,
-        "check_in_date": booking_data.check_in_date,
-        "check_out_date": booking_data.check_out_date,
+        "check_in_date": check_in,
+        "check_out_date": check_out,
         "status": "confirmed",
         "created_at": datetime.now().isoformat()
     }
     
-    db.bookings.append(new_booking)
-    
-    # Update room status
-    room["status"] = "occupied"
-    room["check_out_date"] = booking_data.check_out_date
+    # Availability check and insert commit together against the room's version
+    try:
+        booked = await db.book_room(new_booking)
+    except BookingConflict as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    if not booked:
+        raise unavailable
+    await booking_added(new_booking)
     
     return new_booking
 
+async def booking_added(booking: Dict[str, Any]):
+    share_occupancy(booking["room_id"], booking["check_in_date"], booking["check_out_date"], booked=True)
+    
+    # Update room status if the stay has already started
+    if booking["check_in_date"] <= date.today().isoformat() < booking["check_out_date"]:
+        await db.update_room(booking["room_id"], {
+            "status": "occupied",
+            "check_out_date": booking["check_out_date"]
+        })
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+async def import_rows(rows, rooms: Dict[str, Optional[Dict[str, Any]]], report: ImportReport):
+    """
+    Validate parsed import rows into new bookings, yielding (row number,
+    booking) and reporting rows that are invalid. Rows name their room by
+    room_id or room_number; rooms caches the lookups.
+    """
+    async for number, row, error in rows:
+        if error is not None:
+            report.error(number, error)
+            continue
+        if "room_id" not in row and "room_number" in row:
+            key = "number:" + str(row["room_number"])
+            if key not in rooms:
+                rooms[key] = await db.get_room_by_number(str(row["room_number"]))
+            if rooms[key] is None:
+                report.error(number, f"Room {row['room_number']} not found")
+                continue
+            row = {**row, "room_id": rooms[key]["id"]}
+        if row.get("status", "confirmed") != "confirmed":
+            report.error(number, "Only confirmed bookings can be imported")
+            continue
+        try:
+            data = BookingCreate(**{field: row.get(field) for field in BookingCreate.model_fields})
+            check_in, check_out = parse_date_range(data.check_in_date, data.check_out_date)
+        except ValidationError as e:
+            report.error(number, validation_message(e))
+            continue
+        except HTTPException as e:
+            report.error(number, e.detail)
+            continue
+        if data.room_id not in rooms:
+            rooms[data.room_id] = await db.get_room(data.room_id)
+        room = rooms[data.room_id]
+        if room is None:
+            report.error(number, f"Room {data.room_id} not found")
+            continue
+        if room["status"] == "maintenance":
+            report.error(number, f"Room {room['number']} is under maintenance")
+            continue
+        yield number, {
+            "id": str(uuid.uuid4()),
+            "room_id": room["id"],
+            "room_number": room["number"],
+            "guest_name": data.guest_name,
+            "check_in_date": check_in,
+            "check_out_date": check_out,
+            "status": "confirmed",
+            "created_at": datetime.now().isoformat()
+        }
+
+@app.post("/api/admin/bookings/import")
+async def import_bookings(
+    request: Request,
+    format: Optional[str] = Query(None, description="ndjson or csv; defaults to the Content-Type"),
+    current_user: UserInDB = Depends(is_admin)
+):
+    """
+    Create bookings from an NDJSON or CSV body (columns as BookingCreate,
+    or room_number instead of room_id). The body is read as a stream and
+    committed every IMPORT_BATCH_SIZE rows; rows that are invalid or
+    overlap an existing booking are reported and skipped.
+    """
+    try:
+        fmt = bulk_format(format, request.headers.get("content-type"))
+    except BulkFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    report = ImportReport(IMPORT_MAX_ERRORS)
+    rooms: Dict[str, Optional[Dict[str, Any]]] = {}
+    try:
+        async for batch in batched(import_rows(read_rows(request.stream(), fmt), rooms, report), IMPORT_BATCH_SIZE):
+            outcomes = await db.book_many([booking for _, booking in batch])
+            for (number, booking), outcome in zip(batch, outcomes):
+                if outcome == BOOKED:
+                    report.ok()
+                    await booking_added(booking)
+                elif outcome == CONFLICT:
+                    report.error(number, f"Room {booking['room_number']} is being booked concurrently, please retry")
+                else:
+                    report.error(number, f"Room {booking['room_number']} is not available "
+                                         f"from {booking['check_in_date']} to {booking['check_out_date']}")
+    except BulkFormatError as e:
+        report.aborted = str(e)
+    return report.to_dict()
+
+@app.get("/api/admin/bookings/export")
+async def export_bookings(
+    format: str = Query("ndjson", description="ndjson or csv"),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    date_from: Optional[str] = Query(None, alias="from", description="Stays ending after this date"),
+    date_to: Optional[str] = Query(None, alias="to", description="Stays starting before this date"),
+    current_user: UserInDB = Depends(is_admin)
+):
+    """Stream every booking in check-in order, one page of MAX_PAGE_SIZE at a time."""
+    try:
+        fmt = bulk_format(format)
+    except BulkFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if date_from is not None:
+        date_from = parse_date(date_from, "from date")
+    if date_to is not None:
+        date_to = parse_date(date_to, "to date")
+    
+    async def bookings():
+        after = None
+        while True:
+            rows, after = await db.page_bookings(
+                after=after, limit=MAX_PAGE_SIZE, status=status_filter, date_from=date_from, date_to=date_to
+            )
+            for row in rows:
+                yield row
+            if after is None:
+                return
+    
+    return StreamingResponse(
+        write_rows(bookings(), fmt, list(Booking.model_fields)),
+        media_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="bookings.{fmt}"'}
+    )
+
+@app.get("/api/availability", response_model=List[Room])
+async def get_availability(
+    check_in: str = Query(..., alias="from"),
+    check_out: str = Query(..., alias="to"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    check_in, check_out = parse_date_range(check_in, check_out)
+    rooms = []
+    for room_id in await db.free_room_ids(check_in, check_out):
+        room = await db.get_room(room_id)
+        if room is not None and room["status"] != "maintenance":
+            rooms.append(room)
+    if FAST_JSON:
+        with span_duration.time("serialize"):
+            body = room_list_json.dump(rooms)
+        return json_response(body)
+    return rooms
+
 @app.get("/api/bookings", response_model=List[Booking])
-async def get_bookings(current_user: UserInDB = Depends(get_current_active_user)):
-    user_bookings = []
+async def get_bookings(
+    request: Request,
+    response: Response,
+    booking_status: Optional[str] = Query(None, alias="status"),
+    room_number: Optional[str] = None,
+    guest_name: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    page = parse_page(sort, cursor, fields, BOOKING_SORTS, "check_in_date", Booking)
+    if date_from is not None:
+        date_from = parse_date(date_from, "from date")
+    if date_to is not None:
+        date_to = parse_date(date_to, "to date")
     
-    # Filter bookings for regular users, admins see all
-    if current_user.role == "admin":
-        user_bookings = db.bookings
-    else:
-        user_bookings = [b for b in db.bookings if b["guest_name"] == current_user.username]
+    # Regular users only see their own bookings, admins see all
+    if current_user.role != "admin":
+        guest_name = current_user.username
     
-    return user_bookings
+    # The same URL lists different bookings per user, so the tag names the viewer
+    viewer = "admin" if current_user.role == "admin" else hashlib.sha256(current_user.username.encode()).hexdigest()[:16]
+    etag = versions.etag("bookings", viewer, versions.collection("bookings"))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    
+    cache_key = (booking_status, room_number, guest_name, date_from, date_to, sort, cursor, limit, fields)
+    cached = cached_page("bookings", cache_key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation("bookings")
+    rows, next_key = await db.page_bookings(
+        page["sort"], page["descending"], page["after"], limit,
+        guest_name=guest_name, room_number=room_number, status=booking_status,
+        date_from=date_from, date_to=date_to, fields=page["fields"]
+    )
+    return page_response(rows, next_key, page, response, booking_list_json, etag, ("bookings", cache_key), generation)
+
+@app.delete("/api/bookings/{booking_id}", response_model=Booking)
+async def cancel_booking(booking_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    booking = await db.get_booking(booking_id)
+    if not booking or (current_user.role != "admin" and booking["guest_name"] != current_user.username):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Booking {booking_id} not found"
+        )
+    if booking["status"] != "confirmed":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Booking {booking_id} is already {booking['status']}"
+        )
+    
+    booking = await db.update_booking(booking_id, {"status": "cancelled"})
+    share_occupancy(booking["room_id"], booking["check_in_date"], booking["check_out_date"], booked=False)
+    
+    # Free the room if the cancelled stay is the current one
+    if booking["check_in_date"] <= date.today().isoformat() < booking["check_out_date"]:
+        room = await db.get_room(booking["room_id"])
+        if room and room["status"] == "occupied":
+            await db.update_room(room["id"], {"status": "available", "check_out_date": None})
+    
+    return booking
 
 @app.get("/api/admin/stats", response_model=AdminStats)
-async def get_admin_stats(current_user: UserInDB = Depends(is_admin)):
-    total_rooms = len(db.rooms)
-    available_rooms = sum(1 for room in db.rooms if room["status"] == "available")
-    occupied_rooms = sum(1 for room in db.rooms if room["status"] == "occupied")
+async def get_admin_stats(
+    year: Optional[int] = Query(None, ge=1, le=9999),
+    month: Optional[int] = Query(None, ge=1, le=12),
+    current_user: UserInDB = Depends(is_admin)
+):
+    status_counts = await db.room_status_counts()
+    total_rooms = sum(status_counts.values())
+    available_rooms = status_counts.get("available", 0)
+    occupied_rooms = status_counts.get("occupied", 0)
     
     occupancy_percentage = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
     
-    # Mock monthly statistics for the demo
-    current_month = datetime.now().month
-    monthly_stats = {}
-    
-    for month in range(1, 13):
-        if month < current_month:
-            # Past months with random occupancy
-            monthly_stats[str(month)] = round(30 + 40 * (month / 12), 1)
-        elif month == current_month:
-            # Current month
-            monthly_stats[str(month)] = round(occupancy_percentage, 1)
-        else:
-            # Future months with projections (lower for demo)
-            monthly_stats[str(month)] = round(20 + 30 * ((12 - month) / 12), 1)
+    # Share of room-nights booked, from the occupancy counters
+    today = date.today()
+    year = year or today.year
+    month = month or today.month
+    monthly_stats = {
+        str(m): round(occupancy.month_percentage(year, m), 1) for m in range(1, 13)
+    }
+    room_type_stats = {
+        room_type: round(occupancy.month_percentage(year, month, room_type), 1)
+        for room_type in sorted(occupancy.type_counts)
+        if occupancy.type_counts[room_type]
+    }
     
     return {
         "total_rooms": total_rooms,
         "available_rooms": available_rooms,
         "occupied_rooms": occupied_rooms,
         "occupancy_percentage": occupancy_percentage,
-        "monthly_stats": monthly_stats
+        "monthly_stats": monthly_stats,
+        "daily_stats": occupancy.daily_percentages(year, month),
+        "room_type_stats": room_type_stats
+    }
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    state_lookups = state_cache.hits + state_cache.misses
+    return {
+        "token": token_cache.stats(),
+        "state": {
+            "size": len(state_cache),
+            "hits": state_cache.hits,
+            "misses": state_cache.misses,
+            "hit_rate": state_cache.hits / state_lookups if state_lookups else 0.0,
+        },
+        "response": response_cache.stats(),
+    }
+
+@app.get("/api/admin/cache-stats")
+async def get_cache_stats(current_user: UserInDB = Depends(is_admin)):
+    return {
+        **{f"{name}_cache": stats for name, stats in cache_stats().items()},
+        "command_queue": command_queue.stats(),
+        "event_bus": event_bus.stats(),
     }
 
+def cache_samples(field: str):
+    return [({"cache": name}, stats[field]) for name, stats in cache_stats().items()]
+
+# Values other components already track are read when /metrics is scraped
+metrics.collector("hotel_cache_hits_total", "counter", "Cache lookups answered from the cache",
+                  lambda: cache_samples("hits"))
+metrics.collector("hotel_cache_misses_total", "counter", "Cache lookups that missed",
+                  lambda: cache_samples("misses"))
+metrics.collector("hotel_cache_hit_ratio", "gauge", "Share of cache lookups that hit",
+                  lambda: cache_samples("hit_rate"))
+metrics.collector("hotel_cache_entries", "gauge", "Entries currently cached",
+                  lambda: cache_samples("size"))
+metrics.collector("hotel_controller_pool", "gauge", "Controller pool devices and connections by state",
+                  lambda: [({"state": key}, value) for key, value in controller_pool.stats().items()])
+metrics.collector("hotel_command_queue", "gauge", "Room command queue counters",
+                  lambda: [({"stat": key}, value) for key, value in command_queue.stats().items()])
+metrics.collector("hotel_password_hasher", "gauge", "Password hashing operations pending and rejected",
+                  lambda: [({"stat": "pending"}, password_hasher.pending),
+                           ({"stat": "rejected"}, password_hasher.rejected)])
+metrics.collector("hotel_event_bus", "gauge", "Event bus messages and state of this worker",
+                  lambda: [({"stat": key}, value) for key, value in event_bus.stats().items()])
+metrics.collector("hotel_devices", "gauge", "Known controllers by health, and rooms routed to one",
+                  lambda: [({"stat": key}, value) for key, value in devices.stats().items()])
+metrics.collector("hotel_controller_circuits", "gauge", "Controller circuit breakers by state, and requests they rejected",
+                  lambda: [({"stat": key}, value) for key, value in controller_health.stats().items()])
+metrics.collector("hotel_telemetry_sweeps_total", "counter", "Completed telemetry polling sweeps",
+                  lambda: [({}, telemetry_poller.sweeps)])
+metrics.collector("hotel_telemetry_errors_total", "counter", "Controller reads that failed during polling",
+                  lambda: [({}, telemetry_poller.errors)])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/api/admin/rooms/bulk-control")
-async def bulk_control_rooms(command: Dict[str, Any] = Body(...), current_user: UserInDB = Depends(is_admin)):
-    cmd = list(command.keys())[0] if command else None
+async def bulk_control_rooms(command: BulkControlCommand, current_user: UserInDB = Depends(is_admin)):
+    legacy_commands = {"lights_on": "LightOn", "lights_off": "LightOff"}
+    cmd = command.command
+    if cmd is None and command.lights_on:
+        cmd = "lights_on"
+    elif cmd is None and command.lights_off:
+        cmd = "lights_off"
+    cmd = legacy_commands.get(cmd, cmd)
     
-    if not cmd or cmd not in ["lights_on", "lights_off"]:
+    if not cmd or cmd not in controller_pb2.States.keys():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid command"
+            detail=f"Invalid command, expected one of: {', '.join(controller_pb2.States.keys())}"
         )
+    channel, value = COMMAND_CHANGES[controller_pb2.States.Value(cmd)]
     
-    state_value = cmd == "lights_on"
+    # Select rooms
+    if command.room_ids is not None:
+        rooms = [await db.get_room(room_id) for room_id in command.room_ids]
+        unknown = [room_id for room_id, room in zip(command.room_ids, rooms) if room is None]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Rooms not found: {', '.join(unknown)}"
+            )
+        if command.status is not None:
+            rooms = [room for room in rooms if room["status"] == command.status]
+    else:
+        rooms = await db.list_rooms(status=command.status)
+    if command.floor is not None:
+        rooms = [room for room in rooms if room_floor(room) == command.floor]
+    room_numbers = {room["id"]: room["number"] for room in rooms}
     
-    for room_id in db.room_states:
-        db.room_states[room_id]["lights_on"] = state_value
-        db.room_states[room_id]["last_updated"] = datetime.now().isoformat()
+    # Talk to controllers concurrently; one slow device must not hold up the rest
+    started = datetime.now()
+    results = await fan_out(
+        room_numbers,
+        # Through the room queues, so bulk and single-room commands stay in order
+        lambda room_id: run_room_command(room_id, {channel: value}),
+        concurrency=command.concurrency or BULK_CONCURRENCY,
+        timeout=command.timeout or BULK_TIMEOUT,
+    )
+    duration_ms = (datetime.now() - started).total_seconds() * 1000
+    
+    room_results = []
+    failed = []
+    for result in results:
+        room_id = result.pop("target")
+        if not result["ok"]:
+            failed.append(room_id)
+        room_results.append({"room_id": room_id, "room_number": room_numbers[room_id], **result})
     
     return {
-        "status": "success",
-        "message": f"Bulk command {cmd} executed successfully"
+        "status": "success" if not failed else "partial",
+        "message": f"Bulk command {cmd} executed successfully" if not failed
+                   else f"Bulk command {cmd} failed for {len(failed)} of {len(results)} rooms",
+        "command": cmd,
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed_rooms": failed,
+        "duration_ms": round(duration_ms, 1),
+        "results": room_results
     }
 
+class DeviceDiscovery(BaseModel):
+    # Addresses, "host:first-last" port ranges or subnets; the configured targets when omitted
+    targets: Optional[List[str]] = None
+    # Write the result to DEVICES_CONFIG
+    save: bool = False
+
+def device_health(address) -> Optional[Dict[str, Any]]:
+    health = controller_health.peek(address)
+    return health.to_dict() if health is not None else None
+
+@app.get("/api/admin/devices")
+async def get_devices(current_user: UserInDB = Depends(is_admin)):
+    return {
+        **devices.stats(),
+        "default_address": "%s:%d" % devices.default_address,
+        "default_health": device_health(devices.default_address),
+        "circuits": controller_health.stats(),
+        "targets": devices.targets,
+        "last_discovery": devices.last_discovery,
+        "devices": [{**device.to_dict(), "health": device_health(device.address)} for device in devices.devices()],
+    }
+
+@app.post("/api/admin/devices/discover")
+async def discover_devices(discovery: DeviceDiscovery = Body(DeviceDiscovery()), current_user: UserInDB = Depends(is_admin)):
+    if discovery.save and not DEVICES_CONFIG:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="DEVICES_CONFIG is not set"
+        )
+    try:
+        summary = await devices.discover(discovery.targets)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid targets: {e}")
+    if discovery.save:
+        devices.save(DEVICES_CONFIG)
+    return summary
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await db.init()
+    for room_id, state in (await db.list_room_states()).items():
+        state_cache.put(room_id, state)
+    controller_pool.start()
+    # Loads occupancy and starts the telemetry poller in the leading worker
+    await event_bus.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await telemetry_poller.stop()
+    await devices.stop()
+    await event_bus.close()
+    await command_queue.close()
+    await controller_pool.close()
+    await db.close()
+    password_hasher.shutdown()
+
 # Root path
 @app.get("/")
 async def read_root():
@@ -449,4 +1545,9 @@ async def read_root():
 # Expose app for uvicorn
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("server:app", host="0.0.0.0", port=8001, reload=True)
+    if WORKERS > 1:
+        if STORAGE_BACKEND == "memory":
+            sys.exit("WORKERS > 1 needs state shared between processes, set STORAGE_BACKEND=mongo")
+        uvicorn.run("server:app", host="0.0.0.0", port=8001, workers=WORKERS)
+    else:
+        uvicorn.run("server:app", host="0.0.0.0", port=8001, reload=True)
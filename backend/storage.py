@@ -0,0 +1,790 @@
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from availability import AvailabilityIndex, RoomIntervals
+from mock_client import ControllerClient
+from pagination import PartitionedIndex, SortedIndex, project, take_page
+
+# Sort orders for paged listings: field name -> key fields. The document id
+# is always appended as a tie-breaker so every key is unique.
+ROOM_SORTS = {
+    "number": ("number",),
+    "status": ("status", "number"),
+    "type": ("type", "number"),
+}
+BOOKING_SORTS = {
+    "check_in_date": ("check_in_date",),
+    "check_out_date": ("check_out_date",),
+    "created_at": ("created_at",),
+    "room_number": ("room_number", "check_in_date"),
+}
+
+Page = Tuple[List[Dict[str, Any]], Optional[Tuple[Any, ...]]]
+
+# Optimistic booking commits: attempts per booking, and the longest random
+# pause (seconds) before retrying after another booking of the room won
+BOOKING_RETRIES = 8
+BOOKING_RETRY_DELAY = 0.005
+
+
+# Outcome of each booking in Storage.book_many
+BOOKED = "booked"
+TAKEN = "taken"          # overlaps a confirmed booking, or an earlier one in the batch
+CONFLICT = "conflict"    # lost every commit race for its room
+
+
+class BookingConflict(RuntimeError):
+    """A booking lost every commit race for its room."""
+
+
+def default_users() -> Dict[str, Dict[str, Any]]:
+    return {
+        "admin": {
+            "id": str(uuid.uuid4()),
+            "username": "admin",
+            # Hashed password for "admin"
+            "hashed_password": "$2b$12$1YGx1OYRyfnYQyA9ofCkYO0udGENbNIq2RCbJTJm7Bh9MPrnY9RBW",
+            "role": "admin"
+        },
+        "guest": {
+            "id": str(uuid.uuid4()),
+            "username": "guest",
+            # Hashed password for "guest"
+            "hashed_password": "$2b$12$1YGx1OYRyfnYQyA9ofCkYO0udGENbNIq2RCbJTJm7Bh9MPrnY9RBW",
+            "role": "guest"
+        }
+    }
+
+
+def default_rooms() -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "number": "101",
+            "type": "standard",
+            "status": "available",
+            "check_out_date": None
+        },
+        {
+            "id": str(uuid.uuid4()),
+            "number": "102",
+            "type": "standard",
+            "status": "available",
+            "check_out_date": None
+        },
+        {
+            "id": str(uuid.uuid4()),
+            "number": "103",
+            "type": "deluxe",
+            "status": "occupied",
+            "check_out_date": (datetime.now() + timedelta(days=3)).isoformat()
+        },
+        {
+            "id": str(uuid.uuid4()),
+            "number": "104",
+            "type": "deluxe",
+            "status": "maintenance",
+            "check_out_date": None
+        },
+        {
+            "id": str(uuid.uuid4()),
+            "number": "105",
+            "type": "suite",
+            "status": "available",
+            "check_out_date": None
+        }
+    ]
+
+
+def initial_room_state() -> Dict[str, Any]:
+    state = dict(ControllerClient().get_state())
+    state["last_updated"] = datetime.now().isoformat()
+    return state
+
+
+class Storage:
+    """
+    Interface of the storage backends used by the API.
+    Returned documents are plain dicts and must be treated as read-only;
+    changes go through the update methods, which call the listeners with
+    the changed collection ("rooms", "bookings" or "room_states") and the
+    id of the changed document (the room id for room states).
+    """
+
+    def __init__(self):
+        self._listeners: List[Callable[[str, Optional[str]], None]] = []
+
+    def add_listener(self, listener: Callable[[str, Optional[str]], None]):
+        self._listeners.append(listener)
+
+    def _changed(self, collection: str, key: Optional[str] = None):
+        for listener in self._listeners:
+            listener(collection, key)
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Users
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def add_user(self, user: Dict[str, Any]) -> bool:
+        """Insert a user; returns False if the username is taken."""
+        raise NotImplementedError
+
+    # Rooms
+    async def list_rooms(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get_room_by_number(self, number: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def update_room(self, room_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def room_status_counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    async def page_rooms(self, sort: str = "number", descending: bool = False,
+                         after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                         status: Optional[str] = None, room_type: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None) -> Page:
+        """
+        One page of rooms in ROOM_SORTS[sort] order, resuming after the key
+        `after`. Returns the rooms and the key of the last one if more follow.
+        """
+        raise NotImplementedError
+
+    # Bookings
+    async def add_booking(self, booking: Dict[str, Any]):
+        """Insert a booking without checking for overlaps; bumps the room's version."""
+        raise NotImplementedError
+
+    async def room_version(self, room_id: str) -> int:
+        """Counter bumped by every booking added to the room."""
+        raise NotImplementedError
+
+    async def commit_bookings(self, room_id: str, bookings: List[Dict[str, Any]], version: int) -> bool:
+        """
+        Insert bookings of one room only if the room is still at `version`,
+        bumping it; False, inserting nothing, if another booking of the room
+        was added meanwhile.
+        """
+        raise NotImplementedError
+
+    async def book_room(self, booking: Dict[str, Any], retries: int = BOOKING_RETRIES) -> bool:
+        """
+        Insert a confirmed booking unless it overlaps another confirmed one.
+        Returns False if the room is taken and raises BookingConflict when
+        every attempt lost a race (see book_many).
+        """
+        outcome, = await self.book_many([booking], retries)
+        if outcome == CONFLICT:
+            raise BookingConflict(f"Room {booking['room_id']} is being booked concurrently, please retry")
+        return outcome == BOOKED
+
+    async def book_many(self, bookings: List[Dict[str, Any]], retries: int = BOOKING_RETRIES) -> List[str]:
+        """
+        Insert confirmed bookings, each unless it overlaps a confirmed
+        booking or an earlier one of the batch. Returns BOOKED, TAKEN or
+        CONFLICT per booking.
+
+        Optimistic, one commit per room: read the room's version, check
+        availability, and commit only if the version has not moved. A
+        concurrent booking of the same room moves it, so the checks are
+        repeated against the new state. Reads never wait on a lock.
+        """
+        outcomes = [TAKEN] * len(bookings)
+        by_room: Dict[str, List[int]] = {}
+        for i, booking in enumerate(bookings):
+            by_room.setdefault(booking["room_id"], []).append(i)
+        for room_id, indexes in by_room.items():
+            for attempt in range(retries):
+                if attempt:
+                    await asyncio.sleep(random.uniform(0, BOOKING_RETRY_DELAY * attempt))
+                # The version must be read before availability, so a commit that
+                # lands after the checks always shows up as a version change
+                version = await self.room_version(room_id)
+                batch = RoomIntervals()
+                accepted = []
+                for i in indexes:
+                    check_in, check_out = bookings[i]["check_in_date"], bookings[i]["check_out_date"]
+                    if batch.is_free(check_in, check_out) and await self.is_room_free(room_id, check_in, check_out):
+                        batch.add(check_in, check_out, bookings[i]["id"])
+                        accepted.append(i)
+                        outcomes[i] = BOOKED
+                    else:
+                        outcomes[i] = TAKEN
+                if not accepted or await self.commit_bookings(room_id, [bookings[i] for i in accepted], version):
+                    break
+            else:
+                for i in accepted:
+                    outcomes[i] = CONFLICT
+        return outcomes
+
+    async def list_bookings(self, guest_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def page_bookings(self, sort: str = "check_in_date", descending: bool = False,
+                            after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                            guest_name: Optional[str] = None, room_number: Optional[str] = None,
+                            status: Optional[str] = None, date_from: Optional[str] = None,
+                            date_to: Optional[str] = None,
+                            fields: Optional[Sequence[str]] = None) -> Page:
+        """
+        One page of bookings in BOOKING_SORTS[sort] order, like page_rooms.
+        date_from/date_to keep bookings whose stay overlaps [date_from, date_to).
+        """
+        raise NotImplementedError
+
+    async def get_booking(self, booking_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def update_booking(self, booking_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def is_room_free(self, room_id: str, check_in: str, check_out: str) -> bool:
+        """True if no confirmed booking of the room overlaps [check_in, check_out)."""
+        raise NotImplementedError
+
+    async def free_room_ids(self, check_in: str, check_out: str) -> List[str]:
+        raise NotImplementedError
+
+    # Room states
+    async def list_room_states(self) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get_room_state(self, room_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def update_room_state(self, room_id: str, fields: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class MemoryStorage(Storage):
+    """
+    In-process storage; state is lost on restart and not shared between
+    workers. Used for development and tests.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.users = default_users()
+        self.rooms = []
+        self.bookings = []
+        self.room_states = {}
+        # Secondary room indexes, kept in step with self.rooms by _index_room
+        self._rooms_by_id: Dict[str, Dict[str, Any]] = {}
+        self._rooms_by_number: Dict[str, Dict[str, Any]] = {}
+        self._room_ids_by_status: Dict[str, Dict[str, None]] = {}
+        self._room_sorts = {sort: SortedIndex(fields) for sort, fields in ROOM_SORTS.items()}
+        # The same orders split by status and by type, for filtered pages
+        self._room_sorts_by_status = {sort: PartitionedIndex("status", fields) for sort, fields in ROOM_SORTS.items()}
+        self._room_sorts_by_type = {sort: PartitionedIndex("type", fields) for sort, fields in ROOM_SORTS.items()}
+        self.availability = AvailabilityIndex()
+        self._bookings_by_id: Dict[str, Dict[str, Any]] = {}
+        self._booking_sorts = {sort: SortedIndex(fields) for sort, fields in BOOKING_SORTS.items()}
+        self._booking_sorts_by_status = {sort: PartitionedIndex("status", fields) for sort, fields in BOOKING_SORTS.items()}
+        # Bookings per guest and per room, as ordered sets of ids
+        self._booking_ids_by_guest: Dict[str, Dict[str, None]] = {}
+        self._booking_ids_by_room: Dict[str, Dict[str, None]] = {}
+        self._room_versions: Dict[str, int] = {}
+        for room in default_rooms():
+            self.add_room(room)
+            self.room_states[room["id"]] = initial_room_state()
+
+    def add_room(self, room: Dict[str, Any]):
+        self.rooms.append(room)
+        self._index_room(room)
+        self._changed("rooms", room["id"])
+
+    def _index_room(self, room: Dict[str, Any]):
+        self._rooms_by_id[room["id"]] = room
+        self._rooms_by_number[room["number"]] = room
+        # Dicts as ordered sets: status listings keep insertion order
+        self._room_ids_by_status.setdefault(room["status"], {})[room["id"]] = None
+        for indexes in (self._room_sorts, self._room_sorts_by_status, self._room_sorts_by_type):
+            for index in indexes.values():
+                index.add(room)
+
+    def _unindex_room(self, room: Dict[str, Any]):
+        self._rooms_by_number.pop(room["number"], None)
+        ids = self._room_ids_by_status.get(room["status"])
+        if ids is not None:
+            ids.pop(room["id"], None)
+        for indexes in (self._room_sorts, self._room_sorts_by_status, self._room_sorts_by_type):
+            for index in indexes.values():
+                index.remove(room)
+
+    def _index_booking(self, booking: Dict[str, Any]):
+        self._booking_ids_by_guest.setdefault(booking["guest_name"], {})[booking["id"]] = None
+        self._booking_ids_by_room.setdefault(booking["room_number"], {})[booking["id"]] = None
+        for indexes in (self._booking_sorts, self._booking_sorts_by_status):
+            for index in indexes.values():
+                index.add(booking)
+        if booking["status"] == "confirmed":
+            self.availability.add(booking["room_id"], booking["check_in_date"], booking["check_out_date"], booking["id"])
+
+    def _unindex_booking(self, booking: Dict[str, Any]):
+        self._booking_ids_by_guest.get(booking["guest_name"], {}).pop(booking["id"], None)
+        self._booking_ids_by_room.get(booking["room_number"], {}).pop(booking["id"], None)
+        for indexes in (self._booking_sorts, self._booking_sorts_by_status):
+            for index in indexes.values():
+                index.remove(booking)
+        if booking["status"] == "confirmed":
+            self.availability.remove(booking["room_id"], booking["check_in_date"], booking["id"])
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self.users.get(username)
+
+    async def add_user(self, user: Dict[str, Any]) -> bool:
+        if user["username"] in self.users:
+            return False
+        self.users[user["username"]] = user
+        return True
+
+    async def list_rooms(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        if status is None:
+            return self.rooms
+        by_id = self._rooms_by_id
+        return [by_id[room_id] for room_id in self._room_ids_by_status.get(status, ())]
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        return self._rooms_by_id.get(room_id)
+
+    async def get_room_by_number(self, number: str) -> Optional[Dict[str, Any]]:
+        return self._rooms_by_number.get(number)
+
+    async def update_room(self, room_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        room = self._rooms_by_id.get(room_id)
+        if room is not None:
+            # No await between unindex and reindex, so readers never see a half-updated index
+            self._unindex_room(room)
+            room.update(fields)
+            self._index_room(room)
+            self._changed("rooms", room_id)
+        return room
+
+    async def room_status_counts(self) -> Dict[str, int]:
+        return {status: len(ids) for status, ids in self._room_ids_by_status.items() if ids}
+
+    async def page_rooms(self, sort: str = "number", descending: bool = False,
+                         after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                         status: Optional[str] = None, room_type: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None) -> Page:
+        def predicate(room):
+            return ((status is None or room["status"] == status)
+                    and (room_type is None or room.get("type") == room_type))
+
+        # Page through the smaller matching partition; the predicate handles the other filter
+        index = self._room_sorts[sort]
+        if status is not None:
+            index = self._room_sorts_by_status[sort].partition(status)
+        if room_type is not None:
+            by_type = self._room_sorts_by_type[sort].partition(room_type)
+            if status is None or len(by_type) < len(index):
+                index = by_type
+        rooms, next_key = index.page(limit, after, descending, predicate)
+        return [project(room, fields) for room in rooms], next_key
+
+    async def add_booking(self, booking: Dict[str, Any]):
+        self.bookings.append(booking)
+        self._bookings_by_id[booking["id"]] = booking
+        self._index_booking(booking)
+        self._room_versions[booking["room_id"]] = self._room_versions.get(booking["room_id"], 0) + 1
+        self._changed("bookings", booking["id"])
+
+    async def room_version(self, room_id: str) -> int:
+        return self._room_versions.get(room_id, 0)
+
+    async def commit_bookings(self, room_id: str, bookings: List[Dict[str, Any]], version: int) -> bool:
+        # Check and inserts run without awaiting anything that could interleave
+        if self._room_versions.get(room_id, 0) != version:
+            return False
+        for booking in bookings:
+            await self.add_booking(booking)
+        return True
+
+    async def list_bookings(self, guest_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        if guest_name is None:
+            return self.bookings
+        by_id = self._bookings_by_id
+        return [by_id[booking_id] for booking_id in self._booking_ids_by_guest.get(guest_name, ())]
+
+    async def page_bookings(self, sort: str = "check_in_date", descending: bool = False,
+                            after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                            guest_name: Optional[str] = None, room_number: Optional[str] = None,
+                            status: Optional[str] = None, date_from: Optional[str] = None,
+                            date_to: Optional[str] = None,
+                            fields: Optional[Sequence[str]] = None) -> Page:
+        index = self._booking_sorts[sort]
+
+        def predicate(booking):
+            return ((guest_name is None or booking["guest_name"] == guest_name)
+                    and (room_number is None or booking["room_number"] == room_number)
+                    and (status is None or booking["status"] == status)
+                    and (date_from is None or booking["check_out_date"] > date_from)
+                    and (date_to is None or booking["check_in_date"] < date_to))
+
+        partition = None
+        if guest_name is not None:
+            partition = self._booking_ids_by_guest.get(guest_name, {})
+        if room_number is not None:
+            room_ids = self._booking_ids_by_room.get(room_number, {})
+            if partition is None or len(room_ids) < len(partition):
+                partition = room_ids
+        if partition is not None:
+            # A guest or room partition is small: sort it rather than walk the whole index
+            docs = sorted((self._bookings_by_id[booking_id] for booking_id in partition),
+                          key=index.key, reverse=descending)
+            if after is not None:
+                docs = [doc for doc in docs if (index.key(doc) < after if descending else index.key(doc) > after)]
+        else:
+            if status is not None:
+                index = self._booking_sorts_by_status[sort].partition(status)
+            # Date filters on the sort field itself bound the walk
+            docs = index.scan(after, descending,
+                              above=date_from if sort == "check_out_date" else None,
+                              below=date_to if sort == "check_in_date" else None)
+        bookings, next_key = take_page(docs, index.key, limit, predicate)
+        return [project(booking, fields) for booking in bookings], next_key
+
+    async def get_booking(self, booking_id: str) -> Optional[Dict[str, Any]]:
+        return self._bookings_by_id.get(booking_id)
+
+    async def update_booking(self, booking_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        booking = self._bookings_by_id.get(booking_id)
+        if booking is None:
+            return None
+        self._unindex_booking(booking)
+        booking.update(fields)
+        self._index_booking(booking)
+        self._changed("bookings", booking_id)
+        return booking
+
+    async def is_room_free(self, room_id: str, check_in: str, check_out: str) -> bool:
+        return self.availability.is_free(room_id, check_in, check_out)
+
+    async def free_room_ids(self, check_in: str, check_out: str) -> List[str]:
+        return self.availability.free_rooms(self._rooms_by_id, check_in, check_out)
+
+    async def list_room_states(self) -> Dict[str, Dict[str, Any]]:
+        return self.room_states
+
+    async def get_room_state(self, room_id: str) -> Optional[Dict[str, Any]]:
+        return self.room_states.get(room_id)
+
+    async def update_room_state(self, room_id: str, fields: Dict[str, Any]):
+        if room_id in self.room_states:
+            self.room_states[room_id].update(fields)
+            self._changed("room_states", room_id)
+
+
+# Unconfirmed booking rows left by a crashed commit are deleted after this many seconds
+PENDING_BOOKING_TTL = 3600
+
+
+class MongoStorage(Storage):
+    """
+    MongoDB storage through the motor async driver, shared by all workers.
+    Empty collections are seeded with the same demo data as MemoryStorage.
+
+    Booking commits run in a transaction when the server supports them
+    (replica set or sharded cluster). On a standalone server they insert
+    the bookings as "pending", move the room's version recording the
+    commit's id, then confirm the rows; pending rows are invisible to every
+    read, and a commit whose writer died after winning the version is
+    finished by the next room_version() of that room.
+    """
+
+    def __init__(self, url: str, database: str = "hotel_management"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        super().__init__()
+        self.client = AsyncIOMotorClient(url)
+        self.db = self.client.get_default_database(database)
+        self.transactions = False
+
+    async def init(self):
+        await self.db.users.create_index("username", unique=True)
+        await self.db.rooms.create_index("id", unique=True)
+        await self.db.rooms.create_index("number", unique=True)
+        await self.db.rooms.create_index("status")
+        for sort_fields in ROOM_SORTS.values():
+            await self.db.rooms.create_index([(field, 1) for field in sort_fields + ("id",)])
+        await self.db.bookings.create_index("id", unique=True)
+        await self.db.bookings.create_index([("guest_name", 1), ("check_in_date", 1), ("id", 1)])
+        for sort_fields in BOOKING_SORTS.values():
+            await self.db.bookings.create_index([(field, 1) for field in sort_fields + ("id",)])
+        await self.db.bookings.create_index([("room_id", 1), ("check_in_date", 1), ("check_out_date", 1)])
+        await self.db.bookings.create_index([("check_in_date", 1), ("check_out_date", 1)])
+        await self.db.room_states.create_index("room_id", unique=True)
+        await self.db.room_versions.create_index("room_id", unique=True)
+        await self.db.bookings.create_index("txn", sparse=True)
+        # Only pending rows carry pending_at, so confirmed bookings never expire
+        await self.db.bookings.create_index("pending_at", expireAfterSeconds=PENDING_BOOKING_TTL)
+
+        from pymongo.errors import BulkWriteError
+
+        self.transactions = await self._supports_transactions()
+
+        # Several workers may start at once; the unique indexes let only one of them seed
+        if await self.db.users.estimated_document_count() == 0:
+            try:
+                await self.db.users.insert_many(list(default_users().values()), ordered=False)
+            except BulkWriteError:
+                pass
+        if await self.db.rooms.estimated_document_count() == 0:
+            rooms = default_rooms()
+            try:
+                await self.db.rooms.insert_many(rooms)
+            except BulkWriteError:
+                return
+            await self.db.room_states.insert_many(
+                [{"room_id": room["id"], **initial_room_state()} for room in rooms]
+            )
+
+    async def _supports_transactions(self) -> bool:
+        from pymongo.errors import PyMongoError
+
+        # Replica set members and mongos do; a standalone server does not
+        try:
+            hello = await self.client.admin.command("hello")
+        except PyMongoError:
+            return False
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    async def close(self):
+        self.client.close()
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.db.users.find_one({"username": username}, {"_id": 0})
+
+    async def add_user(self, user: Dict[str, Any]) -> bool:
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            await self.db.users.insert_one(dict(user))
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def list_rooms(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = {} if status is None else {"status": status}
+        return await self.db.rooms.find(query, {"_id": 0}).sort("number", 1).to_list(None)
+
+    async def _page(self, collection, query: Dict[str, Any], sort_fields: Sequence[str], descending: bool,
+                    after: Optional[Tuple[Any, ...]], limit: int, fields: Optional[Sequence[str]]) -> Page:
+        key_fields = tuple(sort_fields) + ("id",)
+        if after is not None:
+            # Keyset condition: (a, b, id) > (a0, b0, id0), expanded into an $or.
+            # Missing fields are "" in keys, as in SortedIndex
+            op = "$lt" if descending else "$gt"
+            clauses = []
+            for i, field in enumerate(key_fields):
+                clause = {prefix: after[j] if after[j] != "" else {"$in": [None, ""]}
+                          for j, prefix in enumerate(key_fields[:i])}
+                clause[field] = {op: after[i]}
+                clauses.append(clause)
+            query = {"$and": [query, {"$or": clauses}]}
+        projection = {"_id": 0}
+        if fields:
+            projection.update({field: 1 for field in (*fields, *key_fields)})
+        direction = -1 if descending else 1
+        cursor = self.db[collection].find(query, projection).sort([(field, direction) for field in key_fields])
+        docs = await cursor.limit(limit + 1).to_list(None)
+        next_key = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_key = tuple(docs[-1].get(field) or "" for field in key_fields)
+        return [project(doc, fields) for doc in docs], next_key
+
+    async def page_rooms(self, sort: str = "number", descending: bool = False,
+                         after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                         status: Optional[str] = None, room_type: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None) -> Page:
+        query = {}
+        if status is not None:
+            query["status"] = status
+        if room_type is not None:
+            query["type"] = room_type
+        return await self._page("rooms", query, ROOM_SORTS[sort], descending, after, limit, fields)
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.rooms.find_one({"id": room_id}, {"_id": 0})
+
+    async def get_room_by_number(self, number: str) -> Optional[Dict[str, Any]]:
+        return await self.db.rooms.find_one({"number": number}, {"_id": 0})
+
+    async def update_room(self, room_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        from pymongo import ReturnDocument
+
+        room = await self.db.rooms.find_one_and_update(
+            {"id": room_id}, {"$set": fields}, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        self._changed("rooms", room_id)
+        return room
+
+    async def room_status_counts(self) -> Dict[str, int]:
+        counts = {}
+        async for row in self.db.rooms.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+    async def add_booking(self, booking: Dict[str, Any]):
+        await self.db.bookings.insert_one(dict(booking))
+        await self.db.room_versions.update_one({"room_id": booking["room_id"]}, {"$inc": {"version": 1}}, upsert=True)
+        self._changed("bookings", booking["id"])
+
+    async def room_version(self, room_id: str) -> int:
+        doc = await self.db.room_versions.find_one({"room_id": room_id}, {"_id": 0, "version": 1, "txn": 1})
+        if doc is None:
+            return 0
+        if doc.get("txn"):
+            # The last commit won the version but has not confirmed its rows
+            # yet (or its writer died): finish it before anyone checks availability
+            await self._confirm(room_id, doc["txn"])
+        return doc["version"]
+
+    async def _confirm(self, room_id: str, txn: str):
+        await self.db.bookings.update_many(
+            {"txn": txn, "status": "pending"},
+            {"$set": {"status": "confirmed"}, "$unset": {"txn": "", "pending_at": ""}},
+        )
+        await self.db.room_versions.update_one({"room_id": room_id, "txn": txn}, {"$unset": {"txn": ""}})
+
+    async def _swap_version(self, room_id: str, version: int, update: Dict[str, Any], session=None) -> bool:
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            result = await self.db.room_versions.update_one(
+                {"room_id": room_id, "version": version}, update, upsert=True, session=session
+            )
+        except DuplicateKeyError:
+            return False  # no document at `version`, and the upsert hit the existing one
+        return result.matched_count == 1 or result.upserted_id is not None
+
+    async def commit_bookings(self, room_id: str, bookings: List[Dict[str, Any]], version: int) -> bool:
+        if self.transactions:
+            committed = await self._commit_in_transaction(room_id, bookings, version)
+        else:
+            committed = await self._commit_pending(room_id, bookings, version)
+        if committed:
+            for booking in bookings:
+                self._changed("bookings", booking["id"])
+        return committed
+
+    async def _commit_in_transaction(self, room_id: str, bookings: List[Dict[str, Any]], version: int) -> bool:
+        from pymongo.errors import PyMongoError
+
+        async with await self.client.start_session() as session:
+            try:
+                async with session.start_transaction():
+                    if not await self._swap_version(room_id, version, {"$inc": {"version": 1}}, session):
+                        await session.abort_transaction()
+                        return False
+                    await self.db.bookings.insert_many([dict(booking) for booking in bookings], session=session)
+            except PyMongoError as e:
+                # A concurrent commit of the room wrote the version first
+                if e.has_error_label("TransientTransactionError"):
+                    return False
+                raise
+        return True
+
+    async def _commit_pending(self, room_id: str, bookings: List[Dict[str, Any]], version: int) -> bool:
+        # Rows go in first, unconfirmed, so that once the version moves every
+        # attempt that reads it can confirm them (see room_version); a losing
+        # attempt's rows were never visible and are removed
+        txn = uuid.uuid4().hex
+        pending_at = datetime.utcnow()
+        await self.db.bookings.insert_many(
+            [{**booking, "status": "pending", "txn": txn, "pending_at": pending_at} for booking in bookings]
+        )
+        if not await self._swap_version(room_id, version, {"$inc": {"version": 1}, "$set": {"txn": txn}}):
+            await self.db.bookings.delete_many({"txn": txn})
+            return False
+        await self._confirm(room_id, txn)
+        return True
+
+    async def list_bookings(self, guest_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = {"status": {"$ne": "pending"}}
+        if guest_name is not None:
+            query["guest_name"] = guest_name
+        return await self.db.bookings.find(query, {"_id": 0}).to_list(None)
+
+    async def page_bookings(self, sort: str = "check_in_date", descending: bool = False,
+                            after: Optional[Tuple[Any, ...]] = None, limit: int = 100,
+                            guest_name: Optional[str] = None, room_number: Optional[str] = None,
+                            status: Optional[str] = None, date_from: Optional[str] = None,
+                            date_to: Optional[str] = None,
+                            fields: Optional[Sequence[str]] = None) -> Page:
+        # Rows of a commit in progress are never listed
+        query = {"status": {"$ne": "pending"}}
+        if status is not None:
+            query["status"] = {"$eq": status, "$ne": "pending"}
+        if guest_name is not None:
+            query["guest_name"] = guest_name
+        if room_number is not None:
+            query["room_number"] = room_number
+        if date_from is not None:
+            query["check_out_date"] = {"$gt": date_from}
+        if date_to is not None:
+            query["check_in_date"] = {"$lt": date_to}
+        return await self._page("bookings", query, BOOKING_SORTS[sort], descending, after, limit, fields)
+
+    async def get_booking(self, booking_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.bookings.find_one({"id": booking_id, "status": {"$ne": "pending"}}, {"_id": 0})
+
+    async def update_booking(self, booking_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        from pymongo import ReturnDocument
+
+        booking = await self.db.bookings.find_one_and_update(
+            {"id": booking_id, "status": {"$ne": "pending"}}, {"$set": fields},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        self._changed("bookings", booking_id)
+        return booking
+
+    def _overlapping(self, check_in: str, check_out: str) -> Dict[str, Any]:
+        return {"status": "confirmed", "check_in_date": {"$lt": check_out}, "check_out_date": {"$gt": check_in}}
+
+    async def is_room_free(self, room_id: str, check_in: str, check_out: str) -> bool:
+        query = {"room_id": room_id, **self._overlapping(check_in, check_out)}
+        return await self.db.bookings.find_one(query, {"_id": 1}) is None
+
+    async def free_room_ids(self, check_in: str, check_out: str) -> List[str]:
+        booked = set(await self.db.bookings.distinct("room_id", self._overlapping(check_in, check_out)))
+        return [room["id"] async for room in self.db.rooms.find({}, {"_id": 0, "id": 1}) if room["id"] not in booked]
+
+    async def list_room_states(self) -> Dict[str, Dict[str, Any]]:
+        states = {}
+        async for doc in self.db.room_states.find({}, {"_id": 0}):
+            states[doc.pop("room_id")] = doc
+        return states
+
+    async def get_room_state(self, room_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self.db.room_states.find_one({"room_id": room_id}, {"_id": 0, "room_id": 0})
+        return doc
+
+    async def update_room_state(self, room_id: str, fields: Dict[str, Any]):
+        await self.db.room_states.update_one({"room_id": room_id}, {"$set": fields})
+        self._changed("room_states", room_id)
+
+
+def create_storage(backend: str = "memory", mongo_url: Optional[str] = None) -> Storage:
+    if backend == "mongo":
+        if not mongo_url:
+            raise ValueError("MONGO_URL must be set for the mongo storage backend")
+        return MongoStorage(mongo_url)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend!r}")
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CachedState:
+    __slots__ = ("state", "version", "fetched_at")
+
+    def __init__(self, state: Dict[str, Any], version: int, fetched_at: float):
+        self.state = state
+        self.version = version
+        self.fetched_at = fetched_at
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class StateCache:
+    """
+    Latest known controller state per room.
+    Every change gives the room a new version, drawn from one counter for
+    the whole cache so a version is never reused even after a discard;
+    fetched_at records when the sensors were last read from the
+    controller, so callers can decide whether an entry is fresh enough.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedState] = {}
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _next_version(self) -> int:
+        self._version += 1
+        return self._version
+
+    def get(self, room_id: str, max_age: Optional[float] = None) -> Optional[CachedState]:
+        entry = self._entries.get(room_id)
+        if entry is None or (max_age is not None and entry.age > max_age):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def peek(self, room_id: str) -> Optional[CachedState]:
+        """Entry regardless of age, without counting a hit or miss."""
+        return self._entries.get(room_id)
+
+    def put(self, room_id: str, state: Dict[str, Any]) -> CachedState:
+        """
+        Store a full state read from the controller.
+        """
+        entry = self._entries.get(room_id)
+        merged = {**entry.state, **state} if entry else dict(state)
+        self._entries[room_id] = new_entry = CachedState(merged, self._next_version(), time.monotonic())
+        return new_entry
+
+    def update(self, room_id: str, fields: Dict[str, Any]) -> Optional[CachedState]:
+        """
+        Apply a partial change (e.g. a command that was acknowledged)
+        without touching the sensor read time.
+        """
+        entry = self._entries.get(room_id)
+        if entry is None:
+            return None
+        self._entries[room_id] = new_entry = CachedState({**entry.state, **fields}, self._next_version(), entry.fetched_at)
+        return new_entry
+
+    def discard(self, room_id: str):
+        self._entries.pop(room_id, None)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TelemetryPoller:
+    """
+    Background task that reads every room's controller on a fixed cadence
+    and feeds the results to a callback, with at most `concurrency` reads
+    in flight at once.
+    """
+
+    def __init__(self, room_ids: Callable[[], Awaitable[Iterable[str]]],
+                 read_state: Callable[[str], Awaitable[Dict[str, Any]]],
+                 on_state: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+                 interval: float = 10.0, concurrency: int = 50):
+        self.room_ids = room_ids
+        self.read_state = read_state
+        self.on_state = on_state
+        self.interval = interval
+        self.concurrency = concurrency
+        self.sweeps = 0
+        self.errors = 0
+        self.last_sweep_duration = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Telemetry sweep failed")
+            # Keep a steady cadence: a slow sweep shortens the pause after it
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def sweep(self):
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def poll(room_id: str):
+            async with semaphore:
+                try:
+                    state = await self.read_state(room_id)
+                except Exception as e:
+                    self.errors += 1
+                    logger.debug("Telemetry read for room %s failed: %r", room_id, e)
+                    return
+                try:
+                    await self.on_state(room_id, state)
+                except Exception:
+                    # A bad room must not abort the sweep for the others
+                    self.errors += 1
+                    logger.exception("Telemetry update for room %s failed", room_id)
+
+        await asyncio.gather(*(poll(room_id) for room_id in await self.room_ids()))
+        self.sweeps += 1
+        self.last_sweep_duration = time.monotonic() - started
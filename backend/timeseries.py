@@ -0,0 +1,176 @@
+from array import array
+from typing import Any, Dict, List, Optional
+
+METRICS = ("temperature", "humidity", "pressure")
+
+# Bucket widths in seconds; buckets are aligned to the Unix epoch (UTC)
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Default retention per room: 30 minutes of raw 10s samples, 2 hours of
+# minutes, 3 days of hours and 90 days of days. That is about 20KB per
+# room, so roughly 200MB for 10k rooms regardless of uptime.
+DEFAULT_RAW_CAPACITY = 180
+DEFAULT_ROLLUP_CAPACITY = {"minute": 120, "hour": 72, "day": 90}
+
+
+class Rollup:
+    """
+    Ring of fixed-width time buckets holding min/max/sum per metric and a
+    shared sample count. Samples are folded in as they arrive; a slot is
+    reset when a newer bucket maps onto it.
+    """
+
+    __slots__ = ("width", "capacity", "buckets", "counts", "mins", "maxs", "sums")
+
+    def __init__(self, width: int, capacity: int):
+        n = len(METRICS)
+        self.width = width
+        self.capacity = capacity
+        self.buckets = array("i", [-1]) * capacity
+        self.counts = array("I", [0]) * capacity
+        self.mins = array("f", [0.0]) * (capacity * n)
+        self.maxs = array("f", [0.0]) * (capacity * n)
+        self.sums = array("d", [0.0]) * (capacity * n)
+
+    def add(self, timestamp: float, values) -> None:
+        bucket = int(timestamp // self.width)
+        slot = bucket % self.capacity
+        n = len(METRICS)
+        base = slot * n
+        if self.buckets[slot] != bucket:
+            if bucket < self.buckets[slot]:
+                return  # older than anything retained in this slot
+            self.buckets[slot] = bucket
+            self.counts[slot] = 1
+            for i, value in enumerate(values):
+                self.mins[base + i] = self.maxs[base + i] = self.sums[base + i] = value
+            return
+        self.counts[slot] += 1
+        for i, value in enumerate(values):
+            if value < self.mins[base + i]:
+                self.mins[base + i] = value
+            if value > self.maxs[base + i]:
+                self.maxs[base + i] = value
+            self.sums[base + i] += value
+
+    def query(self, start: float, end: float) -> List[Dict[str, Any]]:
+        first = int(start // self.width)
+        last = int(end // self.width)
+        # Nothing older than `capacity` buckets can still be in the ring
+        first = max(first, last - self.capacity + 1)
+        n = len(METRICS)
+        points = []
+        for bucket in range(first, last + 1):
+            slot = bucket % self.capacity
+            if self.buckets[slot] != bucket:
+                continue
+            count = self.counts[slot]
+            base = slot * n
+            point = {"time": bucket * self.width, "count": count}
+            for i, metric in enumerate(METRICS):
+                point[metric] = {
+                    "min": round(self.mins[base + i], 2),
+                    "max": round(self.maxs[base + i], 2),
+                    "mean": round(self.sums[base + i] / count, 2),
+                }
+            points.append(point)
+        return points
+
+
+class RoomSeries:
+    """
+    Raw sample ring plus minute/hour/day rollups for one room.
+    """
+
+    __slots__ = ("times", "values", "head", "size", "rollups")
+
+    def __init__(self, raw_capacity: int, rollup_capacity: Dict[str, int]):
+        self.times = array("d", [0.0]) * raw_capacity
+        self.values = array("f", [0.0]) * (raw_capacity * len(METRICS))
+        self.head = 0
+        self.size = 0
+        self.rollups = {
+            name: Rollup(width, rollup_capacity[name]) for name, width in RESOLUTIONS.items()
+        }
+
+    def add(self, timestamp: float, values) -> None:
+        capacity = len(self.times)
+        n = len(METRICS)
+        self.times[self.head] = timestamp
+        self.values[self.head * n:(self.head + 1) * n] = array("f", values)
+        self.head = (self.head + 1) % capacity
+        self.size = min(self.size + 1, capacity)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, values)
+
+    def oldest_raw(self) -> Optional[float]:
+        if not self.size:
+            return None
+        capacity = len(self.times)
+        return self.times[(self.head - self.size) % capacity]
+
+    def raw(self, start: float, end: float) -> List[Dict[str, Any]]:
+        capacity = len(self.times)
+        n = len(METRICS)
+        points = []
+        for k in range(self.size):
+            slot = (self.head - self.size + k) % capacity
+            timestamp = self.times[slot]
+            if start <= timestamp <= end:
+                point = {"time": timestamp}
+                for i, metric in enumerate(METRICS):
+                    point[metric] = round(self.values[slot * n + i], 2)
+                points.append(point)
+        return points
+
+
+class TimeSeriesStore:
+    """
+    Sensor history for all rooms. Memory per room is fixed at creation,
+    so the total is bounded by the number of rooms.
+    """
+
+    def __init__(self, raw_capacity: int = DEFAULT_RAW_CAPACITY,
+                 rollup_capacity: Optional[Dict[str, int]] = None):
+        self.raw_capacity = raw_capacity
+        self.rollup_capacity = {**DEFAULT_ROLLUP_CAPACITY, **(rollup_capacity or {})}
+        self._rooms: Dict[str, RoomSeries] = {}
+
+    def record(self, room_id: str, timestamp: float, state: Dict[str, Any]) -> None:
+        try:
+            values = [float(state[metric]) for metric in METRICS]
+        except (KeyError, TypeError, ValueError):
+            return
+        series = self._rooms.get(room_id)
+        if series is None:
+            series = self._rooms[room_id] = RoomSeries(self.raw_capacity, self.rollup_capacity)
+        series.add(timestamp, values)
+
+    def choose_resolution(self, room_id: str, start: float, end: float) -> str:
+        """
+        Finest resolution whose retention still covers start.
+        """
+        series = self._rooms.get(room_id)
+        if series is None:
+            return "raw"
+        oldest = series.oldest_raw()
+        if oldest is not None and oldest <= start:
+            return "raw"
+        for name, width in RESOLUTIONS.items():
+            if end - start <= width * self.rollup_capacity[name]:
+                return name
+        return "day"
+
+    def query(self, room_id: str, start: float, end: float, resolution: str) -> List[Dict[str, Any]]:
+        series = self._rooms.get(room_id)
+        if series is None:
+            return []
+        if resolution == "raw":
+            return series.raw(start, end)
+        return series.rollups[resolution].query(start, end)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._rooms
+
+    def __len__(self) -> int:
+        return len(self._rooms)
@@ -0,0 +1,51 @@
+import uuid
+from typing import Dict, Optional, Tuple
+
+
+class Versions:
+    """
+    Change counters per collection and per document, bumped by storage
+    listeners. ETags combine a counter with a per-process epoch, so a tag
+    issued before a restart, or by another worker, never matches by accident.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._collections: Dict[str, int] = {}
+        self._documents: Dict[Tuple[str, str], int] = {}
+
+    def renew(self):
+        """Start a new epoch, so no tag issued so far matches any more."""
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def bump(self, collection: str, key: Optional[str] = None):
+        self._collections[collection] = self._collections.get(collection, 0) + 1
+        if key is not None:
+            self._documents[(collection, key)] = self._documents.get((collection, key), 0) + 1
+
+    def collection(self, collection: str) -> int:
+        return self._collections.get(collection, 0)
+
+    def document(self, collection: str, key: str) -> int:
+        return self._documents.get((collection, key), 0)
+
+    def etag(self, *parts) -> str:
+        return '"' + "-".join([self.epoch, *map(str, parts)]) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check: "*" or any listed tag equal to etag. Comparison is
+    weak, as RFC 9110 requires for If-None-Match, so W/ prefixes are ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -1,6 +1,7 @@
 import requests
 import unittest
 import json
+import time
 import sys
 from datetime import datetime, timedelta
 
@@ -162,6 +163,31 @@ class HotelManagementAPITester(unittest.TestCase):
             print(f"❌ Create booking error: {str(e)}")
             return None
 
+    def get_availability(self):
+        """Get rooms available for a date range"""
+        print("\n🔍 Testing availability search...")
+        
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"}
+            params = {
+                "from": (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d"),
+                "to": (datetime.now() + timedelta(days=32)).strftime("%Y-%m-%d")
+            }
+            response = requests.get(f"{self.base_url}/availability", params=params, headers=headers)
+            
+            if response.status_code == 200:
+                rooms = response.json()
+                print(f"✅ Availability search successful - Status: {response.status_code}")
+                print(f"Found {len(rooms)} available rooms")
+                return rooms
+            else:
+                print(f"❌ Availability search failed - Status: {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+        except Exception as e:
+            print(f"❌ Availability search error: {str(e)}")
+            return None
+
     def get_bookings(self):
         """Get user bookings"""
         print("\n🔍 Testing get bookings...")
@@ -183,6 +209,31 @@ class HotelManagementAPITester(unittest.TestCase):
             print(f"❌ Get bookings error: {str(e)}")
             return None
 
+    def cancel_booking(self):
+        """Cancel the booking created earlier"""
+        print("\n🔍 Testing cancel booking...")
+        
+        if not getattr(self, "booking_id", None):
+            print("❌ No booking ID available to cancel")
+            return None
+        
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"}
+            response = requests.delete(f"{self.base_url}/bookings/{self.booking_id}", headers=headers)
+            
+            if response.status_code == 200:
+                booking = response.json()
+                print(f"✅ Cancel booking successful - Status: {response.status_code}")
+                print(f"Booking status: {booking.get('status')}")
+                return booking
+            else:
+                print(f"❌ Cancel booking failed - Status: {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+        except Exception as e:
+            print(f"❌ Cancel booking error: {str(e)}")
+            return None
+
     def get_room_state(self):
         """Get room state"""
         print("\n🔍 Testing get room state...")
@@ -208,6 +259,31 @@ class HotelManagementAPITester(unittest.TestCase):
             print(f"❌ Get room state error: {str(e)}")
             return None
 
+    def get_room_states(self):
+        """Get the states of several rooms in one request"""
+        print("\n🔍 Testing get room states...")
+        
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"}
+            response = requests.get(
+                f"{self.base_url}/room-states",
+                headers=headers,
+                params={"ids": f"{self.room_id},no-such-room"}
+            )
+            
+            if response.status_code == 200:
+                room_states = response.json()
+                print(f"✅ Get room states successful - Status: {response.status_code}")
+                print(f"States: {len(room_states['states'])}, errors: {room_states['errors']}")
+                return room_states
+            else:
+                print(f"❌ Get room states failed - Status: {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+        except Exception as e:
+            print(f"❌ Get room states error: {str(e)}")
+            return None
+
     def control_room(self):
         """Control room (turn on lights)"""
         print("\n🔍 Testing room control...")
@@ -236,6 +312,23 @@ class HotelManagementAPITester(unittest.TestCase):
                 result = response.json()
                 print(f"✅ Room control successful - Status: {response.status_code}")
                 print(f"Control result: {json.dumps(result, indent=2)}")
+                
+                # With ?wait=false the command is only queued; poll until the controller has applied it
+                response = requests.post(
+                    f"{self.base_url}/room-states/{self.room_id}/control?wait=false",
+                    json=control_data,
+                    headers=headers
+                )
+                if response.status_code != 202:
+                    print(f"❌ Queued room control failed - Status: {response.status_code}")
+                    return None
+                command_id = response.json().get("command_id")
+                for _ in range(20):
+                    command = requests.get(f"{self.base_url}/commands/{command_id}", headers=headers).json()
+                    if command.get("status") in ("applied", "failed", "superseded"):
+                        print(f"Command status: {command['status']}")
+                        return result if command["status"] != "failed" else None
+                    time.sleep(0.1)
                 return result
             else:
                 print(f"❌ Room control failed - Status: {response.status_code}")
@@ -295,6 +388,90 @@ class HotelManagementAPITester(unittest.TestCase):
             print(f"❌ Bulk control error: {str(e)}")
             return None
 
+    def bulk_import_export(self):
+        """Test streaming bulk booking import and export"""
+        print("\n🔍 Testing bulk booking import/export...")
+        
+        try:
+            headers = {"Authorization": f"Bearer {self.admin_token}", "Content-Type": "text/csv"}
+            check_in = (datetime.now() + timedelta(days=400)).strftime("%Y-%m-%d")
+            check_out = (datetime.now() + timedelta(days=402)).strftime("%Y-%m-%d")
+            rows = [
+                "room_number,guest_name,check_in_date,check_out_date",
+                f"101,{self.test_user},{check_in},{check_out}",
+                f"101,{self.test_user},{check_in},{check_out}",
+            ]
+            response = requests.post(
+                f"{self.base_url}/admin/bookings/import",
+                data="\n".join(rows).encode(),
+                headers=headers
+            )
+            
+            if response.status_code != 200:
+                print(f"❌ Bulk import failed - Status: {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+            report = response.json()
+            print(f"Import report: {json.dumps(report, indent=2)}")
+            
+            response = requests.get(
+                f"{self.base_url}/admin/bookings/export",
+                params={"format": "csv", "from": check_in, "to": check_out},
+                headers={"Authorization": f"Bearer {self.admin_token}"},
+                stream=True
+            )
+            exported = [line for line in response.iter_lines(decode_unicode=True) if line]
+            if response.status_code == 200 and report["failed"] == 1 and len(exported) >= 2:
+                print(f"✅ Bulk import/export successful - {len(exported) - 1} bookings exported")
+                return report
+            else:
+                print(f"❌ Bulk export failed - Status: {response.status_code}")
+                return None
+        except Exception as e:
+            print(f"❌ Bulk import/export error: {str(e)}")
+            return None
+
+    def get_devices(self):
+        """Test the controller device registry"""
+        print("\n🔍 Testing device registry...")
+        
+        try:
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            response = requests.get(f"{self.base_url}/admin/devices", headers=headers)
+            
+            if response.status_code == 200:
+                registry = response.json()
+                print(f"✅ Device registry successful - Status: {response.status_code}")
+                print(f"Devices: {len(registry['devices'])}, routed rooms: {registry['routed_rooms']}")
+                return registry
+            else:
+                print(f"❌ Device registry failed - Status: {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+        except Exception as e:
+            print(f"❌ Device registry error: {str(e)}")
+            return None
+
+    def get_metrics(self):
+        """Test the Prometheus metrics endpoint"""
+        print("\n🔍 Testing metrics...")
+        
+        try:
+            # /metrics sits next to /api, not under it
+            metrics_url = self.base_url.rsplit("/api", 1)[0] + "/metrics"
+            response = requests.get(metrics_url)
+            
+            if response.status_code == 200 and "hotel_http_request_duration_seconds_bucket" in response.text:
+                print(f"✅ Metrics successful - Status: {response.status_code}")
+                return response.text
+            else:
+                print(f"❌ Metrics failed - Status: {response.status_code}")
+                print(f"Response: {response.text[:500]}")
+                return None
+        except Exception as e:
+            print(f"❌ Metrics error: {str(e)}")
+            return None
+
     def test_full_flow(self):
         """Run the full test flow"""
         try:
@@ -307,6 +484,10 @@ class HotelManagementAPITester(unittest.TestCase):
             self.assertIsNotNone(rooms, "Failed to get rooms")
             self.assertTrue(len(rooms) > 0, "No rooms available")
             
+            # Search availability
+            available_rooms = self.get_availability()
+            self.assertIsNotNone(available_rooms, "Failed to search availability")
+            
             # Create booking
             booking = self.create_booking()
             if not booking:
@@ -316,6 +497,11 @@ class HotelManagementAPITester(unittest.TestCase):
             bookings = self.get_bookings()
             self.assertIsNotNone(bookings, "Failed to get bookings")
             
+            # Cancel booking
+            if booking:
+                cancelled = self.cancel_booking()
+                self.assertIsNotNone(cancelled, "Failed to cancel booking")
+            
             # Try to get room state (might fail if not authorized)
             try:
                 room_state = self.get_room_state()
@@ -328,8 +514,12 @@ class HotelManagementAPITester(unittest.TestCase):
                         print("⚠️ Room control failed, but continuing with tests")
                 else:
                     print("⚠️ Room state access failed, but continuing with tests")
+                room_states = self.get_room_states()
             except Exception as e:
+                room_states = None
                 print(f"⚠️ Room state/control error: {str(e)}, but continuing with tests")
+            if room_states:
+                self.assertEqual([error["room_id"] for error in room_states["errors"]], ["no-such-room"])
             
             # Admin tests
             try:
@@ -344,9 +534,25 @@ class HotelManagementAPITester(unittest.TestCase):
                     print("✅ Bulk control successful")
                 else:
                     print("⚠️ Bulk control failed, but continuing with tests")
+                
+                bulk_bookings = self.bulk_import_export()
+                if bulk_bookings:
+                    print("✅ Bulk import/export successful")
+                else:
+                    print("⚠️ Bulk import/export failed, but continuing with tests")
+                
+                registry = self.get_devices()
+                if registry:
+                    print("✅ Device registry successful")
+                else:
+                    print("⚠️ Device registry failed, but continuing with tests")
             except Exception as e:
                 print(f"⚠️ Admin tests error: {str(e)}, but continuing with tests")
             
+            # Metrics
+            metrics = self.get_metrics()
+            self.assertIsNotNone(metrics, "Failed to get metrics")
+            
             print("\n✅ API testing completed with some warnings")
             
         except AssertionError as e:
@@ -0,0 +1,37 @@
+"""
+Helpers shared by load_test.py and the benchmarks.
+"""
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import httpx
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@asynccontextmanager
+async def in_process_client(base_url, timeout=60):
+    """
+    The app from backend/ behind an ASGI client, started on entry and shut
+    down on exit; yields (client, server module). Set any environment the
+    server reads at import time before entering.
+    """
+    sys.path.insert(0, BACKEND)
+    import server
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout) as client:
+        await server.app.router.startup()
+        try:
+            yield client, server
+        finally:
+            await server.app.router.shutdown()
@@ -0,0 +1,265 @@
+"""
+Concurrent booking stress test.
+
+Fires thousands of overlapping booking attempts at a handful of rooms and
+checks that no two confirmed bookings of a room overlap. Runs in-process
+against the in-memory storage, with extra awaits injected so attempts
+interleave the way they would against a real database, and against
+MongoDB when MONGO_URL is set. The MongoStorage commit path also runs
+in-process against mongomock_motor when it is installed.
+
+    python booking_stress_test.py
+    MONGO_URL=mongodb://localhost:27017/hotel_stress python booking_stress_test.py
+"""
+import asyncio
+import inspect
+import os
+import random
+import sys
+import unittest
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("TELEMETRY_INTERVAL", "0")
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import httpx
+
+from storage import BookingConflict, MemoryStorage, MongoStorage, Storage
+
+try:
+    import mongomock_motor
+except ImportError:
+    mongomock_motor = None
+
+ATTEMPTS = 3000
+START = date(2030, 1, 1)
+
+
+class InterleavingMemoryStorage(MemoryStorage):
+    """MemoryStorage whose booking steps yield to the event loop like network I/O would."""
+
+    lost_races = 0
+
+    async def _io(self):
+        for _ in range(random.randint(0, 3)):
+            await asyncio.sleep(0)
+
+    async def room_version(self, room_id):
+        await self._io()
+        return await super().room_version(room_id)
+
+    async def is_room_free(self, room_id, check_in, check_out):
+        await self._io()
+        return await super().is_room_free(room_id, check_in, check_out)
+
+    async def commit_bookings(self, room_id, bookings, version):
+        await self._io()
+        committed = await super().commit_bookings(room_id, bookings, version)
+        self.lost_races += not committed
+        return committed
+
+
+class YieldingCollection:
+    """Collection whose async operations yield to the event loop before and after, like network round trips."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            for _ in range(random.randint(0, 3)):
+                await asyncio.sleep(0)
+            result = await attr(*args, **kwargs)
+            for _ in range(random.randint(0, 3)):
+                await asyncio.sleep(0)
+            return result
+
+        return call
+
+
+class YieldingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.name = db.name
+
+    def __getattr__(self, name):
+        return YieldingCollection(self._db[name])
+
+    def __getitem__(self, name):
+        return YieldingCollection(self._db[name])
+
+
+class MockMongoStorage(MongoStorage):
+    """MongoStorage on mongomock_motor, every operation interleaving with the others."""
+
+    def __init__(self):
+        Storage.__init__(self)
+        self.client = mongomock_motor.AsyncMongoMockClient()
+        self.db = YieldingDatabase(self.client["hotel_stress"])
+        self.transactions = False
+
+    async def _supports_transactions(self):
+        return False
+
+
+def random_booking(room):
+    check_in = START + timedelta(days=random.randrange(30))
+    return {
+        "id": str(uuid.uuid4()),
+        "room_id": room["id"],
+        "room_number": room["number"],
+        "guest_name": f"guest{random.randrange(100)}",
+        "check_in_date": check_in.isoformat(),
+        "check_out_date": (check_in + timedelta(days=random.randint(1, 4))).isoformat(),
+        "status": "confirmed",
+        "created_at": check_in.isoformat(),
+    }
+
+
+async def attempt(db, booking):
+    try:
+        return "booked" if await db.book_room(booking) else "taken"
+    except BookingConflict:
+        return "conflict"
+
+
+class BookingStressTest(unittest.TestCase):
+    def assert_no_overlaps(self, bookings):
+        stays = {}
+        for booking in bookings:
+            if booking["status"] == "confirmed":
+                stays.setdefault(booking["room_id"], []).append((booking["check_in_date"], booking["check_out_date"]))
+        for room_id, room_stays in stays.items():
+            room_stays.sort()
+            for (_, previous_out), (check_in, _) in zip(room_stays, room_stays[1:]):
+                self.assertLessEqual(previous_out, check_in, f"Room {room_id} is double-booked")
+
+    def test_memory_storage(self):
+        async def run():
+            random.seed(21)
+            db = InterleavingMemoryStorage()
+            rooms = db.rooms[:3]
+            outcomes = Counter(await asyncio.gather(
+                *(attempt(db, random_booking(random.choice(rooms))) for _ in range(ATTEMPTS))
+            ))
+            print(f"\nMemory storage, {ATTEMPTS} attempts on {len(rooms)} rooms: {dict(outcomes)},"
+                  f" {db.lost_races} commits retried")
+            self.assertGreater(db.lost_races, 0, "attempts never raced")
+            self.assertEqual(outcomes["booked"], len(await db.list_bookings()))
+            self.assertGreater(outcomes["booked"], 0)
+            self.assertGreater(outcomes["taken"], 0)
+            self.assert_no_overlaps(await db.list_bookings())
+
+        asyncio.run(run())
+
+    @unittest.skipIf(mongomock_motor is None, "mongomock_motor not installed")
+    def test_mongo_commit_path(self):
+        async def run():
+            random.seed(21)
+            db = MockMongoStorage()
+            await db.init()
+            rooms = (await db.list_rooms())[:3]
+            seen = {}
+            original_is_room_free = db.is_room_free
+
+            async def watching_is_room_free(room_id, check_in, check_out):
+                # Readers running alongside the commits must only ever see committed bookings
+                seen.update((booking["id"], booking["status"]) for booking in await db.list_bookings())
+                return await original_is_room_free(room_id, check_in, check_out)
+
+            db.is_room_free = watching_is_room_free
+            outcomes = Counter(await asyncio.gather(
+                *(attempt(db, random_booking(random.choice(rooms))) for _ in range(ATTEMPTS // 3))
+            ))
+            print(f"\nMongo commit path (mongomock), {ATTEMPTS // 3} attempts on {len(rooms)} rooms: {dict(outcomes)}")
+            bookings = await db.list_bookings()
+            self.assertEqual(set(seen.values()), {"confirmed"})
+            rolled_back = set(seen) - {booking["id"] for booking in bookings}
+            self.assertEqual(len(rolled_back), 0, "readers saw bookings that were later rolled back")
+            self.assertEqual(outcomes["booked"], len(bookings))
+            self.assertGreater(outcomes["taken"], 0)
+            self.assert_no_overlaps(bookings)
+            # Nothing is left behind by the losing attempts
+            self.assertEqual(await db.client["hotel_stress"].bookings.count_documents({"status": "pending"}), 0)
+
+            # A writer that died after winning the version: the next reader of the room confirms its rows
+            room = rooms[0]
+            booking = random_booking(room)
+            booking["check_in_date"], booking["check_out_date"] = "2031-01-01", "2031-01-05"
+            version = await db.room_version(room["id"])
+            raw = db.client["hotel_stress"]
+            await raw.bookings.insert_one({**booking, "status": "pending", "txn": "dead", "pending_at": datetime.utcnow()})
+            self.assertIsNone(await db.get_booking(booking["id"]))
+            await raw.room_versions.update_one({"room_id": room["id"]}, {"$inc": {"version": 1}, "$set": {"txn": "dead"}})
+            self.assertEqual(await db.room_version(room["id"]), version + 1)
+            self.assertEqual((await db.get_booking(booking["id"]))["status"], "confirmed")
+            self.assertFalse(await db.book_room({**random_booking(room), "check_in_date": "2031-01-02",
+                                                 "check_out_date": "2031-01-03"}))
+
+        asyncio.run(run())
+
+    @unittest.skipUnless(os.environ.get("MONGO_URL"), "MONGO_URL not set")
+    def test_mongo_storage(self):
+        async def run():
+            random.seed(21)
+            db = MongoStorage(os.environ["MONGO_URL"], database=f"hotel_stress_{uuid.uuid4().hex[:8]}")
+            try:
+                await db.init()
+                rooms = (await db.list_rooms())[:3]
+                outcomes = Counter(await asyncio.gather(
+                    *(attempt(db, random_booking(random.choice(rooms))) for _ in range(ATTEMPTS // 3))
+                ))
+                print(f"\nMongo storage, {ATTEMPTS // 3} attempts on {len(rooms)} rooms: {dict(outcomes)}")
+                self.assertEqual(outcomes["booked"], len(await db.list_bookings()))
+                self.assert_no_overlaps(await db.list_bookings())
+            finally:
+                await db.client.drop_database(db.db.name)
+                await db.close()
+
+        asyncio.run(run())
+
+    def test_api(self):
+        import server
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+                await server.app.router.startup()
+                try:
+                    credentials = {"username": "stress_admin", "password": "stress", "role": "admin"}
+                    await client.post("/api/register", data=credentials)
+                    response = await client.post("/api/token", data=credentials)
+                    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                    rooms = [room for room in (await client.get("/api/rooms", headers=headers)).json()
+                             if room["status"] != "maintenance"]
+                    # Everyone wants the same week in the same few rooms
+                    requests = [
+                        client.post("/api/bookings", headers=headers, json={
+                            "room_id": rooms[i % len(rooms)]["id"],
+                            "guest_name": f"guest{i}",
+                            "check_in_date": "2030-06-01",
+                            "check_out_date": "2030-06-08",
+                        })
+                        for i in range(1000)
+                    ]
+                    statuses = Counter(response.status_code for response in await asyncio.gather(*requests))
+                    print(f"\nAPI, 1000 attempts on {len(rooms)} rooms: {dict(statuses)}")
+                    self.assertEqual(statuses[200], len(rooms))
+                    self.assertEqual(set(statuses) - {200, 400, 409}, set())
+                    self.assert_no_overlaps(await server.db.list_bookings())
+                finally:
+                    await server.app.router.shutdown()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
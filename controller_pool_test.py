@@ -0,0 +1,99 @@
+"""
+Controller connection tests against the in-process controller simulator.
+
+    python controller_pool_test.py
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.insert(0, BACKEND)
+
+import controller_pb2
+from controller_pool import ControllerBackoff, ControllerError, ControllerPool
+from controller_simulator import ControllerSimulator
+from fanout import fan_out
+from framing import FrameDecoder, encode_frame
+from health import HealthTracker
+
+
+class ControllerConnectionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_request_does_not_desync_connection(self):
+        async with ControllerSimulator(count=1, latency=0.3) as simulator:
+            host, port = simulator.addresses[0]
+            pool = ControllerPool()
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.get_state(host, port), 0.1)
+            # Slow enough that the late reply and the next one arrive in separate reads
+            simulator.latency = 0.05
+            # The late State reply must not be taken as the answer to GetInfo
+            info = await pool.get_info(host, port)
+            self.assertEqual(info.mac, simulator.controllers[0].info.mac)
+            state = await pool.get_state(host, port)
+            self.assertIn("lights_on", state)
+            await asyncio.sleep(0.3)
+            self.assertEqual((await pool.get_info(host, port)).mac, info.mac)
+            await pool.close()
+
+    async def test_fan_out_deadline_bounds_the_request(self):
+        async with ControllerSimulator(count=1, latency=0.3) as simulator:
+            host, port = simulator.addresses[0]
+            health = HealthTracker()
+            pool = ControllerPool(health=health)
+            results = await fan_out(["room"], lambda room: pool.get_state(host, port), timeout=0.1)
+            self.assertFalse(results[0]["ok"])
+            self.assertLess(results[0]["latency_ms"], 300)
+            # Running out of the caller's time says nothing about the device
+            self.assertEqual(health.get((host, port)).samples, 0)
+            simulator.latency = 0.05
+            self.assertEqual((await pool.get_info(host, port)).mac, simulator.controllers[0].info.mac)
+            await pool.close()
+
+    async def test_backoff_is_not_a_health_sample(self):
+        async with ControllerSimulator(count=1) as simulator:
+            host, port = simulator.addresses[0]
+        # The simulator is gone: connects are refused and the connection backs off
+        health = HealthTracker(failure_threshold=1, open_seconds=0.0)
+        pool = ControllerPool(health=health)
+        with self.assertRaises(ControllerError):
+            await pool.get_state(host, port)
+        device = health.get((host, port))
+        self.assertEqual((device.samples, device.state), (1, "open"))
+        # Half-open trial rejected by the local backoff: the device was not probed
+        with self.assertRaises(ControllerBackoff):
+            await pool.get_state(host, port)
+        self.assertEqual((device.samples, device.state), (1, "half_open"))
+        self.assertTrue(device.allow())
+        await pool.close()
+
+    async def test_malformed_framed_response_fails_only_its_request(self):
+        info = controller_pb2.ControllerResponse()
+        info.info.mac = "02:00:00:00:00:99"
+        replies = [b"\xff\xff\xff", info.SerializeToString()]
+
+        async def serve(reader, writer):
+            decoder = FrameDecoder("varint")
+            while replies:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for correlation_id, _ in decoder.feed(data):
+                    writer.write(encode_frame(replies.pop(0), correlation_id, "varint"))
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        host, port = server.sockets[0].getsockname()[:2]
+        pool = ControllerPool(framing="varint", timeout=2)
+        with self.assertRaisesRegex(ControllerError, "malformed"):
+            await pool.get_info(host, port)
+        # The connection keeps serving the requests after it
+        self.assertEqual((await pool.get_info(host, port)).mac, "02:00:00:00:00:99")
+        await pool.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,7 @@ const AdminTable = () => {
     rooms, 
     fetchRooms, 
     roomStates, 
-    fetchRoomState,
+    fetchRoomStates,
     isLoading 
   } = useStore();
   
@@ -15,18 +15,12 @@ const AdminTable = () => {
     fetchRooms();
   }, [fetchRooms]);
   
-  // Once we have rooms, fetch all their states
+  // Once we have rooms, fetch all their states in one request
   useEffect(() => {
-    const fetchAllRoomStates = async () => {
-      for (const room of rooms) {
-        await fetchRoomState(room.id);
-      }
-    };
-    
     if (rooms.length > 0) {
-      fetchAllRoomStates();
+      fetchRoomStates(rooms.map(room => room.id));
     }
-  }, [rooms, fetchRoomState]);
+  }, [rooms, fetchRoomStates]);
 
   // Combine room data with state data
   const combinedRoomData = rooms.map(room => {
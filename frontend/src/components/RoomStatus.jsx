@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect } from 'react';
 import useStore from '../store/useStore';
 
 // Sub-components
@@ -64,6 +64,7 @@ const SensorDisplay = ({ name, value, unit, icon }) => (
 const RoomStatus = ({ roomId }) => {
   const { 
     fetchRoomState, 
+    subscribeRoomStates,
     sendControlCommand, 
     roomStates, 
     isLoading, 
@@ -71,7 +72,6 @@ const RoomStatus = ({ roomId }) => {
     isOffline
   } = useStore();
   
-  const [polling, setPolling] = useState(null);
   const roomState = roomStates[roomId];
 
   // Auto-update room state
@@ -79,22 +79,28 @@ const RoomStatus = ({ roomId }) => {
     // Initial fetch
     fetchRoomState(roomId);
     
-    // Set up polling interval (only if online)
-    if (!isOffline) {
-      const intervalId = setInterval(() => {
-        fetchRoomState(roomId);
-      }, 10000); // Poll every 10 seconds
-      
-      setPolling(intervalId);
+    if (isOffline) {
+      return undefined;
     }
     
+    // Changes are pushed by the server; poll only if the stream is unavailable
+    let intervalId = null;
+    const unsubscribe = subscribeRoomStates([roomId], () => {
+      if (!intervalId) {
+        intervalId = setInterval(() => {
+          fetchRoomState(roomId);
+        }, 10000); // Poll every 10 seconds
+      }
+    });
+    
     // Cleanup function
     return () => {
-      if (polling) {
-        clearInterval(polling);
+      unsubscribe();
+      if (intervalId) {
+        clearInterval(intervalId);
       }
     };
-  }, [fetchRoomState, roomId, isOffline]);
+  }, [fetchRoomState, subscribeRoomStates, roomId, isOffline]);
 
   // Control handlers
   const handleLightToggle = async (newState) => {
@@ -138,7 +144,15 @@ const RoomStatus = ({ roomId }) => {
           </span>
         </div>
       )}
-      
+
+      {roomState?.stale && !isOffline && (
+        <div className="bg-yellow-100 border border-yellow-400 text-yellow-700 px-4 py-3 rounded mb-4" role="alert">
+          <span className="block sm:inline">
+            Контроллер комнаты не отвечает. Показано последнее известное состояние.
+          </span>
+        </div>
+      )}
+
       <div className="grid grid-cols-1 md:grid-cols-2 gap-4 mb-6">
         <div className="space-y-4">
           <LightToggle 
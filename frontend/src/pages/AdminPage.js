@@ -30,7 +30,7 @@ const AdminPage = () => {
     rooms, 
     fetchRooms, 
     roomStates, 
-    fetchRoomState, 
+    fetchRoomStates, 
     isLoading, 
     error 
   } = useStore();
@@ -44,12 +44,9 @@ const AdminPage = () => {
 
   useEffect(() => {
     if (rooms.length > 0) {
-      // Fetch room states for all rooms
-      rooms.forEach(room => {
-        fetchRoomState(room.id);
-      });
+      fetchRoomStates(rooms.map(room => room.id));
     }
-  }, [rooms, fetchRoomState]);
+  }, [rooms, fetchRoomStates]);
 
   const handleBulkControl = async (command) => {
     await sendBulkControl(command);
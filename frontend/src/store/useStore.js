@@ -2,6 +2,33 @@ import { create } from 'zustand';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+// Largest page (and id list) the API accepts, MAX_PAGE_SIZE on the server
+const MAX_PAGE_SIZE = 1000;
+
+// Last response per URL and query, revalidated with If-None-Match so the
+// server can answer 304 instead of resending an unchanged payload
+const etagCache = new Map();
+
+const conditionalGet = async (url, config = {}) => {
+  const key = `${url}?${new URLSearchParams(config.params || {})}`;
+  const cached = etagCache.get(key);
+  const response = await axios.get(url, {
+    ...config,
+    headers: {
+      ...config.headers,
+      ...(cached ? { 'If-None-Match': cached.etag } : {})
+    },
+    validateStatus: status => (status >= 200 && status < 300) || status === 304
+  });
+  if (response.status === 304 && cached) {
+    return { ...response, data: cached.data, headers: { ...cached.headers, ...response.headers } };
+  }
+  const etag = response.headers.etag;
+  if (etag) {
+    etagCache.set(key, { etag, data: response.data, headers: response.headers });
+  }
+  return response;
+};
 
 const useStore = create((set, get) => ({
   // Authentication
@@ -17,6 +44,7 @@ const useStore = create((set, get) => ({
   rooms: [],
   selectedRoom: null,
   bookings: [],
+  bookingsCursor: null,
   roomStates: {},
   
   // Set error with auto-clear
@@ -127,6 +155,7 @@ const useStore = create((set, get) => ({
   // Logout
   logout: () => {
     localStorage.removeItem('token');
+    etagCache.clear();
     set({ 
       isAuthenticated: false,
       user: null,
@@ -141,11 +170,19 @@ const useStore = create((set, get) => ({
     try {
       const { token } = get();
       
-      const response = await axios.get(`${BACKEND_URL}/rooms`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
+      // The list is paged; follow X-Next-Cursor until the last page
+      let rooms = [];
+      let cursor = null;
+      do {
+        const response = await conditionalGet(`${BACKEND_URL}/rooms`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { limit: MAX_PAGE_SIZE, ...(cursor ? { cursor } : {}) }
+        });
+        rooms = rooms.concat(response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
       
-      set({ rooms: response.data, isLoading: false });
+      set({ rooms, isLoading: false });
     } catch (error) {
       console.error('Failed to fetch rooms:', error);
       set({ 
@@ -161,7 +198,7 @@ const useStore = create((set, get) => ({
     try {
       const { token } = get();
       
-      const response = await axios.get(`${BACKEND_URL}/rooms/number/${roomNumber}`, {
+      const response = await conditionalGet(`${BACKEND_URL}/rooms/number/${roomNumber}`, {
         headers: { Authorization: `Bearer ${token}` }
       });
       
@@ -182,7 +219,7 @@ const useStore = create((set, get) => ({
     try {
       const { token } = get();
       
-      const response = await axios.get(`${BACKEND_URL}/room-states/${roomId}`, {
+      const response = await conditionalGet(`${BACKEND_URL}/room-states/${roomId}`, {
         headers: { Authorization: `Bearer ${token}` }
       });
       
@@ -204,6 +241,98 @@ const useStore = create((set, get) => ({
     }
   },
   
+  // Fetch the states of many rooms in one request; rooms that could not be
+  // read come back under errors and keep their previous state
+  fetchRoomStates: async (roomIds) => {
+    try {
+      const { token } = get();
+      
+      // The server takes at most MAX_PAGE_SIZE ids per request
+      const chunks = [];
+      for (let i = 0; i < roomIds.length; i += MAX_PAGE_SIZE) {
+        chunks.push(roomIds.slice(i, i + MAX_PAGE_SIZE));
+      }
+      const responses = await Promise.all(chunks.map(ids => conditionalGet(`${BACKEND_URL}/room-states`, {
+        params: { ids: ids.join(',') },
+        headers: { Authorization: `Bearer ${token}` }
+      })));
+      const data = {
+        states: responses.flatMap(response => response.data.states),
+        errors: responses.flatMap(response => response.data.errors)
+      };
+      
+      set(state => ({
+        roomStates: {
+          ...state.roomStates,
+          ...Object.fromEntries(data.states.map(roomState => [roomState.room_id, roomState]))
+        }
+      }));
+      
+      return data;
+    } catch (error) {
+      console.error('Failed to fetch room states:', error);
+      set({ 
+        error: `Failed to fetch room states. Please try again.`,
+        isOffline: error.message === 'Network Error'
+      });
+      return null;
+    }
+  },
+  
+  // Subscribe to pushed room state changes (WebSocket, falling back to SSE).
+  // Returns an unsubscribe function; onFailure is called if neither transport works.
+  subscribeRoomStates: (roomIds, onFailure) => {
+    const { token } = get();
+    const params = new URLSearchParams({ token });
+    roomIds.forEach((id) => params.append('room_id', id));
+    
+    const applyChanges = (data) => {
+      const { room_id, changes } = JSON.parse(data);
+      set(state => ({
+        roomStates: {
+          ...state.roomStates,
+          [room_id]: { ...state.roomStates[room_id], room_id, ...changes }
+        }
+      }));
+    };
+    
+    let socket = null;
+    let source = null;
+    let closed = false;
+    
+    const openEventSource = () => {
+      if (closed || typeof EventSource === 'undefined') {
+        if (!closed && onFailure) onFailure();
+        return;
+      }
+      source = new EventSource(`${BACKEND_URL}/room-states/stream?${params}`);
+      source.onmessage = (event) => applyChanges(event.data);
+      source.onerror = () => {
+        // EventSource reconnects by itself unless the server refused us
+        if (source.readyState === EventSource.CLOSED && onFailure) onFailure();
+      };
+    };
+    
+    if (typeof WebSocket !== 'undefined') {
+      let opened = false;
+      socket = new WebSocket(`${BACKEND_URL.replace(/^http/, 'ws')}/ws/room-states?${params}`);
+      socket.onopen = () => { opened = true; };
+      socket.onmessage = (event) => applyChanges(event.data);
+      socket.onclose = () => {
+        if (!closed && !opened) openEventSource();
+        else if (!closed && onFailure) onFailure();
+      };
+    } else {
+      openEventSource();
+    }
+    
+    return () => {
+      closed = true;
+      if (socket) socket.close();
+      if (source) source.close();
+    };
+  },
+  
   // Send control command to a room
   sendControlCommand: async (roomId, command, state = null) => {
     set({ isLoading: true });
@@ -265,18 +394,25 @@ const useStore = create((set, get) => ({
     }
   },
   
-  // Fetch bookings
-  fetchBookings: async () => {
+  // Fetch bookings: one page, newest stays first unless params say otherwise
+  // (status, room_number, from, to, sort, limit, fields)
+  fetchBookings: async (params = {}) => {
     set({ isLoading: true });
     
     try {
       const { token } = get();
       
-      const response = await axios.get(`${BACKEND_URL}/bookings`, {
-        headers: { Authorization: `Bearer ${token}` }
+      const response = await conditionalGet(`${BACKEND_URL}/bookings`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { sort: '-check_in_date', ...params }
       });
       
-      set({ bookings: response.data, isLoading: false });
+      set({
+        bookings: response.data,
+        bookingsCursor: response.headers['x-next-cursor'] || null,
+        isLoading: false
+      });
+      return response.data;
     } catch (error) {
       console.error('Failed to fetch bookings:', error);
       set({ 
@@ -284,6 +420,7 @@ const useStore = create((set, get) => ({
         isLoading: false,
         isOffline: error.message === 'Network Error'
       });
+      return [];
     }
   },
   
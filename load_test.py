@@ -0,0 +1,305 @@
+"""
+Load test for the hotel management API.
+
+Runs a mix of concurrent scenarios against the app in-process (ASGI) or a
+running server, then prints throughput and latency percentiles per
+endpoint. Thresholds turn the report into a pass/fail check: the exit
+status is 1 when any of them is violated.
+
+Scenarios:
+    dashboard   staff dashboards polling the room list and room states
+                with If-None-Match, like RoomStatus.jsx
+    login       bursts of concurrent logins
+    booking     guests racing to book the same rooms; "not available"
+                answers are expected and not counted as errors
+    bulk        an admin switching all lights on and off
+
+    python load_test.py                                 # in-process, all scenarios, 20s
+    python load_test.py --url http://localhost:8001 --duration 60
+    python load_test.py --scenario dashboard --scenario booking --rooms 500 \\
+        --threshold "GET /api/rooms:p99<=100" --threshold "*:error_rate<=0.01"
+
+A threshold is ENDPOINT:METRIC<=VALUE or ENDPOINT:METRIC>=VALUE, where
+ENDPOINT is a row of the report (or * for every row) and METRIC is one of
+p50, p95, p99 (milliseconds), rps or error_rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+from bench_utils import in_process_client, percentile
+
+SCENARIOS = ("dashboard", "login", "booking", "bulk")
+DEFAULT_THRESHOLDS = ("*:error_rate<=0.01",)
+THRESHOLD_PATTERN = re.compile(r"^(?P<endpoint>.+):(?P<metric>p50|p95|p99|rps|error_rate)(?P<op><=|>=)(?P<value>[\d.]+)$")
+
+
+class Recorder:
+    """
+    Latencies and outcomes per endpoint. Paths with ids are folded into
+    one row by the caller passing a template name.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    async def request(self, client, method, name, url, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self._record(name, time.perf_counter() - started, type(e).__name__, ok=False)
+            return None
+        ok = response.status_code in expected
+        self._record(name, time.perf_counter() - started, response.status_code, ok)
+        return response
+
+    def _record(self, name, elapsed, outcome, ok):
+        self.latencies.setdefault(name, []).append(elapsed)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[outcome] = statuses.get(outcome, 0) + 1
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        rows = {}
+        for name, samples in sorted(self.latencies.items()):
+            rows[name] = {
+                "requests": len(samples),
+                "rps": len(samples) / elapsed,
+                "p50": percentile(samples, 50) * 1000,
+                "p95": percentile(samples, 95) * 1000,
+                "p99": percentile(samples, 99) * 1000,
+                "error_rate": self.errors.get(name, 0) / len(samples),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[name].items(), key=str)},
+            }
+        return rows
+
+
+def print_report(rows, elapsed):
+    width = max([len(name) for name in rows] + [8])
+    print(f"\n{'endpoint':<{width}} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+    for name, row in rows.items():
+        statuses = " ".join(f"{status}:{count}" for status, count in row["statuses"].items())
+        print(f"{name:<{width}} {row['requests']:>9} {row['rps']:>8.1f} {row['p50']:>8.1f} {row['p95']:>8.1f}"
+              f" {row['p99']:>8.1f} {row['error_rate']:>7.1%}  {statuses}")
+    total = sum(row["requests"] for row in rows.values())
+    print(f"\n{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} rps overall")
+
+
+def check_thresholds(rows, thresholds):
+    failures = []
+    for threshold in thresholds:
+        match = THRESHOLD_PATTERN.match(threshold)
+        if match is None:
+            raise SystemExit(f"Invalid threshold {threshold!r}")
+        endpoint, metric, op, limit = match["endpoint"], match["metric"], match["op"], float(match["value"])
+        names = list(rows) if endpoint == "*" else [endpoint]
+        for name in names:
+            if name not in rows:
+                failures.append(f"{threshold}: no requests to {name}")
+                continue
+            value = rows[name][metric]
+            if (op == "<=" and value > limit) or (op == ">=" and value < limit):
+                failures.append(f"{name}: {metric} {value:.3f} violates {op} {limit:g}")
+    return failures
+
+
+async def register(client, username, password, role="guest"):
+    await client.post("/api/register", data={"username": username, "password": password, "role": role})
+    response = await client.post("/api/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def all_rooms(client, headers):
+    rooms, cursor = [], None
+    while True:
+        params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/rooms", params=params, headers=headers)
+        response.raise_for_status()
+        rooms.extend(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return rooms
+
+
+async def dashboard(client, recorder, headers, rooms, stop_at, args):
+    """One dashboard: room list plus a page of room states, revalidated with ETags."""
+    etags = {}
+    watched = random.sample(rooms, min(args.states_per_dashboard, len(rooms)))
+
+    async def get(name, url):
+        request_headers = dict(headers)
+        if url in etags:
+            request_headers["If-None-Match"] = etags[url]
+        response = await recorder.request(client, "GET", name, url, expected=(200, 304), headers=request_headers)
+        if response is not None and "etag" in response.headers:
+            etags[url] = response.headers["etag"]
+
+    await asyncio.sleep(random.uniform(0, args.poll_interval))
+    while time.perf_counter() < stop_at:
+        await get("GET /api/rooms", "/api/rooms")
+        await asyncio.gather(*(get("GET /api/room-states/{id}", f"/api/room-states/{room['id']}") for room in watched))
+        await asyncio.sleep(args.poll_interval)
+
+
+async def login_bursts(client, recorder, users, stop_at, args):
+    while time.perf_counter() < stop_at:
+        burst = [random.choice(users) for _ in range(args.login_burst)]
+        await asyncio.gather(*(
+            recorder.request(client, "POST", "POST /api/token", "/api/token",
+                             data={"username": username, "password": password})
+            for username, password in burst
+        ))
+        await asyncio.sleep(args.login_interval)
+
+
+async def booking_rush(client, recorder, guests, rooms, stop_at, args):
+    """Guests book short stays in a narrow window, so many requests collide."""
+    bookable = [room for room in rooms if room["status"] != "maintenance"][:args.booking_rooms] or rooms
+    first_day = date.today() + timedelta(days=30)
+
+    async def guest(username, headers):
+        while time.perf_counter() < stop_at:
+            check_in = first_day + timedelta(days=random.randrange(args.booking_days))
+            room = random.choice(bookable)
+            await recorder.request(
+                client, "POST", "POST /api/bookings", "/api/bookings", expected=(200, 400), headers=headers,
+                json={
+                    "room_id": room["id"],
+                    "guest_name": username,
+                    "check_in_date": check_in.isoformat(),
+                    "check_out_date": (check_in + timedelta(days=random.randint(1, 3))).isoformat(),
+                },
+            )
+            await recorder.request(client, "GET", "GET /api/bookings", "/api/bookings", headers=headers,
+                                   params={"limit": 20, "sort": "-check_in_date"})
+            await asyncio.sleep(args.think_time)
+
+    await asyncio.gather(*(guest(username, headers) for username, headers in guests))
+
+
+async def bulk_control(client, recorder, headers, stop_at, args):
+    command = "LightOn"
+    while time.perf_counter() < stop_at:
+        await recorder.request(client, "POST", "POST /api/admin/rooms/bulk-control", "/api/admin/rooms/bulk-control",
+                               headers=headers, json={"command": command})
+        command = "LightOff" if command == "LightOn" else "LightOn"
+        await asyncio.sleep(args.bulk_interval)
+
+
+async def run(client, args, scenarios):
+    suffix = uuid.uuid4().hex[:6]
+    password = "Load@123"
+    admin_headers = await register(client, f"load_admin_{suffix}", password, role="admin")
+    guests = []
+    for i in range(max(args.bookers, args.login_users)):
+        username = f"load_guest_{suffix}_{i}"
+        guests.append((username, await register(client, username, password)))
+    rooms = await all_rooms(client, admin_headers)
+    print(f"{len(rooms)} rooms, scenarios: {', '.join(scenarios)}, {args.duration:.0f}s")
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    stop_at = started + args.duration
+    tasks = []
+    if "dashboard" in scenarios:
+        tasks += [dashboard(client, recorder, admin_headers, rooms, stop_at, args) for _ in range(args.dashboards)]
+    if "login" in scenarios:
+        users = [(username, password) for username, _ in guests[:args.login_users]]
+        tasks.append(login_bursts(client, recorder, users, stop_at, args))
+    if "booking" in scenarios:
+        tasks.append(booking_rush(client, recorder, guests[:args.bookers], rooms, stop_at, args))
+    if "bulk" in scenarios:
+        tasks.append(bulk_control(client, recorder, admin_headers, stop_at, args))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return recorder.report(elapsed), elapsed
+
+
+def seed_rooms(server, count):
+    """Extra rooms with controller states, for in-process runs only."""
+    from storage import MemoryStorage, initial_room_state
+
+    db = server.db
+    if not isinstance(db, MemoryStorage):
+        raise SystemExit("--rooms needs the memory storage backend")
+    for i in range(count):
+        room_id = str(uuid.uuid4())
+        db.add_room({
+            "id": room_id,
+            "number": f"{2 + i // 100}{i % 100:02d}",
+            "type": ("standard", "deluxe", "suite")[i % 3],
+            "status": "available",
+            "check_out_date": None,
+        })
+        state = initial_room_state()
+        db.room_states[room_id] = state
+        server.state_cache.put(room_id, state)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load a running server instead of the app in-process")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run (default 20)")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Scenario to run; repeatable (default all)")
+    parser.add_argument("--rooms", type=int, default=0, help="Extra rooms to seed (in-process only)")
+    parser.add_argument("--dashboards", type=int, default=50, help="Polling dashboards (default 50)")
+    parser.add_argument("--states-per-dashboard", type=int, default=20, help="Room states each dashboard polls")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Dashboard poll interval in seconds")
+    parser.add_argument("--login-users", type=int, default=8, help="Distinct users in login bursts")
+    parser.add_argument("--login-burst", type=int, default=16, help="Concurrent logins per burst")
+    parser.add_argument("--login-interval", type=float, default=2.0, help="Seconds between login bursts")
+    parser.add_argument("--bookers", type=int, default=20, help="Guests in the booking rush")
+    parser.add_argument("--booking-rooms", type=int, default=5, help="Rooms the rush competes for")
+    parser.add_argument("--booking-days", type=int, default=14, help="Window of check-in days")
+    parser.add_argument("--think-time", type=float, default=0.1, help="Pause between a guest's bookings")
+    parser.add_argument("--bulk-interval", type=float, default=5.0, help="Seconds between bulk commands")
+    parser.add_argument("--threshold", action="append", default=None,
+                        help=f"ENDPOINT:METRIC<=VALUE or >=VALUE; repeatable (default {' '.join(DEFAULT_THRESHOLDS)})")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    thresholds = args.threshold if args.threshold is not None else list(DEFAULT_THRESHOLDS)
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            rows, elapsed = await run(client, args, scenarios)
+    else:
+        # No poller in-process; serve cached states for up to 10s as it would
+        os.environ.setdefault("TELEMETRY_INTERVAL", "0")
+        os.environ.setdefault("STATE_MAX_AGE", "10")
+        os.environ.setdefault("STORAGE_BACKEND", "memory")
+        async with in_process_client("http://loadtest") as (client, server):
+            if args.rooms:
+                seed_rooms(server, args.rooms)
+            rows, elapsed = await run(client, args, scenarios)
+
+    print_report(rows, elapsed)
+    failures = check_thresholds(rows, thresholds)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"duration": elapsed, "endpoints": rows, "failures": failures}, f, indent=2)
+    if failures:
+        print("\nThreshold failures:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nAll thresholds met")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,83 @@
+"""
+Login throughput benchmark.
+
+Fires concurrent logins at /api/token while a probe keeps requesting an
+unrelated endpoint, and reports login throughput together with the probe's
+latency percentiles. If password hashing blocks the event loop, the probe
+latency climbs to the bcrypt cost; with hashing offloaded it stays flat.
+
+    python login_benchmark.py                      # in-process (ASGI)
+    python login_benchmark.py --url http://localhost:8001
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+
+from bench_utils import in_process_client, percentile
+
+
+async def run(client, duration, concurrency, probe_interval):
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    password = "Bench@123"
+    response = await client.post("/api/register", data={"username": username, "password": password})
+    response.raise_for_status()
+
+    stop_at = time.perf_counter() + duration
+    login_latencies = []
+    probe_latencies = []
+    failures = 0
+
+    async def login_worker():
+        nonlocal failures
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            response = await client.post("/api/token", data={"username": username, "password": password})
+            if response.status_code == 200:
+                login_latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    async def probe():
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            await client.get("/")
+            probe_latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(probe_interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(probe(), *(login_worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"logins           : {len(login_latencies)} ok, {failures} failed in {elapsed:.1f}s")
+    print(f"login throughput : {len(login_latencies) / elapsed:.1f}/s")
+    print(f"login latency    : p50 {percentile(login_latencies, 50) * 1000:.0f}ms"
+          f"  p99 {percentile(login_latencies, 99) * 1000:.0f}ms")
+    print(f"probe latency    : p50 {percentile(probe_latencies, 50) * 1000:.1f}ms"
+          f"  p99 {percentile(probe_latencies, 99) * 1000:.1f}ms"
+          f"  max {max(probe_latencies, default=0) * 1000:.1f}ms  ({len(probe_latencies)} requests)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run (default 10)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent login loops (default 16)")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="Pause between probe requests")
+    args = parser.parse_args()
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            await run(client, args.duration, args.concurrency, args.probe_interval)
+        return
+
+    os.environ.setdefault("TELEMETRY_INTERVAL", "0")
+    async with in_process_client("http://benchmark") as (client, _):
+        await run(client, args.duration, args.concurrency, args.probe_interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
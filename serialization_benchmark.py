@@ -0,0 +1,95 @@
+"""
+Listing serialization benchmark.
+
+Seeds rooms and bookings into the in-memory storage and times full-page
+GET /api/rooms and GET /api/bookings requests in three modes:
+
+    validated   response_model validation per row (FAST_JSON=0, the old path)
+    fast        stored dicts dumped through precompiled TypeAdapters
+    cached      fast, plus the serialized-bytes response cache
+
+    python serialization_benchmark.py              # 10k rows, 20 requests per mode
+    python serialization_benchmark.py --rows 50000 --requests 5
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import date, timedelta
+
+from bench_utils import in_process_client, percentile
+
+
+async def seed(server, rows):
+    db = server.db
+    start = date(2020, 1, 1)
+    for i in range(rows):
+        db.add_room({
+            "id": str(uuid.uuid4()),
+            "number": f"{1000 + i}",
+            "type": ("standard", "deluxe", "suite")[i % 3],
+            "status": "available",
+            "check_out_date": None,
+        })
+    room_ids = [room["id"] for room in db.rooms]
+    for i in range(rows):
+        check_in = start + timedelta(days=i % 2000)
+        await db.add_booking({
+            "id": str(uuid.uuid4()),
+            "room_id": room_ids[i % len(room_ids)],
+            "room_number": f"{1000 + i % rows}",
+            "guest_name": f"guest{i % 500}",
+            "check_in_date": check_in.isoformat(),
+            "check_out_date": (check_in + timedelta(days=2)).isoformat(),
+            "status": "confirmed",
+            "created_at": check_in.isoformat(),
+        })
+
+
+async def run(client, server, headers, rows, requests):
+    print(f"{'mode':<10} {'endpoint':<14} {'rows':>6} {'p50':>9} {'p99':>9} {'rows/s':>11}")
+    results = {}
+    for mode in ("validated", "fast", "cached"):
+        server.FAST_JSON = mode != "validated"
+        server.response_cache.max_entries = 256 if mode == "cached" else 0
+        server.response_cache.clear()
+        for path in ("/api/rooms", "/api/bookings"):
+            latencies = []
+            count = 0
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = await client.get(path, params={"limit": rows}, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+                count = len(response.json())
+            p50 = percentile(latencies, 50)
+            results[(mode, path)] = p50
+            print(f"{mode:<10} {path:<14} {count:>6} {p50 * 1000:>7.1f}ms {percentile(latencies, 99) * 1000:>7.1f}ms"
+                  f" {count / p50 if p50 else 0:>11,.0f}")
+    for path in ("/api/rooms", "/api/bookings"):
+        before = results[("validated", path)]
+        print(f"{path}: fast {before / results[('fast', path)]:.1f}x, cached {before / results[('cached', path)]:.1f}x faster than validated")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Rooms and bookings to seed (default 10000)")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per mode and endpoint (default 20)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TELEMETRY_INTERVAL", "0")
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["MAX_PAGE_SIZE"] = str(max(args.rows, 1000))
+    async with in_process_client("http://benchmark", timeout=120) as (client, server):
+        await seed(server, args.rows)
+        username = f"bench_{uuid.uuid4().hex[:8]}"
+        await client.post("/api/register", data={"username": username, "password": "Bench@123", "role": "admin"})
+        response = await client.post("/api/token", data={"username": username, "password": "Bench@123"})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        await run(client, server, headers, args.rows, args.requests)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())